@@ -0,0 +1,82 @@
+"""
+Role-based access by URL section.
+
+The employee and librarian apps are mounted under their own URL prefixes
+(ROLE_ACCESS). RoleAccessMiddleware admits a request to a section only for
+sessions of the matching user_type, so the views need no login or role
+checks of their own.
+
+The role is stored in the session at login next to the user id, so
+routing needs no query for the user row. request.user stays lazy and is
+loaded only by views that need more than request.user_id (e.g. the
+username). Every ROLE_RECHECK_SECONDS the user is loaded once anyway, to
+apply Django's session checks: a changed password, a deactivated or
+deleted account ends the session within that delay.
+"""
+import time
+from django.conf import settings
+from django.contrib.auth import SESSION_KEY, get_user_model
+from django.contrib.auth.signals import user_logged_in
+from django.contrib.auth.views import redirect_to_login
+from django.dispatch import receiver
+from django.shortcuts import redirect
+
+ROLE_SESSION_KEY = '_auth_user_role'
+ROLE_CHECKED_SESSION_KEY = '_auth_user_role_checked'
+
+
+def remember_role(request, user):
+    request.session[ROLE_SESSION_KEY] = user.user_type
+    request.session[ROLE_CHECKED_SESSION_KEY] = time.time()
+    return user.user_type
+
+
+@receiver(user_logged_in)
+def remember_role_on_login(sender, request, user, **kwargs):
+    remember_role(request, user)
+
+
+def session_role(request):
+    """(role, user_id) of the logged-in session, or (None, None)."""
+    session = request.session
+    if SESSION_KEY not in session:
+        return None, None
+    role = session.get(ROLE_SESSION_KEY)
+    checked = session.get(ROLE_CHECKED_SESSION_KEY, 0)
+    if role is None or time.time() - checked > settings.ROLE_RECHECK_SECONDS:
+        # Sessions from before the role was stored, or due for a recheck
+        user = request.user
+        if not user.is_authenticated:
+            return None, None
+        return remember_role(request, user), user.pk
+    return role, get_user_model()._meta.pk.to_python(session[SESSION_KEY])
+
+
+class RoleAccessMiddleware:
+    """
+    Sets request.role and request.user_id for the sections of ROLE_ACCESS
+    and sends other visitors to the section's login page (anonymous ones
+    with ?next=). Must come after AuthenticationMiddleware.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        return self.get_response(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        match = request.resolver_match
+        required = settings.ROLE_ACCESS.get(match.route.split('/', 1)[0])
+        if required is None or match.url_name in settings.ROLE_ACCESS_EXEMPT:
+            return None
+
+        login_url = settings.ROLE_LOGIN_URLS[required]
+        role, user_id = session_role(request)
+        if user_id is None:
+            return redirect_to_login(request.get_full_path(), login_url)
+        if role != required:
+            return redirect(login_url)
+        request.role = role
+        request.user_id = user_id
+        return None
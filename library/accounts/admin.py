@@ -1,5 +1,6 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
+from rental.pagination import EstimatedCountPaginator
 from .models import CustomUser, Employee, Librarian
 
 class CustomUserAdmin(UserAdmin):
@@ -7,6 +8,8 @@ class CustomUserAdmin(UserAdmin):
     list_filter = ('user_type', 'is_active', 'is_staff')
     search_fields = ('username',)
     ordering = ('username',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     
     fieldsets = (
         (None, {'fields': ('username', 'password')}),
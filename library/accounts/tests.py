@@ -1,3 +1,37 @@
-from django.test import TestCase
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from .access import ROLE_SESSION_KEY
+from .models import Employee, Librarian
 
-# Create your tests here.
+
+class RoleAccessTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.employee = Employee.objects.create_user(username='emp', password='pw12345!x')
+        cls.librarian = Librarian.objects.create_user(username='lib', password='pw12345!x')
+
+    def test_anonymous_is_sent_to_section_login(self):
+        response = self.client.get(reverse('loan_history'))
+        self.assertRedirects(response, '/accounts/employee/login/?next=/rental/loan-history/', fetch_redirect_response=False)
+        response = self.client.get(reverse('reg_index'))
+        self.assertRedirects(response, '/accounts/librarian/login/?next=/registration_book/', fetch_redirect_response=False)
+
+    def test_wrong_role_is_redirected(self):
+        self.client.force_login(self.librarian)
+        self.assertRedirects(self.client.get(reverse('rental_index')), '/accounts/employee/login/', fetch_redirect_response=False)
+        self.assertEqual(self.client.get(reverse('reg_index')).status_code, 200)
+
+    def test_role_is_read_from_session(self):
+        self.client.force_login(self.employee)
+        self.assertEqual(self.client.session[ROLE_SESSION_KEY], 'employee')
+        # The user row is not loaded: only the session is read
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(reverse('rental_index')).status_code, 200)
+
+    def test_recheck_ends_session_after_password_change(self):
+        self.client.force_login(self.employee)
+        self.employee.set_password('changed1!x')
+        self.employee.save()
+        with override_settings(ROLE_RECHECK_SECONDS=-1):
+            response = self.client.get(reverse('rental_index'))
+        self.assertRedirects(response, '/accounts/employee/login/?next=/rental/', fetch_redirect_response=False)
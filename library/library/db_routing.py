@@ -0,0 +1,79 @@
+"""
+Read-replica routing.
+
+When a 'replica' database is configured (DATABASE_REPLICA_URL), GET/HEAD
+requests to the views named in DATABASE_REPLICA_VIEWS (search, copy detail,
+loan history) read from it; everything else, and every write, uses
+'default'. ReplicaRoutingMiddleware marks the request and ReplicaRouter
+picks the alias from that mark, so the views need no `.using()` calls.
+
+Replicas lag behind the primary. After a request that may have written
+(any non-GET/HEAD method) the client gets a short-lived cookie that keeps
+its reads on the primary for DATABASE_REPLICA_PIN_SECONDS, so a user never
+misses their own loan or reservation.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+REPLICA_ALIAS = 'replica'
+PIN_COOKIE = 'db_primary'
+SAFE_METHODS = ('GET', 'HEAD')
+
+_use_replica = ContextVar('use_replica', default=False)
+
+
+@contextmanager
+def read_from_replica(enabled=True):
+    """Route the reads of the enclosed block to the replica (if configured)."""
+    token = _use_replica.set(enabled)
+    try:
+        yield
+    finally:
+        _use_replica.reset(token)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if _use_replica.get() and REPLICA_ALIAS in settings.DATABASES:
+            return REPLICA_ALIAS
+        return None
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both aliases hold the same data
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db != REPLICA_ALIAS
+
+
+class ReplicaRoutingMiddleware:
+    def __init__(self, get_response):
+        if REPLICA_ALIAS not in settings.DATABASES:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.views = set(settings.DATABASE_REPLICA_VIEWS)
+        self.pin_seconds = settings.DATABASE_REPLICA_PIN_SECONDS
+
+    def __call__(self, request):
+        token = _use_replica.set(False)
+        try:
+            response = self.get_response(request)
+        finally:
+            _use_replica.reset(token)
+        if request.method not in SAFE_METHODS and self.pin_seconds:
+            response.set_cookie(PIN_COOKIE, '1', max_age=self.pin_seconds, httponly=True, samesite='Lax')
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if (
+            request.method in SAFE_METHODS
+            and PIN_COOKIE not in request.COOKIES
+            and request.resolver_match.url_name in self.views
+        ):
+            _use_replica.set(True)
+        return None
@@ -0,0 +1,139 @@
+"""
+Per-request SQL instrumentation (opt-in with SQL_INSTRUMENTATION = True).
+
+Every statement run while a request is handled is timed through a database
+execute wrapper, so it works with DEBUG off. Per request the middleware
+records the query count, the total database time, the slowest statements and
+statements repeated with the same shape (an N+1 pattern). The result is
+logged to the 'library.sql' logger, sent as a Server-Timing header and
+aggregated per view name.
+
+SQL_QUERY_BUDGETS maps view names to a maximum number of queries. A request
+over budget logs a warning, or raises QueryBudgetExceeded when
+SQL_QUERY_BUDGET_STRICT is on (the test client re-raises it, failing the test).
+"""
+import logging
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import ExitStack
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+logger = logging.getLogger('library.sql')
+
+_IN_LIST = re.compile(r'IN \((?:%s, )*%s\)')
+_WHITESPACE = re.compile(r'\s+')
+
+_stats_lock = threading.Lock()
+_view_stats = {}
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def fingerprint(sql):
+    """Statement shape: parameters are already placeholders; collapse IN lists."""
+    return _IN_LIST.sub('IN (...)', _WHITESPACE.sub(' ', sql).strip())
+
+
+class QueryRecorder:
+    """execute_wrapper that records (sql, milliseconds) for every statement."""
+
+    def __init__(self):
+        self.statements = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.statements.append((sql, (time.perf_counter() - started) * 1000))
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    @property
+    def total_ms(self):
+        return sum(ms for _, ms in self.statements)
+
+    def slowest(self, limit):
+        return sorted(self.statements, key=lambda statement: statement[1], reverse=True)[:limit]
+
+    def duplicates(self):
+        """{fingerprint: times run} for statement shapes run more than once."""
+        counts = Counter(fingerprint(sql) for sql, _ in self.statements)
+        return {sql: count for sql, count in counts.items() if count > 1}
+
+
+def view_stats():
+    """Aggregated {view_name: {...}} for this process."""
+    with _stats_lock:
+        return {name: dict(stats) for name, stats in _view_stats.items()}
+
+
+def reset_view_stats():
+    with _stats_lock:
+        _view_stats.clear()
+
+
+def _record_view(view_name, recorder):
+    with _stats_lock:
+        stats = _view_stats.setdefault(view_name, {'requests': 0, 'queries': 0, 'max_queries': 0, 'db_ms': 0.0})
+        stats['requests'] += 1
+        stats['queries'] += recorder.count
+        stats['max_queries'] = max(stats['max_queries'], recorder.count)
+        stats['db_ms'] += recorder.total_ms
+
+
+def query_budget(view_name):
+    budgets = getattr(settings, 'SQL_QUERY_BUDGETS', {})
+    return budgets.get(view_name, getattr(settings, 'SQL_QUERY_BUDGET_DEFAULT', None))
+
+
+class SQLInstrumentationMiddleware:
+    def __init__(self, get_response):
+        if not getattr(settings, 'SQL_INSTRUMENTATION', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.slowest = getattr(settings, 'SQL_INSTRUMENTATION_SLOWEST', 5)
+
+    def __call__(self, request):
+        recorder = QueryRecorder()
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(recorder))
+            response = self.get_response(request)
+        total_ms = (time.perf_counter() - started) * 1000
+
+        match = getattr(request, 'resolver_match', None)
+        view_name = (match.view_name if match else None) or request.path
+        _record_view(view_name, recorder)
+
+        response['Server-Timing'] = (
+            f'db;dur={recorder.total_ms:.1f};desc="{recorder.count} queries", '
+            f'total;dur={total_ms:.1f}'
+        )
+
+        duplicates = recorder.duplicates()
+        lines = [
+            f"{request.method} {request.path} ({view_name}): {recorder.count} queries, "
+            f"{recorder.total_ms:.1f}ms db, {total_ms:.1f}ms total, "
+            f"{sum(duplicates.values()) - len(duplicates)} duplicate(s)"
+        ]
+        lines += [f"  {ms:.1f}ms {sql}" for sql, ms in recorder.slowest(self.slowest)]
+        lines += [f"  x{count} {sql}" for sql, count in sorted(duplicates.items(), key=lambda item: -item[1])]
+        logger.info('\n'.join(lines))
+
+        budget = query_budget(view_name)
+        if budget is not None and recorder.count > budget:
+            message = f"{view_name} ran {recorder.count} queries (budget {budget})"
+            if getattr(settings, 'SQL_QUERY_BUDGET_STRICT', False):
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+        return response
@@ -14,3 +14,10 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'library.settings')
 
 application = get_wsgi_application()
+
+from django.conf import settings  # noqa: E402  (needs the settings configured above)
+
+if settings.SCHEDULER_MODE == 'leader':
+    from rental.leader import start_on_first_request
+
+    application = start_on_first_request(application)
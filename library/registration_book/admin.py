@@ -1,4 +1,5 @@
 from django.contrib import admin
+from rental.pagination import EstimatedCountPaginator
 
 # Register your models here.
 from .models import Storage, BookInstance, Book
@@ -6,9 +7,12 @@ from .models import Storage, BookInstance, Book
 @admin.register(Book)
 class BookAdmin(admin.ModelAdmin):
     # Display these fields in the list view of all storages
-    list_display = ('title', 'author')
-    # Add a search bar to search by these fields
-    search_fields = ('title',)
+    list_display = ('title', 'author', 'available_copies', 'total_copies')
+    readonly_fields = ('available_copies', 'total_copies')
+    # Add a search bar to search by these fields (also used by the book autocompletes)
+    search_fields = ('title', '=isbn')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
 @admin.register(BookInstance)
 class BookInstanceAdmin(admin.ModelAdmin):
@@ -16,8 +20,19 @@ class BookInstanceAdmin(admin.ModelAdmin):
     list_display = ('book_instance_id', 'book_title', 'storage')
     # Make the 'storage' field a searchable dropdown instead of a simple text input
     raw_id_fields = ('storage',)
-    @admin.display(description='Book Title')
+    autocomplete_fields = ('book',)
+    # Used by the Loan / Reservation copy autocompletes
+    search_fields = ('book__title', '=book__isbn')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    @admin.display(description='Book Title', ordering='book__title')
     def book_title(self, obj):
         return obj.book.title
+
+    def get_queryset(self, request):
+        # __str__ shows the book and the storage; unlike list_select_related
+        # this also covers the autocomplete results
+        return super().get_queryset(request).select_related('book', 'storage')
     
-admin.site.register(Storage)
\ No newline at end of file
+admin.site.register(Storage)
@@ -0,0 +1,198 @@
+"""
+Bulk ISBN import: stream a CSV / barcode-scanner dump of `isbn[,storage]`
+lines and register one BookInstance per line.
+
+Rows are processed in chunks. Metadata for a chunk is resolved with one
+batched OpenBD call (outside any transaction), then the Book, Storage and
+BookInstance rows, the failure report and the job's progress are written
+in a single transaction per chunk. An interrupted import therefore resumes
+exactly after the last committed chunk.
+
+Uploads are imported by the task worker (registration_book.import_isbns),
+which retries a failed run from the same point.
+"""
+import csv
+import itertools
+from collections import Counter
+from django.db import transaction
+from django.db.models import F, Q
+from .cache import invalidate_storages
+from .models import Book, BookImportFailure, BookImportJob, BookInstance, Storage
+from .openbd import DEFAULT_IMAGE_URL, get_client
+from .search import index_books
+
+HEADER_NAMES = ('isbn', 'isbn13', 'isbn-13')
+
+
+def normalize_isbn(value):
+    """13-digit ISBN with a valid check digit (ISBN-10 is converted), or None."""
+    digits = ''.join(ch for ch in value if ch not in '- ').upper()
+    if len(digits) == 10 and digits[:9].isdigit() and (digits[9].isdigit() or digits[9] == 'X'):
+        digits = '978' + digits[:9]
+        total = sum(int(d) * (1 if i % 2 == 0 else 3) for i, d in enumerate(digits))
+        digits += str((10 - total % 10) % 10)
+    if len(digits) != 13 or not digits.isdigit():
+        return None
+    total = sum(int(d) * (1 if i % 2 == 0 else 3) for i, d in enumerate(digits[:12]))
+    if (10 - total % 10) % 10 != int(digits[12]):
+        return None
+    return digits
+
+
+def read_rows(lines, default_storage=''):
+    """
+    Yield (line_number, isbn, storage_name) from an iterable of text lines.
+    The delimiter (comma or tab) is taken from the first line; a header row
+    and blank lines are skipped.
+    """
+    lines = iter(lines)
+    first = next(lines, None)
+    if first is None:
+        return
+    delimiter = '\t' if '\t' in first else ','
+    reader = csv.reader(itertools.chain([first], lines), delimiter=delimiter)
+    for row in reader:
+        cells = [cell.strip() for cell in row]
+        if not any(cells):
+            continue
+        if reader.line_num == 1 and cells[0].lower() in HEADER_NAMES:
+            continue
+        storage_name = cells[1] if len(cells) > 1 and cells[1] else default_storage
+        yield reader.line_num, cells[0], storage_name
+
+
+def import_isbns(lines, job, chunk_size=200, client=None):
+    """Import every row after job.processed_rows; returns the updated job."""
+    client = client or get_client()
+    if job.status != 'running':
+        # Resuming a failed (or re-running a completed) import
+        BookImportJob.objects.filter(pk=job.pk).update(status='running')
+        job.status = 'running'
+    chunk = []
+    try:
+        for row in read_rows(lines, job.default_storage):
+            if row[0] <= job.processed_rows:
+                continue
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                import_chunk(job, chunk, client)
+                chunk = []
+        if chunk:
+            import_chunk(job, chunk, client)
+    except Exception:
+        BookImportJob.objects.filter(pk=job.pk).update(status='failed')
+        job.status = 'failed'
+        raise
+
+    BookImportJob.objects.filter(pk=job.pk).update(status='completed')
+    job.status = 'completed'
+    return job
+
+
+def _book_from_info(isbn, info):
+    return Book(
+        isbn=isbn,
+        title=info['title'][:255],
+        author=(info['author'] or '')[:255],
+        publish_date=(info['publish_date'] or '')[:15],
+        subject=(info['subject'] or '')[:255],
+        image_url=(info['image_url'] or DEFAULT_IMAGE_URL)[:255],
+    )
+
+
+def import_chunk(job, rows, client):
+    failures = []
+    valid = []
+    for line_number, raw_isbn, storage_name in rows:
+        isbn = normalize_isbn(raw_isbn)
+        if isbn is None:
+            failures.append(BookImportFailure(job=job, line_number=line_number, isbn=raw_isbn[:32], reason='Invalid ISBN'))
+        elif not storage_name:
+            failures.append(BookImportFailure(job=job, line_number=line_number, isbn=isbn, reason='No storage location'))
+        else:
+            valid.append((line_number, isbn, storage_name[:255]))
+
+    # Network lookups happen before the transaction is opened
+    isbns = {isbn for _, isbn, _ in valid}
+    known = set(Book.objects.filter(isbn__in=isbns).values_list('isbn', flat=True))
+    metadata = client.get_many(sorted(isbns - known)) if isbns - known else {}
+
+    with transaction.atomic():
+        books = {book.isbn: book for book in Book.objects.filter(isbn__in=isbns).only('book_id', 'isbn')}
+
+        # Books OpenBD described that are not in the catalog yet
+        failed_isbns = {}
+        candidates = {}
+        for isbn in isbns - set(books):
+            if isbn not in metadata:
+                failed_isbns[isbn] = 'Metadata lookup failed'
+            elif metadata[isbn] is None:
+                failed_isbns[isbn] = 'Not found in OpenBD'
+            elif not metadata[isbn].get('title'):
+                failed_isbns[isbn] = 'OpenBD record has no title'
+            else:
+                candidates[isbn] = _book_from_info(isbn, metadata[isbn])
+
+        # (title, author) is unique: reuse an existing book with the same pair
+        if candidates:
+            pair_filter = Q()
+            for book in candidates.values():
+                pair_filter |= Q(title=book.title, author=book.author)
+            existing_pairs = {(b.title, b.author): b for b in Book.objects.filter(pair_filter).only('book_id', 'title', 'author')}
+        else:
+            existing_pairs = {}
+
+        for isbn, book in candidates.items():
+            pair = (book.title, book.author)
+            books[isbn] = existing_pairs.setdefault(pair, book)
+
+        # New books are inserted with their counters already set
+        copies = Counter(isbn for _, isbn, _ in valid if isbn not in failed_isbns)
+        new_books = {}
+        for isbn, count in copies.items():
+            book = books[isbn]
+            if book.pk is None:
+                new_books[id(book)] = book
+                book.total_copies += count
+                book.available_copies += count
+        created = Book.objects.bulk_create(new_books.values(), batch_size=500)
+        index_books(created)
+
+        # Storage names are not unique; reuse the oldest one with the name
+        names = {name for _, _, name in valid}
+        storages = {}
+        for storage in Storage.objects.filter(storage_name__in=names).order_by('-storage_id'):
+            storages[storage.storage_name] = storage
+        missing = [Storage(storage_name=name) for name in names if name not in storages]
+        for storage in Storage.objects.bulk_create(missing):
+            storages[storage.storage_name] = storage
+        if missing:
+            invalidate_storages()
+
+        instances = []
+        for line_number, isbn, storage_name in valid:
+            if isbn in failed_isbns:
+                failures.append(BookImportFailure(job=job, line_number=line_number, isbn=isbn, reason=failed_isbns[isbn]))
+                continue
+            instances.append(BookInstance(book=books[isbn], storage=storages[storage_name]))
+        BookInstance.objects.bulk_create(instances, batch_size=500)
+
+        # Counters of books created above were set at insert time
+        new_ids = {book.book_id for book in created}
+        per_book = Counter(instance.book.book_id for instance in instances)
+        for book_id, count in per_book.items():
+            if book_id not in new_ids:
+                Book.objects.adjust_copy_counts(book_id, total=count, available=count)
+
+        BookImportFailure.objects.bulk_create(failures)
+        BookImportJob.objects.filter(pk=job.pk).update(
+            processed_rows=rows[-1][0],
+            created_copies=F('created_copies') + len(instances),
+            created_books=F('created_books') + len(created),
+            failed_rows=F('failed_rows') + len(failures),
+        )
+
+    job.processed_rows = rows[-1][0]
+    job.created_copies += len(instances)
+    job.created_books += len(created)
+    job.failed_rows += len(failures)
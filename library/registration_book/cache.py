@@ -0,0 +1,223 @@
+"""
+Catalog read cache.
+
+Book metadata, the storage list and each book's copy list are read on every
+search and detail page but change rarely. They are kept in the 'catalog'
+cache (settings.CACHES: per-process locmem by default, a file or database
+cache when processes should share it) under versioned keys: each entry's
+key embeds version numbers stored in the same cache, and a write bumps the
+version instead of deleting entries, so everything derived from a book (or
+from the storage list) is invalidated with one incr. Orphaned entries
+expire after CATALOG_CACHE_TIMEOUT.
+
+Versions are bumped by the post_save/post_delete receivers in
+registration_book.signals, by BookManager's counter UPDATEs and, for bulk
+writes that send no signals, by calling invalidate_all().
+
+Cached model instances are detached copies: treat them as read-only.
+"""
+import time
+from collections import Counter
+from functools import partial
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+CACHE_ALIAS = 'catalog'
+# Misses read the primary: rows from a lagging replica would be cached under
+# the version that was just bumped (see library.db_routing)
+PRIMARY = DEFAULT_DB_ALIAS
+
+_stats = Counter()
+
+
+def catalog_cache():
+    return caches[CACHE_ALIAS]
+
+
+def _new_version():
+    # Time based, so a version key that was evicted never restarts at a
+    # number whose entries may still be cached
+    return int(time.time() * 1000)
+
+
+def _versions(names):
+    """Current version of each name, in order; missing versions are created."""
+    cache = catalog_cache()
+    keys = [f'catalog:version:{name}' for name in names]
+    found = cache.get_many(keys)
+    for key in keys:
+        if key not in found:
+            cache.add(key, _new_version(), timeout=None)
+            found[key] = cache.get(key)
+    return [found[key] for key in keys]
+
+
+def _bump(name):
+    cache = catalog_cache()
+    key = f'catalog:version:{name}'
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, _new_version(), timeout=None)
+
+
+def bump_version(name):
+    """
+    Invalidate every entry keyed on version `name`, now and again when the
+    current transaction commits: a concurrent request may re-cache the
+    pre-commit rows in between.
+    """
+    _bump(name)
+    transaction.on_commit(partial(_bump, name))
+
+
+def invalidate_book(book_id):
+    bump_version(f'book:{book_id}')
+
+
+def invalidate_copies(book_id):
+    bump_version(f'copies:{book_id}')
+
+
+def invalidate_storages():
+    bump_version('storages')
+
+
+def invalidate_all():
+    bump_version('catalog')
+
+
+def _record(kind, hits, misses):
+    _stats[f'{kind}_hits'] += hits
+    _stats[f'{kind}_misses'] += misses
+
+
+def cache_stats():
+    """Hit/miss counters of this process since start (or the last reset)."""
+    kinds = sorted({key.rsplit('_', 1)[0] for key in _stats})
+    stats = {kind: {'hits': _stats[f'{kind}_hits'], 'misses': _stats[f'{kind}_misses']} for kind in kinds}
+    hits = sum(kind['hits'] for kind in stats.values())
+    misses = sum(kind['misses'] for kind in stats.values())
+    return {
+        'backend': settings.CACHES[CACHE_ALIAS]['BACKEND'],
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': hits / (hits + misses) if hits + misses else None,
+        'kinds': stats,
+    }
+
+
+def reset_cache_stats():
+    _stats.clear()
+
+
+def get_books(book_ids):
+    """{book_id: Book} for the given ids (search_vector deferred); one query for all misses."""
+    from .models import Book
+
+    book_ids = list(dict.fromkeys(book_ids))
+    if not book_ids:
+        return {}
+    cache = catalog_cache()
+    versions = _versions(['catalog'] + [f'book:{book_id}' for book_id in book_ids])
+    keys = {
+        book_id: f'catalog:book:{book_id}:{versions[0]}.{version}'
+        for book_id, version in zip(book_ids, versions[1:])
+    }
+    found = cache.get_many(keys.values())
+    books = {book_id: found[key] for book_id, key in keys.items() if key in found}
+
+    missing = [book_id for book_id in book_ids if book_id not in books]
+    if missing:
+        fetched = {book.pk: book for book in Book.objects.using(PRIMARY).filter(pk__in=missing).defer('search_vector')}
+        cache.set_many({keys[book_id]: book for book_id, book in fetched.items()}, settings.CATALOG_CACHE_TIMEOUT)
+        books.update(fetched)
+    _record('book', len(book_ids) - len(missing), len(missing))
+    return books
+
+
+def get_book(book_id):
+    return get_books([book_id]).get(book_id)
+
+
+def get_storages(required=()):
+    """
+    {storage_id: Storage} for every storage. Storages created without a
+    signal (bulk_create) are picked up when listed in `required`.
+    """
+    from .models import Storage
+
+    cache = catalog_cache()
+    catalog_version, version = _versions(['catalog', 'storages'])
+    key = f'catalog:storages:{catalog_version}.{version}'
+    storages = cache.get(key)
+    if storages is not None and not set(required) - storages.keys():
+        _record('storages', 1, 0)
+        return storages
+
+    storages = {storage.pk: storage for storage in Storage.objects.using(PRIMARY).order_by('storage_name', 'storage_id')}
+    cache.set(key, storages, settings.CATALOG_CACHE_TIMEOUT)
+    _record('storages', 0, 1)
+    return storages
+
+
+def get_copies(book_id):
+    """
+    Every copy of a book, ordered by id, with .book and .storage attached
+    from the cache. One query on a miss.
+    """
+    from .models import BookInstance
+
+    cache = catalog_cache()
+    versions = _versions(['catalog', f'copies:{book_id}'])
+    key = f'catalog:copies:{book_id}:{versions[0]}.{versions[1]}'
+    rows = cache.get(key)
+    if rows is None:
+        rows = list(
+            BookInstance.objects.using(PRIMARY).filter(book_id=book_id)
+            .order_by('book_instance_id')
+            .values_list('book_instance_id', 'storage_id')
+        )
+        cache.set(key, rows, settings.CATALOG_CACHE_TIMEOUT)
+        _record('copies', 0, 1)
+    else:
+        _record('copies', 1, 0)
+    # from_db takes the values in the model's field order
+    fields = ['book_instance_id', 'storage_id', 'book_id']
+    return attach_catalog([BookInstance.from_db(None, fields, (pk, storage_id, book_id)) for pk, storage_id in rows])
+
+
+def get_copy_book_id(book_instance_id):
+    """The book_id of a copy, or None if it does not exist. One query on a miss."""
+    from .models import BookInstance
+
+    cache = catalog_cache()
+    catalog_version, = _versions(['catalog'])
+    key = f'catalog:copy:{book_instance_id}:{catalog_version}'
+    book_id = cache.get(key)
+    if book_id is None:
+        book_id = BookInstance.objects.using(PRIMARY).filter(pk=book_instance_id).values_list('book_id', flat=True).first()
+        if book_id is not None:
+            cache.set(key, book_id, settings.CATALOG_CACHE_TIMEOUT)
+        _record('copy', 0, 1)
+    else:
+        _record('copy', 1, 0)
+    return book_id
+
+
+def forget_copy(book_instance_id):
+    catalog_cache().delete_many([
+        f'catalog:copy:{book_instance_id}:{version}' for version in _versions(['catalog'])
+    ])
+
+
+def attach_catalog(instances):
+    """Set .book and .storage on BookInstances from the cache; returns the list."""
+    instances = list(instances)
+    books = get_books(instance.book_id for instance in instances)
+    storages = get_storages(required={instance.storage_id for instance in instances})
+    for instance in instances:
+        instance.book = books[instance.book_id]
+        instance.storage = storages[instance.storage_id]
+    return instances
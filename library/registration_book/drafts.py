@@ -0,0 +1,38 @@
+"""
+ISBN registration wizard state.
+
+The OpenBD record being confirmed is kept in the default cache for
+ISBN_DRAFT_TIMEOUT seconds, keyed by librarian and ISBN, instead of in the
+session, so the session stays small (and fits a signed cookie). The ISBN
+travels in the confirmation URL. A draft missing from the cache (expired,
+or written to another process's local memory) is rebuilt from the OpenBD
+lookup cache.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from .openbd import get_client
+
+
+def _key(user_id, isbn):
+    return f'isbn-draft:{user_id}:{isbn}'
+
+
+def save_draft(user_id, isbn, book_data):
+    cache.set(_key(user_id, isbn), {**book_data, 'isbn': isbn}, settings.ISBN_DRAFT_TIMEOUT)
+
+
+def load_draft(user_id, isbn):
+    """The book data to confirm for `isbn`, or None."""
+    if not isbn:
+        return None
+    book_data = cache.get(_key(user_id, isbn))
+    if book_data is None:
+        found, book_data = get_client().cached(isbn)
+        if not (found and book_data):
+            return None
+        book_data = {**book_data, 'isbn': isbn}
+    return book_data
+
+
+def delete_draft(user_id, isbn):
+    cache.delete(_key(user_id, isbn))
@@ -97,7 +97,7 @@ class ManualBookForm(forms.ModelForm):
     
     storage = forms.CharField(
         label="Storage Location",
-        widget=forms.TextInput(attrs={"class": "form-control", "placeholder": "Enter or select a storage"})
+        widget=forms.TextInput(attrs={"class": "form-control", "placeholder": "Enter or select a storage", "list": "storage-options"})
     )
     
     def __init__(self, *args, **kwargs):
@@ -154,3 +154,24 @@ class BookConfirmationForm(forms.Form):
         data = self.cleaned_data.get('publish_date', '')
         validate_publish_date(data)
         return data
+
+
+class BulkImportForm(forms.Form):
+    file = forms.FileField(
+        label='ISBN list (CSV or scanner dump)',
+        help_text='One copy per line: ISBN[,storage location]. A header row is optional.',
+        widget=forms.ClearableFileInput(attrs={'class': 'form-control', 'accept': '.csv,.txt,.tsv'})
+    )
+    default_storage = forms.CharField(
+        label='Default storage location',
+        max_length=255,
+        required=False,
+        help_text='Used for lines without a storage location.',
+        widget=forms.TextInput(attrs={'class': 'form-control'})
+    )
+    resume_job = forms.IntegerField(
+        label='Resume import ID',
+        required=False,
+        help_text='Re-upload the same file to continue an interrupted import.',
+        widget=forms.NumberInput(attrs={'class': 'form-control'})
+    )
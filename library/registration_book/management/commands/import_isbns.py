@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+from registration_book.bulk_import import import_isbns
+from registration_book.models import BookImportJob
+
+
+class Command(BaseCommand):
+    help = 'Bulk-register book copies from a CSV or barcode-scanner dump of ISBN[,storage] lines'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV / TSV / plain text file, one copy per line')
+        parser.add_argument('--storage', default='', help='Storage location for lines without one')
+        parser.add_argument('--job', type=int, help='Resume the given import job instead of starting a new one')
+        parser.add_argument('--chunk-size', type=int, default=200)
+
+    def handle(self, *args, **options):
+        if options['job']:
+            try:
+                job = BookImportJob.objects.get(pk=options['job'])
+            except BookImportJob.DoesNotExist:
+                raise CommandError(f"Import job {options['job']} does not exist")
+            self.stdout.write(f"Resuming import {job.job_id} after line {job.processed_rows}")
+        else:
+            job = BookImportJob.objects.create(source_name=options['path'], default_storage=options['storage'])
+            self.stdout.write(f"Started import {job.job_id}")
+
+        try:
+            with open(options['path'], encoding='utf-8-sig', newline='') as f:
+                import_isbns(f, job, chunk_size=options['chunk_size'])
+        except Exception as e:
+            raise CommandError(
+                f"Import {job.job_id} stopped after line {job.processed_rows}: {e}. "
+                f"Re-run with --job {job.job_id} to resume."
+            )
+
+        for failure in job.failures.all():
+            self.stdout.write(self.style.WARNING(f"Line {failure.line_number} ({failure.isbn}): {failure.reason}"))
+        self.stdout.write(self.style.SUCCESS(
+            f"Import {job.job_id} completed: {job.created_copies} copies, "
+            f"{job.created_books} new books, {job.failed_rows} failed rows"
+        ))
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from registration_book.models import Book
+from registration_book.search import index_books
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the catalog search index (Book.search_vector) for every book'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        books = Book.objects.only('book_id', 'title', 'author', 'subject', 'isbn').order_by('book_id')
+
+        indexed = 0
+        batch = []
+        for book in books.iterator(chunk_size=batch_size):
+            batch.append(book)
+            if len(batch) >= batch_size:
+                index_books(batch)
+                indexed += len(batch)
+                batch = []
+        if batch:
+            index_books(batch)
+            indexed += len(batch)
+
+        self.stdout.write(self.style.SUCCESS(f"Indexed {indexed} books"))
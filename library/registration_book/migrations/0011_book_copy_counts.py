@@ -0,0 +1,28 @@
+# Generated by Django 5.2.2 on 2026-10-18 03:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('registration_book', '0010_alter_book_unique_together'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='available_copies',
+            field=models.PositiveIntegerField(default=0, verbose_name='貸出可能数'),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='total_copies',
+            field=models.PositiveIntegerField(default=0, verbose_name='蔵書数'),
+        ),
+        migrations.AlterField(
+            model_name='book',
+            name='subject',
+            field=models.CharField(blank=True, max_length=255, null=True, verbose_name='ジャンル'),
+        ),
+    ]
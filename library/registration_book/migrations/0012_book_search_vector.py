@@ -0,0 +1,53 @@
+# Generated by Django 5.2.2 on 2026-10-18 04:10
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS registration_book_book_search_gin '
+        'ON registration_book_book USING gin (search_vector)'
+    )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS registration_book_book_search_gin')
+
+
+def backfill_search_vector(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    from registration_book.search import book_search_vector
+
+    Book = apps.get_model('registration_book', 'Book')
+    batch = []
+    for book in Book.objects.only('book_id', 'title', 'author', 'subject', 'isbn').iterator(chunk_size=500):
+        book.search_vector = book_search_vector(book.title, book.author, book.subject, book.isbn)
+        batch.append(book)
+        if len(batch) >= 500:
+            Book.objects.bulk_update(batch, ['search_vector'])
+            batch = []
+    if batch:
+        Book.objects.bulk_update(batch, ['search_vector'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('registration_book', '0011_book_copy_counts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+        migrations.RunPython(backfill_search_vector, migrations.RunPython.noop),
+    ]
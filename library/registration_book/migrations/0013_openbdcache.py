@@ -0,0 +1,21 @@
+# Generated by Django 5.2.2 on 2026-10-18 04:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('registration_book', '0012_book_search_vector'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OpenBDCache',
+            fields=[
+                ('isbn', models.CharField(max_length=13, primary_key=True, serialize=False, verbose_name='ISBN')),
+                ('book_info', models.JSONField(blank=True, null=True, verbose_name='書誌情報')),
+                ('fetched_at', models.DateTimeField(verbose_name='取得日時')),
+            ],
+        ),
+    ]
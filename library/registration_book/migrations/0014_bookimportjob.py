@@ -0,0 +1,42 @@
+# Generated by Django 5.2.2 on 2026-10-18 04:03
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('registration_book', '0013_openbdcache'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookImportJob',
+            fields=[
+                ('job_id', models.AutoField(primary_key=True, serialize=False, verbose_name='インポートID')),
+                ('source_name', models.CharField(max_length=255, verbose_name='ファイル名')),
+                ('default_storage', models.CharField(blank=True, max_length=255, verbose_name='既定の保管場所')),
+                ('status', models.CharField(choices=[('running', 'Running'), ('completed', 'Completed'), ('failed', 'Failed')], default='running', max_length=10, verbose_name='状態')),
+                ('processed_rows', models.PositiveIntegerField(default=0, verbose_name='処理済み行数')),
+                ('created_copies', models.PositiveIntegerField(default=0, verbose_name='登録冊数')),
+                ('created_books', models.PositiveIntegerField(default=0, verbose_name='新規書籍数')),
+                ('failed_rows', models.PositiveIntegerField(default=0, verbose_name='失敗行数')),
+                ('started_at', models.DateTimeField(auto_now_add=True, verbose_name='開始日時')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新日時')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='BookImportFailure',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('line_number', models.PositiveIntegerField(verbose_name='行番号')),
+                ('isbn', models.CharField(blank=True, max_length=32, verbose_name='ISBN')),
+                ('reason', models.CharField(max_length=255, verbose_name='理由')),
+                ('job', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='failures', to='registration_book.bookimportjob')),
+            ],
+            options={
+                'ordering': ['line_number'],
+            },
+        ),
+    ]
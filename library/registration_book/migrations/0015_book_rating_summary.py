@@ -0,0 +1,53 @@
+# Generated by Django 5.2.2 on 2026-10-18 04:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('registration_book', '0014_bookimportjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='rating_1',
+            field=models.PositiveIntegerField(default=0, verbose_name='評価1件数'),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='rating_2',
+            field=models.PositiveIntegerField(default=0, verbose_name='評価2件数'),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='rating_3',
+            field=models.PositiveIntegerField(default=0, verbose_name='評価3件数'),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='rating_4',
+            field=models.PositiveIntegerField(default=0, verbose_name='評価4件数'),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='rating_5',
+            field=models.PositiveIntegerField(default=0, verbose_name='評価5件数'),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='rating_avg',
+            field=models.FloatField(blank=True, editable=False, null=True, verbose_name='平均評価'),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='評価件数'),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0, verbose_name='評価合計'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.2 on 2026-10-18 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('registration_book', '0016_export_watermark'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bookimportjob',
+            name='source',
+            field=models.TextField(blank=True, editable=False, verbose_name='取込データ'),
+        ),
+    ]
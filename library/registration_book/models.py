@@ -1,6 +1,61 @@
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
+from django.db.models import F, FloatField, Value
+from django.db.models.functions import Cast, Greatest, NullIf
 from django.urls import reverse
+from django.utils import timezone
 import uuid
+from .cache import invalidate_book, invalidate_copies
+
+RATING_SCORES = range(1, 6)
+
+
+class BookManager(models.Manager):
+    def adjust_copy_counts(self, book_id, total=0, available=0):
+        """
+        Shift the denormalized copy counters of a book with a single UPDATE.
+        Call inside the same transaction as the loan/instance change.
+        """
+        changes = {}
+        if total:
+            changes['total_copies'] = Greatest(F('total_copies') + total, Value(0))
+        if available:
+            changes['available_copies'] = Greatest(F('available_copies') + available, Value(0))
+        if changes:
+            self.filter(pk=book_id).update(**changes, updated_at=timezone.now())
+            invalidate_book(book_id)
+        if total:
+            # Copies were added or removed, possibly with bulk_create (no signals)
+            invalidate_copies(book_id)
+
+    def adjust_rating(self, book_id, old_score=None, new_score=None):
+        """
+        Move one review's score out of / into a book's rating summary with a
+        single UPDATE (old_score=None: review added, new_score=None: removed).
+        """
+        old_score = old_score if old_score in RATING_SCORES else None
+        new_score = new_score if new_score in RATING_SCORES else None
+        if old_score == new_score:
+            return
+        count = (new_score is not None) - (old_score is not None)
+        total = (new_score or 0) - (old_score or 0)
+        changes = {}
+        if old_score is not None:
+            changes[f'rating_{old_score}'] = Greatest(F(f'rating_{old_score}') - 1, Value(0))
+        if new_score is not None:
+            changes[f'rating_{new_score}'] = F(f'rating_{new_score}') + 1
+        new_count = Greatest(F('rating_count') + count, Value(0))
+        new_sum = Greatest(F('rating_sum') + total, Value(0))
+        changes.update(
+            rating_count=new_count,
+            rating_sum=new_sum,
+            # Every right-hand side reads the pre-update row, so the average is
+            # computed from the new count and sum in the same statement
+            rating_avg=Cast(new_sum, FloatField()) / NullIf(new_count, Value(0)),
+        )
+        self.filter(pk=book_id).update(**changes, updated_at=timezone.now())
+        invalidate_book(book_id)
+
 
 class Book(models.Model):
     book_id = models.AutoField('書籍ID', primary_key=True)
@@ -10,12 +65,43 @@ class Book(models.Model):
     publish_date = models.CharField('出版日', max_length=15) 
     image_url = models.URLField('画像用リンク', max_length=255, blank=True, null=True)
     subject = models.CharField('ジャンル', max_length=255, blank=True, null=True)
+    # Kept in sync by the loan/return/register/delete flows; see reconcile_copy_counts
+    total_copies = models.PositiveIntegerField('蔵書数', default=0)
+    available_copies = models.PositiveIntegerField('貸出可能数', default=0)
+    # Review score summary kept in sync by rental.signals; see reconcile_ratings
+    rating_count = models.PositiveIntegerField('評価件数', default=0)
+    rating_sum = models.PositiveIntegerField('評価合計', default=0)
+    rating_avg = models.FloatField('平均評価', null=True, blank=True, editable=False)
+    rating_1 = models.PositiveIntegerField('評価1件数', default=0)
+    rating_2 = models.PositiveIntegerField('評価2件数', default=0)
+    rating_3 = models.PositiveIntegerField('評価3件数', default=0)
+    rating_4 = models.PositiveIntegerField('評価4件数', default=0)
+    rating_5 = models.PositiveIntegerField('評価5件数', default=0)
+    # Weighted bigram vector maintained by registration_book.search (PostgreSQL only)
+    search_vector = SearchVectorField(null=True, editable=False)
+    # Export watermark (rental.exports); UPDATE-only code paths set it explicitly
+    updated_at = models.DateTimeField('更新日時', auto_now=True, db_index=True)
+
+    objects = BookManager()
+
     class Meta:
         ordering = ['title', '-publish_date']
         unique_together = ('title', 'author')
     
     def __str__(self):
         return self.title
+
+    @property
+    def rating_histogram(self):
+        """[{'score': 1, 'count': n}, ..., {'score': 5, 'count': n}]"""
+        return [{'score': score, 'count': getattr(self, f'rating_{score}')} for score in RATING_SCORES]
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or {'title', 'author', 'subject', 'isbn'} & set(update_fields):
+            from .search import index_books
+            index_books([self])
     
     def get_absolute_url(self):
         return reverse('book-detail', args=[str(self.book_id)])
@@ -23,6 +109,7 @@ class Book(models.Model):
 class Storage(models.Model):
     storage_id = models.AutoField('保管場所ID', primary_key=True)
     storage_name = models.CharField('保管場所の名前', max_length=255) 
+    updated_at = models.DateTimeField('更新日時', auto_now=True, db_index=True)
 
     def __str__(self):
         return f'{self.storage_name}'
@@ -31,9 +118,71 @@ class BookInstance(models.Model):
     book_instance_id = models.UUIDField('蔵書ID', primary_key=True, default=uuid.uuid4)
     storage = models.ForeignKey(Storage, on_delete=models.CASCADE)
     book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='instances')
+    updated_at = models.DateTimeField('更新日時', auto_now=True, db_index=True)
 
     class Meta:
         ordering = ['book_instance_id']
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.remember_book()
+        return instance
+
+    def remember_book(self):
+        """Note the book the stored row counts towards; see rental.signals."""
+        self._book_state = self.__dict__.get('book_id')
+
     def __str__(self):
         return f'{self.book_instance_id} : {self.book.title} in {self.storage.storage_name}'
+
+
+class OpenBDCache(models.Model):
+    """Persistent OpenBD lookup cache; book_info is NULL when OpenBD has no record."""
+    isbn = models.CharField('ISBN', max_length=13, primary_key=True)
+    book_info = models.JSONField('書誌情報', null=True, blank=True)
+    fetched_at = models.DateTimeField('取得日時')
+
+    def __str__(self):
+        return f'{self.isbn} ({"found" if self.book_info else "not found"})'
+
+
+class BookImportJob(models.Model):
+    """
+    Progress of a bulk ISBN import; processed_rows lets an interrupted import
+    resume. The uploaded lines are kept in `source` for the task worker until
+    the import completes.
+    """
+    STATUS_CHOICES = (
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    )
+
+    job_id = models.AutoField('インポートID', primary_key=True)
+    source_name = models.CharField('ファイル名', max_length=255)
+    default_storage = models.CharField('既定の保管場所', max_length=255, blank=True)
+    status = models.CharField('状態', max_length=10, choices=STATUS_CHOICES, default='running')
+    processed_rows = models.PositiveIntegerField('処理済み行数', default=0)
+    created_copies = models.PositiveIntegerField('登録冊数', default=0)
+    created_books = models.PositiveIntegerField('新規書籍数', default=0)
+    failed_rows = models.PositiveIntegerField('失敗行数', default=0)
+    source = models.TextField('取込データ', blank=True, editable=False)
+    started_at = models.DateTimeField('開始日時', auto_now_add=True)
+    updated_at = models.DateTimeField('更新日時', auto_now=True)
+
+    def __str__(self):
+        return f'Import {self.job_id} ({self.source_name}): {self.status}'
+
+
+class BookImportFailure(models.Model):
+    job = models.ForeignKey(BookImportJob, on_delete=models.CASCADE, related_name='failures')
+    line_number = models.PositiveIntegerField('行番号')
+    isbn = models.CharField('ISBN', max_length=32, blank=True)
+    reason = models.CharField('理由', max_length=255)
+
+    class Meta:
+        ordering = ['line_number']
+
+    def __str__(self):
+        return f'line {self.line_number} ({self.isbn}): {self.reason}'
@@ -0,0 +1,170 @@
+"""
+OpenBD metadata client.
+
+One pooled requests.Session per process, strict (connect, read) timeouts,
+and a persistent cache in the OpenBDCache table. ISBNs OpenBD does not
+know are cached too (negative caching) with a shorter TTL, so librarian
+retries and bulk imports never hit the API twice for the same ISBN.
+"""
+import logging
+from datetime import timedelta
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from django.conf import settings
+from django.utils import timezone
+from .models import OpenBDCache
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_IMAGE_URL = 'https://www.svgrepo.com/show/83343/book.svg'
+
+
+class OpenBDUnavailable(Exception):
+    """OpenBD could not be reached or answered badly; the lookup can be retried."""
+
+
+def parse_openbd_record(isbn, record):
+    """Map one OpenBD record to the book_info dict used by the registration views."""
+    book_info = {
+        'isbn': isbn,
+        'title': '',
+        'author': '',
+        'publish_date': '',
+        'subject': '',
+        'image_url': ''
+    }
+
+    # Extract from 'summary'
+    if 'summary' in record:
+        summary = record['summary']
+        book_info.update({
+            'title': summary.get('title', ''),
+            'author': summary.get('author', ''),
+            'publish_date': summary.get('pubdate', ''),
+            'image_url': summary.get('cover', '') or DEFAULT_IMAGE_URL
+        })
+
+    # Extract 'subject' from ONIX if available
+    try:
+        descriptive_detail = record.get('onix', {}).get('DescriptiveDetail', {})
+        subject_data = descriptive_detail.get('Subject')
+
+        if isinstance(subject_data, dict):
+            subject_data = [subject_data]
+
+        subject_list = []
+        for item in subject_data or []:
+            subject_text = item.get('SubjectHeadingText') or item.get('SubjectCode')
+            if subject_text:
+                subject_list.append(subject_text)
+
+        if subject_list:
+            book_info['subject'] = '; '.join(subject_list)
+
+    except Exception as e:
+        logger.warning(f"Subject extraction error for {isbn}: {e}")
+        book_info['subject'] = ''
+
+    return book_info
+
+
+class OpenBDClient:
+    def __init__(self, session=None, base_url=None, timeout=None, batch_size=None,
+                 cache_ttl=None, negative_cache_ttl=None):
+        self.base_url = base_url or getattr(settings, 'OPENBD_API_URL', 'https://api.openbd.jp/v1/get')
+        # (connect, read) seconds
+        self.timeout = timeout or getattr(settings, 'OPENBD_TIMEOUT', (3.05, 10))
+        self.batch_size = batch_size or getattr(settings, 'OPENBD_BATCH_SIZE', 100)
+        self.cache_ttl = cache_ttl or getattr(settings, 'OPENBD_CACHE_TTL', timedelta(days=30))
+        self.negative_cache_ttl = negative_cache_ttl or getattr(
+            settings, 'OPENBD_NEGATIVE_CACHE_TTL', timedelta(days=1)
+        )
+        self.session = session or self._build_session()
+
+    def _build_session(self):
+        session = requests.Session()
+        retry = Retry(total=2, backoff_factor=0.5, status_forcelist=(502, 503, 504), allowed_methods=('GET',))
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=10, max_retries=retry)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        session.headers['Accept'] = 'application/json'
+        return session
+
+    def get(self, isbn):
+        """book_info dict for one ISBN, or None if OpenBD does not know it."""
+        return self.get_many([isbn]).get(isbn)
+
+    def cached(self, isbn):
+        """(True, book_info or None) if the ISBN's lookup is cached and fresh, else (False, None)."""
+        results = self._from_cache([isbn])
+        return (isbn in results, results.get(isbn))
+
+    def get_many(self, isbns):
+        """
+        {isbn: book_info or None} for every requested ISBN. Cached entries are
+        served from the database; the rest are fetched in batches of
+        batch_size with one comma-separated request each. ISBNs whose batch
+        failed (network error, bad response) are left out of the result so
+        callers can retry them later.
+        """
+        isbns = list(dict.fromkeys(isbns))
+        results = self._from_cache(isbns)
+
+        missing = [isbn for isbn in isbns if isbn not in results]
+        for start in range(0, len(missing), self.batch_size):
+            batch = missing[start:start + self.batch_size]
+            fetched = self._fetch(batch)
+            if fetched is None:
+                continue
+            self._store(fetched)
+            results.update(fetched)
+        return results
+
+    def _from_cache(self, isbns):
+        now = timezone.now()
+        results = {}
+        for entry in OpenBDCache.objects.filter(isbn__in=isbns):
+            ttl = self.cache_ttl if entry.book_info is not None else self.negative_cache_ttl
+            if entry.fetched_at + ttl > now:
+                results[entry.isbn] = entry.book_info
+        return results
+
+    def _fetch(self, isbns):
+        try:
+            response = self.session.get(self.base_url, params={'isbn': ','.join(isbns)}, timeout=self.timeout)
+            response.raise_for_status()
+            data = response.json()
+        except (requests.RequestException, ValueError) as e:
+            logger.error(f"OpenBD API error for {len(isbns)} ISBN(s): {e}")
+            return None
+
+        if not isinstance(data, list) or len(data) != len(isbns):
+            logger.error(f"Unexpected OpenBD response for {len(isbns)} ISBN(s)")
+            return None
+
+        # OpenBD answers positionally, with null for unknown ISBNs
+        return {
+            isbn: parse_openbd_record(isbn, record) if record else None
+            for isbn, record in zip(isbns, data)
+        }
+
+    def _store(self, fetched):
+        now = timezone.now()
+        OpenBDCache.objects.bulk_create(
+            [OpenBDCache(isbn=isbn, book_info=info, fetched_at=now) for isbn, info in fetched.items()],
+            update_conflicts=True,
+            unique_fields=['isbn'],
+            update_fields=['book_info', 'fetched_at'],
+        )
+
+
+_client = None
+
+
+def get_client():
+    """Process-wide client so the connection pool is reused across requests."""
+    global _client
+    if _client is None:
+        _client = OpenBDClient()
+    return _client
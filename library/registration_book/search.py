@@ -0,0 +1,277 @@
+"""
+Catalog search over Book (title, author, subject, ISBN).
+
+Text is normalized (NFKC + casefold) and split into runs of letters/digits;
+every run is indexed as overlapping character bigrams plus its last
+character, so Japanese titles without word boundaries match on any
+partial string of two or more characters.
+
+* PostgreSQL: the bigrams are stored, weighted per field, in
+  Book.search_vector (GIN indexed) and queried as tsquery phrases.
+* Other databases (SQLite): an in-process inverted index over the same
+  bigrams, rebuilt when a Book changes or after CATALOG_SEARCH_INDEX_TTL.
+"""
+import json
+import threading
+import time
+import unicodedata
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.db import connections, router
+from django.db.models import Case, F, FloatField, Value, When
+from django.db.models.expressions import RawSQL
+
+# Field -> tsvector weight label; the label also restricts a term to its field
+FIELD_WEIGHTS = {
+    'title': 'A',
+    'author': 'B',
+    'subject': 'C',
+    'isbn': 'D',
+}
+# Same ordering as PostgreSQL's default ts_rank weights {D, C, B, A}
+WEIGHT_SCORES = {'A': 1.0, 'B': 0.4, 'C': 0.2, 'D': 0.1}
+
+
+def normalize(text):
+    """NFKC-normalize (full-width ASCII, half-width kana) and casefold."""
+    return unicodedata.normalize('NFKC', text or '').casefold()
+
+
+def _is_word_char(char):
+    return unicodedata.category(char)[0] in ('L', 'N')
+
+
+def split_runs(text):
+    """
+    Split normalized text into runs of letters/digits. A run also breaks
+    between ASCII and non-ASCII characters so mixed titles such as
+    'Python入門' index both halves cleanly.
+    """
+    runs = []
+    current = []
+    for char in normalize(text):
+        if not _is_word_char(char):
+            if current:
+                runs.append(''.join(current))
+                current = []
+            continue
+        if current and current[-1].isascii() != char.isascii():
+            runs.append(''.join(current))
+            current = []
+        current.append(char)
+    if current:
+        runs.append(''.join(current))
+    return runs
+
+
+def run_grams(run):
+    """'python' -> ['py', 'yt', 'th', 'ho', 'on', 'n']"""
+    if len(run) == 1:
+        return [run]
+    return [run[i:i + 2] for i in range(len(run) - 1)] + [run[-1]]
+
+
+def tokenize(text):
+    """Space-joined gram document for one field, in position order."""
+    return ' '.join(gram for run in split_runs(text) for gram in run_grams(run))
+
+
+def book_search_vector(title, author, subject, isbn):
+    """Weighted SearchVector expression for a book's fields."""
+    values = {'title': title, 'author': author, 'subject': subject, 'isbn': isbn}
+    vector = None
+    for field, weight in FIELD_WEIGHTS.items():
+        part = SearchVector(Value(tokenize(values[field])), config='simple', weight=weight)
+        vector = part if vector is None else vector + part
+    return vector
+
+
+def index_books(books):
+    """
+    Refresh Book.search_vector for the given books (PostgreSQL only; the
+    fallback index reads the fields directly).
+    """
+    books = list(books)
+    if not books:
+        return
+    model = type(books[0])
+    using = router.db_for_write(model)
+    if connections[using].vendor != 'postgresql':
+        invalidate_fallback_index()
+        return
+    for book in books:
+        book.search_vector = book_search_vector(book.title, book.author, book.subject, book.isbn)
+    model.objects.using(using).bulk_update(books, ['search_vector'], batch_size=500)
+
+
+def _terms(terms):
+    """Drop empty search terms and split each into runs."""
+    parsed = {}
+    for field, text in terms.items():
+        if field != 'query' and field not in FIELD_WEIGHTS:
+            raise ValueError(f"Unknown search field: {field}")
+        runs = split_runs(text)
+        if runs:
+            parsed[field] = runs
+    return parsed
+
+
+class PostgresSearchBackend:
+    """Phrase search over the GIN-indexed Book.search_vector column."""
+
+    def raw_query(self, terms):
+        """tsquery text for parsed terms: each run is a phrase of its bigrams."""
+        parts = []
+        for field, runs in terms.items():
+            label = FIELD_WEIGHTS.get(field, '')
+            for run in runs:
+                if len(run) == 1:
+                    # Single character: any gram that starts with it
+                    parts.append(f"'{run}':*{label}")
+                else:
+                    grams = run_grams(run)[:-1]
+                    parts.append(' <-> '.join(f"'{gram}'{':' + label if label else ''}" for gram in grams))
+        return ' & '.join(f'({part})' for part in parts)
+
+    def build_query(self, terms):
+        return SearchQuery(self.raw_query(terms), config='simple', search_type='raw')
+
+    def search(self, queryset, prefix='', ranked=True, **terms):
+        terms = _terms(terms)
+        if not terms:
+            return queryset.annotate(search_rank=Value(0.0, output_field=FloatField())) if ranked else queryset
+        query = self.build_query(terms)
+        vector_field = f'{prefix}search_vector'
+        queryset = queryset.filter(**{vector_field: query})
+        if ranked:
+            queryset = queryset.annotate(search_rank=SearchRank(F(vector_field), query))
+        return queryset
+
+
+class NgramIndex:
+    """In-process inverted index: gram -> {book_id: {field: [positions]}}."""
+
+    def __init__(self, rows):
+        self.postings = {}
+        for book_id, *values in rows:
+            for field, text in zip(FIELD_WEIGHTS, values):
+                for position, gram in enumerate(tokenize(text).split()):
+                    fields = self.postings.setdefault(gram, {}).setdefault(book_id, {})
+                    fields.setdefault(field, []).append(position)
+        self.by_first_char = {}
+        for gram in self.postings:
+            self.by_first_char.setdefault(gram[0], []).append(gram)
+
+    def match_run(self, run, fields):
+        """{book_id: score} for books containing the run in one of fields."""
+        scores = {}
+        if len(run) == 1:
+            for gram in self.by_first_char.get(run, ()):
+                for book_id, positions in self.postings[gram].items():
+                    for field in fields:
+                        if field in positions:
+                            scores[book_id] = max(scores.get(book_id, 0), WEIGHT_SCORES[FIELD_WEIGHTS[field]])
+            return scores
+
+        grams = run_grams(run)[:-1]
+        postings = [self.postings.get(gram) for gram in grams]
+        if not all(postings):
+            return scores
+        candidates = set(postings[0]).intersection(*postings[1:])
+        for book_id in candidates:
+            for field in fields:
+                starts = set(postings[0][book_id].get(field, ()))
+                for offset, posting in enumerate(postings[1:], start=1):
+                    if not starts:
+                        break
+                    starts &= {p - offset for p in posting[book_id].get(field, ())}
+                if starts:
+                    score = WEIGHT_SCORES[FIELD_WEIGHTS[field]] * len(starts)
+                    scores[book_id] = scores.get(book_id, 0) + score
+        return scores
+
+    def search(self, terms):
+        result = None
+        for field, runs in terms.items():
+            fields = [field] if field in FIELD_WEIGHTS else list(FIELD_WEIGHTS)
+            for run in runs:
+                scores = self.match_run(run, fields)
+                if result is None:
+                    result = scores
+                else:
+                    result = {book_id: result[book_id] + score
+                              for book_id, score in scores.items() if book_id in result}
+                if not result:
+                    return {}
+        return result or {}
+
+
+_fallback_lock = threading.Lock()
+_fallback_index = None
+_fallback_built_at = 0.0
+
+
+def invalidate_fallback_index():
+    global _fallback_index
+    with _fallback_lock:
+        _fallback_index = None
+
+
+def get_fallback_index():
+    global _fallback_index, _fallback_built_at
+    from .models import Book
+
+    ttl = getattr(settings, 'CATALOG_SEARCH_INDEX_TTL', 300)
+    with _fallback_lock:
+        if _fallback_index is None or time.monotonic() - _fallback_built_at > ttl:
+            rows = Book.objects.values_list('book_id', *FIELD_WEIGHTS).order_by().iterator(chunk_size=2000)
+            _fallback_index = NgramIndex(rows)
+            _fallback_built_at = time.monotonic()
+        return _fallback_index
+
+
+class NgramSearchBackend:
+    """
+    Pure-Python fallback for databases without full-text search. Matches are
+    ranked in Python and handed to the database as id lists; on SQLite each
+    list is one JSON parameter read with json_each, so the query stays within
+    the bound-parameter limit however many books match.
+    """
+
+    def search(self, queryset, prefix='', ranked=True, **terms):
+        terms = _terms(terms)
+        if not terms:
+            return queryset.annotate(search_rank=Value(0.0, output_field=FloatField())) if ranked else queryset
+        scores = get_fallback_index().search(terms)
+        vendor = connections[queryset.db].vendor
+        pk_field = f'{prefix}pk'
+        queryset = queryset.filter(**{f'{pk_field}__in': _id_list(list(scores), vendor)})
+        if ranked:
+            # One WHEN per distinct score rather than per book
+            by_score = {}
+            for book_id, score in sorted(scores.items()):
+                by_score.setdefault(score, []).append(book_id)
+            whens = [When(**{f'{pk_field}__in': _id_list(book_ids, vendor)}, then=Value(score))
+                     for score, book_ids in by_score.items()]
+            queryset = queryset.annotate(
+                search_rank=Case(*whens, default=Value(0.0), output_field=FloatField()) if whens
+                else Value(0.0, output_field=FloatField())
+            )
+        return queryset
+
+
+def _id_list(ids, vendor):
+    """Right-hand side of an __in lookup: a single JSON parameter on SQLite, a plain list elsewhere."""
+    if vendor == 'sqlite':
+        return RawSQL('SELECT value FROM json_each(%s)', (json.dumps(ids),))
+    return ids
+
+
+def get_search_backend(using=None):
+    """Pick the backend for the database the catalog is read from."""
+    from .models import Book
+
+    using = using or router.db_for_read(Book)
+    if connections[using].vendor == 'postgresql':
+        return PostgresSearchBackend()
+    return NgramSearchBackend()
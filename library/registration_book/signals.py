@@ -0,0 +1,23 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from . import cache
+from .models import Book, BookInstance, Storage
+
+
+@receiver(post_save, sender=Book)
+@receiver(post_delete, sender=Book)
+def invalidate_cached_book(sender, instance, **kwargs):
+    cache.invalidate_book(instance.pk)
+
+
+@receiver(post_save, sender=BookInstance)
+@receiver(post_delete, sender=BookInstance)
+def invalidate_cached_copies(sender, instance, **kwargs):
+    cache.forget_copy(instance.pk)
+    cache.invalidate_copies(instance.book_id)
+
+
+@receiver(post_save, sender=Storage)
+@receiver(post_delete, sender=Storage)
+def invalidate_cached_storages(sender, instance, **kwargs):
+    cache.invalidate_storages()
@@ -0,0 +1,20 @@
+import io
+from taskqueue.queue import register
+from .bulk_import import import_isbns
+from .models import BookImportJob
+from .openbd import OpenBDUnavailable, get_client
+
+
+@register('registration_book.fetch_openbd')
+def fetch_openbd(isbn):
+    """Look an ISBN up on OpenBD into OpenBDCache; raises (and is retried) while OpenBD is unreachable."""
+    if isbn not in get_client().get_many([isbn]):
+        raise OpenBDUnavailable(isbn)
+
+
+@register('registration_book.import_isbns')
+def import_isbns_task(job_id):
+    """Run a bulk import from its stored lines; a retry resumes after the last committed chunk."""
+    job = BookImportJob.objects.get(pk=job_id)
+    import_isbns(io.StringIO(job.source), job)
+    BookImportJob.objects.filter(pk=job.pk).update(source='')
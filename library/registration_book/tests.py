@@ -1,3 +1,473 @@
+import json
+import uuid
+from unittest.mock import patch
+from datetime import timedelta
+from urllib.parse import parse_qs, urlparse
+import requests
+from requests.adapters import BaseAdapter
+from django.core.cache import cache as default_cache
+from django.core.files.uploadedfile import SimpleUploadedFile
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
+from django.urls import resolve, reverse
+from django.utils import timezone
+from accounts.models import Employee, Librarian
+from rental.models import Loan
+from taskqueue.models import Task
+from taskqueue.worker import Worker
+from . import cache, search
+from .bulk_import import import_isbns, normalize_isbn
+from .models import Book, BookImportJob, BookInstance, OpenBDCache, Storage
+from .openbd import OpenBDClient
 
-# Create your tests here.
+OPENBD_URL = 'https://openbd.test/v1/get'
+
+OPENBD_RECORDS = {
+    '9784003101018': {
+        'summary': {
+            'isbn': '9784003101018',
+            'title': '吾輩は猫である',
+            'author': '夏目漱石／著',
+            'pubdate': '19900415',
+            'cover': '',
+        },
+        'onix': {'DescriptiveDetail': {'Subject': [{'SubjectCode': '0193'}]}},
+    },
+    '9784101010014': {
+        'summary': {
+            'isbn': '9784101010014',
+            'title': '坊っちゃん',
+            'author': '夏目漱石',
+            'pubdate': '2003',
+            'cover': 'https://cover.openbd.jp/9784101010014.jpg',
+        },
+    },
+}
+
+
+class FixtureTransport(BaseAdapter):
+    """requests adapter answering OpenBD calls from OPENBD_RECORDS, without the network."""
+
+    def __init__(self, records=OPENBD_RECORDS, fail=False):
+        super().__init__()
+        self.records = records
+        self.fail = fail
+        self.calls = []
+
+    def send(self, request, **kwargs):
+        self.calls.append(request.url)
+        if self.fail:
+            raise requests.ConnectionError('fixture transport is offline')
+        isbns = parse_qs(urlparse(request.url).query)['isbn'][0].split(',')
+        response = requests.Response()
+        response.status_code = 200
+        response.url = request.url
+        response.request = request
+        response._content = json.dumps([self.records.get(isbn) for isbn in isbns]).encode()
+        return response
+
+    def close(self):
+        pass
+
+
+def fixture_client(transport, **kwargs):
+    session = requests.Session()
+    session.mount('https://', transport)
+    return OpenBDClient(session=session, base_url=OPENBD_URL, **kwargs)
+
+
+class OpenBDClientTests(TestCase):
+    def test_get_parses_summary_and_subject(self):
+        client = fixture_client(FixtureTransport())
+        info = client.get('9784003101018')
+        self.assertEqual(info['title'], '吾輩は猫である')
+        self.assertEqual(info['publish_date'], '19900415')
+        self.assertEqual(info['subject'], '0193')
+        self.assertEqual(info['image_url'], 'https://www.svgrepo.com/show/83343/book.svg')
+
+    def test_repeat_lookup_is_served_from_cache(self):
+        transport = FixtureTransport()
+        client = fixture_client(transport)
+        client.get('9784003101018')
+        client.get('9784003101018')
+        self.assertEqual(len(transport.calls), 1)
+
+    def test_unknown_isbn_is_negatively_cached(self):
+        transport = FixtureTransport()
+        client = fixture_client(transport)
+        self.assertIsNone(client.get('9780000000002'))
+        self.assertIsNone(client.get('9780000000002'))
+        self.assertEqual(len(transport.calls), 1)
+        self.assertIsNone(OpenBDCache.objects.get(isbn='9780000000002').book_info)
+
+    def test_expired_negative_entry_is_refetched(self):
+        transport = FixtureTransport()
+        client = fixture_client(transport, negative_cache_ttl=timedelta(hours=1))
+        OpenBDCache.objects.create(
+            isbn='9784101010014', book_info=None, fetched_at=timezone.now() - timedelta(hours=2)
+        )
+        self.assertEqual(client.get('9784101010014')['title'], '坊っちゃん')
+        self.assertEqual(len(transport.calls), 1)
+
+    def test_get_many_batches_uncached_isbns(self):
+        transport = FixtureTransport()
+        client = fixture_client(transport, batch_size=2)
+        client.get('9784003101018')
+        results = client.get_many(['9784003101018', '9784101010014', '9780000000002', '9780000000019'])
+        self.assertEqual(results['9784101010014']['title'], '坊っちゃん')
+        self.assertIsNone(results['9780000000002'])
+        # 1 single lookup + 3 uncached ISBNs in batches of 2
+        self.assertEqual(len(transport.calls), 3)
+
+    def test_transport_error_is_not_cached(self):
+        client = fixture_client(FixtureTransport(fail=True))
+        self.assertEqual(client.get_many(['9784003101018']), {})
+        self.assertFalse(OpenBDCache.objects.exists())
+
+
+class BulkImportTests(TestCase):
+    def setUp(self):
+        self.transport = FixtureTransport()
+        self.client = fixture_client(self.transport)
+
+    def test_normalize_isbn(self):
+        self.assertEqual(normalize_isbn('978-4-00-310101-8'), '9784003101018')
+        self.assertEqual(normalize_isbn('4003101014'), '9784003101018')
+        self.assertIsNone(normalize_isbn('9784003101019'))
+        self.assertIsNone(normalize_isbn('abc'))
+
+    def test_import_creates_books_copies_and_failures(self):
+        lines = [
+            'isbn,storage\n',
+            '9784003101018,Shelf A\n',
+            '9784003101018,Shelf B\n',
+            '9784101010014\n',
+            '9780000000002,Shelf A\n',
+            'not-an-isbn,Shelf A\n',
+        ]
+        job = BookImportJob.objects.create(source_name='donation.csv', default_storage='Shelf C')
+        import_isbns(lines, job, chunk_size=2, client=self.client)
+
+        self.assertEqual(job.status, 'completed')
+        self.assertEqual((job.created_copies, job.created_books, job.failed_rows), (3, 2, 2))
+        neko = Book.objects.get(isbn='9784003101018')
+        self.assertEqual((neko.total_copies, neko.available_copies), (2, 2))
+        self.assertEqual(BookInstance.objects.filter(book__isbn='9784101010014', storage__storage_name='Shelf C').count(), 1)
+        self.assertEqual(
+            list(job.failures.values_list('line_number', 'reason')),
+            [(5, 'Not found in OpenBD'), (6, 'Invalid ISBN')],
+        )
+
+    def test_resume_skips_committed_rows(self):
+        lines = ['9784003101018,Shelf A\n', '9784101010014,Shelf A\n']
+        job = BookImportJob.objects.create(source_name='scan.txt', processed_rows=1)
+        import_isbns(lines, job, client=self.client)
+
+        self.assertEqual(job.created_copies, 1)
+        self.assertFalse(Book.objects.filter(isbn='9784003101018').exists())
+        self.assertTrue(Book.objects.filter(isbn='9784101010014').exists())
+
+
+
+class BulkImportViewTests(TestCase):
+    def setUp(self):
+        self.client.force_login(Librarian.objects.create_user(username='lib', password='pw12345!x'))
+        self.transport = FixtureTransport()
+
+    def upload(self, content, **data):
+        upload = SimpleUploadedFile('scan.csv', content.encode())
+        return self.client.post(reverse('bulk_import'), {'file': upload, 'default_storage': 'Shelf A', **data})
+
+    def run_worker(self):
+        with patch('registration_book.bulk_import.get_client', return_value=fixture_client(self.transport)):
+            Worker(name='test').run_tasks(Task.objects.filter(name='registration_book.import_isbns'))
+
+    def test_upload_is_imported_by_the_worker(self):
+        response = self.upload('isbn\n9784003101018\n9784101010014,Shelf B\n')
+        job = BookImportJob.objects.get()
+        self.assertRedirects(response, reverse('bulk_import_report', args=[job.job_id]), fetch_redirect_response=False)
+        # Nothing is imported inside the upload request
+        self.assertEqual((job.status, job.processed_rows), ('running', 0))
+        self.assertFalse(BookInstance.objects.exists())
+        self.assertContains(self.client.get(response.url), 'running in the background')
+
+        self.run_worker()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.created_copies, job.source), ('completed', 2, ''))
+        self.assertEqual(BookInstance.objects.filter(storage__storage_name='Shelf B').count(), 1)
+
+    def test_resuming_a_failed_import(self):
+        job = BookImportJob.objects.create(source_name='scan.csv', default_storage='Shelf A',
+                                           status='failed', processed_rows=1)
+        self.upload('9784003101018\n9784101010014\n', resume_job=job.job_id)
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'running')
+        # A second resume while the first one is queued is refused
+        response = self.upload('9784003101018\n9784101010014\n', resume_job=job.job_id)
+        self.assertFormError(response.context['form'], 'resume_job', 'This import is still running.')
+
+        self.run_worker()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.processed_rows, job.created_copies), ('completed', 2, 1))
+        self.assertEqual(list(BookInstance.objects.values_list('book__isbn', flat=True)), ['9784101010014'])
+
+    def test_failed_attempt_is_retried(self):
+        self.upload('9784003101018\n9784101010014\n')
+        with patch('registration_book.bulk_import.import_chunk', side_effect=RuntimeError('connection lost')):
+            self.run_worker()
+        job = BookImportJob.objects.get()
+        self.assertEqual(job.status, 'failed')
+        self.assertEqual(Task.objects.get().status, Task.QUEUED)
+
+        # The retry marks the job running again and finishes it
+        Task.objects.update(run_at=timezone.now())
+        self.run_worker()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.created_copies), ('completed', 2))
+
+class CopyCounterTests(TestCase):
+    def setUp(self):
+        self.client.force_login(Librarian.objects.create_user(username='lib', password='pw12345!x'))
+
+    def register(self):
+        self.client.post(reverse('manual_book_registration'), {
+            'title': '吾輩は猫である', 'author': '夏目漱石', 'publish_date': '1905', 'storage': 'A',
+        })
+        return Book.objects.get(title='吾輩は猫である')
+
+    def counts(self, book):
+        return Book.objects.values_list('total_copies', 'available_copies').get(pk=book.pk)
+
+    def test_register_and_delete_copies(self):
+        for _ in range(3):
+            book = self.register()
+        self.assertEqual(self.counts(book), (3, 3))
+
+        free, lent, last = book.instances.all()
+        employee = Employee.objects.create_user(username='emp', password='pw12345!x', user_type='employee')
+        Loan.objects.create(book_instance=lent, employee=employee)
+        self.assertEqual(self.counts(book), (3, 2))
+
+        # A copy on loan was not counted as available
+        self.client.post(reverse('book_instance_delete', args=[lent.pk]))
+        self.assertEqual(self.counts(book), (2, 2))
+        self.client.post(reverse('book_instance_delete', args=[free.pk]))
+        self.assertEqual(self.counts(book), (1, 1))
+        self.client.post(reverse('book_instance_delete', args=[last.pk]))
+        self.assertFalse(Book.objects.filter(pk=book.pk).exists())
+
+    def test_copies_added_moved_and_deleted_in_admin(self):
+        self.client.force_login(Librarian.objects.create_superuser(username='admin', password='pw12345!x'))
+        storage = Storage.objects.create(storage_name='A')
+        neko = Book.objects.create(title='吾輩は猫である', author='夏目漱石', publish_date='1905')
+        kokoro = Book.objects.create(title='こころ', author='夏目漱石', publish_date='1914')
+        for _ in range(2):
+            response = self.client.post(reverse('admin:registration_book_bookinstance_add'),
+                                        {'book_instance_id': uuid.uuid4(), 'book': neko.pk, 'storage': storage.pk})
+            self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.counts(neko), (2, 2))
+
+        free, lent = neko.instances.all()
+        employee = Employee.objects.create_user(username='emp', password='pw12345!x', user_type='employee')
+        Loan.objects.create(book_instance=lent, employee=employee)
+        self.assertEqual(self.counts(neko), (2, 1))
+
+        # A copy moved to another book takes its counts along; a lent one stays unavailable
+        for copy in (free, lent):
+            self.client.post(reverse('admin:registration_book_bookinstance_change', args=[copy.pk]),
+                             {'book_instance_id': copy.pk, 'book': kokoro.pk, 'storage': storage.pk})
+        self.assertEqual(self.counts(neko), (0, 0))
+        self.assertEqual(self.counts(kokoro), (2, 1))
+
+        self.client.post(reverse('admin:registration_book_bookinstance_delete', args=[lent.pk]), {'post': 'yes'})
+        self.assertEqual(self.counts(kokoro), (1, 1))
+        self.client.post(reverse('admin:registration_book_bookinstance_delete', args=[free.pk]), {'post': 'yes'})
+        self.assertEqual(self.counts(kokoro), (0, 0))
+
+
+class CatalogCacheTests(TestCase):
+    def setUp(self):
+        cache.catalog_cache().clear()
+        cache.reset_cache_stats()
+        self.storage = Storage.objects.create(storage_name='Shelf A')
+        self.book = Book.objects.create(title='吾輩は猫である', author='夏目漱石', publish_date='1905')
+        self.copy = BookInstance.objects.create(book=self.book, storage=self.storage)
+
+    def test_second_read_hits_cache(self):
+        copies = cache.get_copies(self.book.pk)
+        with CaptureQueriesContext(connection) as queries:
+            again = cache.get_copies(self.book.pk)
+        self.assertEqual(len(queries), 0)
+        self.assertEqual([copy.pk for copy in again], [copy.pk for copy in copies])
+        self.assertEqual(again[0].storage.storage_name, 'Shelf A')
+        self.assertEqual(again[0].book.title, '吾輩は猫である')
+        self.assertEqual(cache.cache_stats()['kinds']['copies'], {'hits': 1, 'misses': 1})
+
+    def test_signals_invalidate(self):
+        cache.get_copies(self.book.pk)
+        self.book.title = '坊っちゃん'
+        self.book.save()
+        self.storage.storage_name = 'Shelf B'
+        self.storage.save()
+        second = BookInstance.objects.create(book=self.book, storage=self.storage)
+
+        copies = cache.get_copies(self.book.pk)
+        self.assertEqual({copy.pk for copy in copies}, {self.copy.pk, second.pk})
+        self.assertEqual({copy.storage.storage_name for copy in copies}, {'Shelf B'})
+        self.assertEqual(copies[0].book.title, '坊っちゃん')
+
+        second.delete()
+        self.assertEqual([copy.pk for copy in cache.get_copies(self.book.pk)], [self.copy.pk])
+        self.assertIsNone(cache.get_copy_book_id(second.pk))
+
+    def test_counter_updates_invalidate(self):
+        cache.get_book(self.book.pk)
+        Book.objects.adjust_copy_counts(self.book.pk, total=1, available=1)
+        Book.objects.adjust_rating(self.book.pk, new_score=5)
+        book = cache.get_book(self.book.pk)
+        self.assertEqual((book.total_copies, book.rating_count), (2, 1))
+
+    def test_bulk_created_storage_is_found(self):
+        cache.get_storages()
+        storage = Storage.objects.bulk_create([Storage(storage_name='Annex')])[0]
+        copy = BookInstance.objects.create(book=self.book, storage=storage)
+        self.assertEqual(cache.attach_catalog([copy])[0].storage.storage_name, 'Annex')
+
+
+class IsbnDraftTests(TestCase):
+    isbn = '9784003101018'
+
+    def setUp(self):
+        default_cache.clear()
+        self.client.force_login(Librarian.objects.create_user(username='lib', password='pw12345!x'))
+        OpenBDCache.objects.create(isbn=self.isbn, fetched_at=timezone.now(), book_info={
+            'title': '吾輩は猫である', 'author': '夏目漱石', 'publish_date': '1905', 'subject': '', 'image_url': '',
+        })
+
+    def test_draft_is_kept_out_of_the_session(self):
+        response = self.client.post(reverse('isbn_input'), {'isbn': self.isbn})
+        confirm_url = f"{reverse('book_confirmation')}?isbn={self.isbn}"
+        self.assertRedirects(response, confirm_url, fetch_redirect_response=False)
+        self.assertNotIn('book_data', self.client.session)
+
+        self.assertContains(self.client.get(confirm_url), '吾輩は猫である')
+        response = self.client.post(confirm_url, {
+            'isbn': self.isbn, 'title': '吾輩は猫である', 'author': '夏目漱石',
+            'publish_date': '1905', 'storage_name': 'Shelf A',
+        })
+        self.assertRedirects(response, reverse('registration_complete'), fetch_redirect_response=False)
+        self.assertEqual(BookInstance.objects.filter(book__isbn=self.isbn).count(), 1)
+
+    def test_missing_draft_is_rebuilt_from_openbd_cache(self):
+        self.client.post(reverse('isbn_input'), {'isbn': self.isbn})
+        default_cache.clear()
+        response = self.client.get(reverse('book_confirmation'), {'isbn': self.isbn})
+        self.assertContains(response, '夏目漱石')
+        response = self.client.get(reverse('book_confirmation'), {'isbn': '9784101010014'})
+        self.assertRedirects(response, reverse('isbn_input'), fetch_redirect_response=False)
+
+
+class IsbnLookupTests(TestCase):
+    isbn = '9784101010014'
+
+    def setUp(self):
+        self.client.force_login(Librarian.objects.create_user(username='lib', password='pw12345!x'))
+
+    def submit(self):
+        response = self.client.post(reverse('isbn_input'), {'isbn': self.isbn})
+        return Task.objects.get(pk=resolve(response.url).kwargs['task_id'])
+
+    def test_repeated_submits_share_the_pending_lookup(self):
+        task = self.submit()
+        self.assertEqual(task.idempotency_key, f'openbd:{self.isbn}')
+        self.assertEqual(self.submit(), task)
+        self.assertEqual(Task.objects.count(), 1)
+
+    def test_expired_result_is_looked_up_again_by_the_worker(self):
+        task = self.submit()
+        # Done, but the cached OpenBD entry has since expired
+        Task.objects.filter(pk=task.pk).update(status=Task.DONE)
+        with patch.object(OpenBDClient, 'get_many', side_effect=AssertionError('OpenBD called in the request')):
+            response = self.client.get(reverse('isbn_lookup', args=[task.pk]))
+            retry = Task.objects.get(pk=resolve(response.url).kwargs['task_id'])
+            self.assertEqual((retry.status, retry.idempotency_key), (Task.QUEUED, f'openbd:{self.isbn}'))
+            self.assertIsNone(Task.objects.get(pk=task.pk).idempotency_key)
+            self.assertContains(self.client.get(response.url), self.isbn)
+
+        with patch('registration_book.tasks.get_client', return_value=fixture_client(FixtureTransport())):
+            Worker(name='test').run_tasks(Task.objects.filter(pk=retry.pk))
+        self.assertRedirects(self.client.get(response.url), f"{reverse('book_confirmation')}?isbn={self.isbn}",
+                             fetch_redirect_response=False)
+
+    def test_failed_lookup_can_be_retried(self):
+        task = self.submit()
+        Task.objects.filter(pk=task.pk).update(status=Task.FAILED)
+        retry = self.submit()
+        self.assertNotEqual(retry, task)
+        self.assertEqual(retry.status, Task.QUEUED)
+
+
+class CatalogSearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.books = {
+            'norway': Book.objects.create(title='ノルウェイの森', author='村上春樹', publish_date='1987', isbn='9784062748681'),
+            'python': Book.objects.create(title='Python入門', author='山田太郎', publish_date='2020', isbn='9784003101018'),
+            'sakura_title': Book.objects.create(title='さくら日記', author='佐藤', publish_date='2001'),
+            'sakura_author': Book.objects.create(title='春の歌', author='さくら', publish_date='2002'),
+        }
+
+    def setUp(self):
+        search.invalidate_fallback_index()
+
+    def found(self, ranked=False, **terms):
+        books = search.NgramSearchBackend().search(Book.objects.all(), ranked=ranked, **terms)
+        if ranked:
+            books = books.order_by('-search_rank', 'book_id')
+        return [book.pk for book in books]
+
+    def test_runs_split_between_scripts(self):
+        self.assertEqual(search.split_runs('Ｐｙｔｈｏｎ入門 第2版'), ['python', '入門', '第', '2', '版'])
+        self.assertEqual(search.tokenize('ノルウェイ'), 'ノル ルウ ウェ ェイ イ')
+
+    def test_partial_japanese_and_mixed_script(self):
+        norway, python = self.books['norway'].pk, self.books['python'].pk
+        self.assertEqual(self.found(title='ウェイ'), [norway])
+        self.assertEqual(self.found(title='の森'), [norway])
+        self.assertEqual(self.found(title='森'), [norway])
+        self.assertEqual(self.found(title='ウェイ森'), [])
+        self.assertEqual(self.found(title='python入門'), [python])
+        self.assertEqual(self.found(title='THON 入'), [python])
+        self.assertEqual(self.found(query='村上 ノルウェイ'), [norway])
+
+    def test_isbn(self):
+        self.assertEqual(self.found(isbn='978-4-00-310101-8'), [self.books['python'].pk])
+        self.assertEqual(self.found(isbn='4062748'), [self.books['norway'].pk])
+
+    def test_title_matches_rank_above_author_matches(self):
+        self.assertEqual(self.found(ranked=True, query='さくら'),
+                         [self.books['sakura_title'].pk, self.books['sakura_author'].pk])
+
+    def test_broad_fallback_search_returns_every_match(self):
+        Book.objects.bulk_create([
+            Book(title=f'さくら{n}', author='著者', publish_date='2000') for n in range(1200)
+        ])
+        search.invalidate_fallback_index()
+        found = self.found(ranked=True, query='さくら')
+        self.assertEqual(len(found), 1202)
+        # Title matches outrank the author match
+        self.assertEqual(found[-1], self.books['sakura_author'].pk)
+        # The ids travel as one JSON parameter per list, not one parameter per book
+        books = search.NgramSearchBackend().search(Book.objects.all(), query='さくら')
+        _, params = books.query.sql_with_params()
+        self.assertLess(len(params), 10)
+
+    def test_postgres_phrase_query(self):
+        backend = search.PostgresSearchBackend()
+        self.assertEqual(backend.raw_query(search._terms({'title': 'ノルウェイ'})),
+                         "('ノル':A <-> 'ルウ':A <-> 'ウェ':A <-> 'ェイ':A)")
+        self.assertEqual(backend.raw_query(search._terms({'title': '森', 'isbn': '9784'})),
+                         "('森':*A) & ('97':D <-> '78':D <-> '84':D)")
+        self.assertEqual(backend.raw_query(search._terms({'query': 'Python入門'})),
+                         "('py' <-> 'yt' <-> 'th' <-> 'ho' <-> 'on') & ('入門')")
@@ -5,6 +5,7 @@ from . import views
 urlpatterns = [
     path("", views.reg_index, name="reg_index"),
     path('isbn_input/', views.isbn_input_view, name='isbn_input'),
+    path('isbn_lookup/<int:task_id>/', views.isbn_lookup_view, name='isbn_lookup'),
     path('confirm/', views.book_confirmation_view, name='book_confirmation'),
     path('complete/', views.registration_complete_view, name='registration_complete'),
     path('complete/manual/', views.registration_complete_manual, name='complete_manual'),
@@ -12,5 +13,9 @@ urlpatterns = [
     path('delete/<uuid:pk>/', views.book_instance_delete, name='book_instance_delete'),
     path('delete/complete/', views.delete_complete, name='delete_complete'),
     path('manual-register/', views.manual_book_registration, name='manual_book_registration'),
+    path('bulk-import/', views.bulk_import_view, name='bulk_import'),
+    path('bulk-import/<int:job_id>/', views.bulk_import_report, name='bulk_import_report'),
+    path('cache-stats/', views.catalog_cache_stats, name='catalog_cache_stats'),
+    path('export/<str:dataset>/', views.export_data, name='export_data'),
     path('logout/', views.registration_book_logout, name='registration_book_logout'),
 ]
\ No newline at end of file
@@ -1,131 +1,110 @@
-import requests
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib import messages
-from django.contrib.auth.decorators import login_required
 from django.contrib.auth import logout
+from django.http import Http404, HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
 from django.db import transaction
 from django.db.models import Q
 from django.urls import reverse
-from .forms import IsbnForm, BookInstanceSearchForm, ManualBookForm, BookConfirmationForm
-from .models import Book, BookInstance, Storage
+from django.utils import timezone
+from datetime import timedelta
+from urllib.parse import urlencode
+from .forms import IsbnForm, BookInstanceSearchForm, ManualBookForm, BookConfirmationForm, BulkImportForm
+from .models import Book, BookImportJob, BookInstance, Storage
+from .cache import cache_stats, get_storages
+from .drafts import delete_draft, load_draft, save_draft
+from .search import get_search_backend
+from .openbd import get_client
+from rental.exports import FORMATS, UnknownExport, parse_since, stream_export
+from taskqueue.models import Task
+from taskqueue.queue import enqueue
 # Create your views here.
 
-@login_required(login_url='/accounts/librarian/login/')
 def reg_index(request):
-    if not hasattr(request.user, 'user_type') or request.user.user_type != 'librarian':
-        return redirect('/accounts/librarian/login/')
     return render(request, 'registration_book/reg_index.html')
 
-@login_required(login_url='/accounts/librarian/login/')
 def isbn_input_view(request):
-    if not hasattr(request.user, 'user_type') or request.user.user_type != 'librarian':
-        return redirect('/accounts/librarian/login/')
     if request.method == 'POST':
         form = IsbnForm(request.POST)
         if form.is_valid():
             isbn = form.cleaned_data['isbn']
-            book_data = fetch_book_from_openbd(isbn)
-            if book_data:
-                # Store book data in session for next step
-                book_data['isbn'] = isbn  # Add ISBN to session data
-                request.session['book_data'] = book_data
-                return redirect('book_confirmation')
-            else:
-                messages.error(request, 'Book not found in OpenBD database')
+            found, book_data = get_client().cached(isbn)
+            if found:
+                return openbd_result_redirect(request, isbn, book_data)
+            # OpenBD is called by the task worker; the lookup page waits for it
+            task = enqueue_openbd_lookup(isbn)
+            return redirect('isbn_lookup', task_id=task.pk)
     else:
         form = IsbnForm()
     
     return render(request, 'registration_book/isbn_input.html', {'form': form})
-   
-def fetch_book_from_openbd(isbn):
-    try:
-        url = f"https://api.openbd.jp/v1/get?isbn={isbn}"
-        response = requests.get(url)
-
-        if response.status_code == 200:
-            data = response.json()
-            if data and data[0]:
-                book = data[0]
-
-                book_info = {
-                    'isbn': isbn,
-                    'title': '',
-                    'author': '',
-                    'publish_date': '',
-                    'subject': '',
-                    'image_url': ''
-                }
-
-                # Extract from 'summary'
-                if 'summary' in book:
-                    summary = book['summary']
-                    book_info.update({
-                        'title': summary.get('title', ''),
-                        'author': summary.get('author', ''),
-                        'publish_date': summary.get('pubdate', ''),
-                        'image_url': summary.get('cover', '') or 'https://www.svgrepo.com/show/83343/book.svg'
-                    })
-
-                # Extract 'subject' from ONIX if available
-                try:
-                    descriptive_detail = book.get('onix', {}).get('DescriptiveDetail', {})
-                    subject_data = descriptive_detail.get('Subject')
-
-                    subject_list = []
-
-                    if isinstance(subject_data, dict):
-                        subject_text = subject_data.get('SubjectHeadingText') or subject_data.get('SubjectCode')
-                        if subject_text:
-                            subject_list.append(subject_text)
-
-                    elif isinstance(subject_data, list):
-                        for item in subject_data:
-                            subject_text = item.get('SubjectHeadingText') or item.get('SubjectCode')
-                            if subject_text:
-                                subject_list.append(subject_text)
-
-                    if subject_list:
-                        book_info['subject'] = '; '.join(subject_list)
-
-                except Exception as e:
-                    print(f"Subject extraction error: {e}")
-                    book_info['subject'] = ''
-
-                return book_info
-
-    except Exception as e:
-        print(f"OpenBD API error: {e}")
-
-    return None
-
-@login_required(login_url='/accounts/librarian/login/')
+
+def isbn_lookup_view(request, task_id):
+    """Waiting page for a queued OpenBD lookup; reloads itself until the result is cached."""
+    task = get_object_or_404(Task, pk=task_id, name='registration_book.fetch_openbd')
+    isbn = task.kwargs['isbn']
+
+    found, book_data = get_client().cached(isbn)
+    if found:
+        return openbd_result_redirect(request, isbn, book_data)
+    if task.status == Task.DONE:
+        # Cached entry already expired: look it up again rather than calling OpenBD in the request
+        return redirect('isbn_lookup', task_id=enqueue_openbd_lookup(isbn).pk)
+    if task.status == Task.FAILED:
+        messages.error(request, 'OpenBD could not be reached. Please try again later or register the book manually.')
+        return redirect('isbn_input')
+
+    context = {
+        'isbn': isbn,
+        'task': task,
+        # Nothing has picked the task up: no `manage.py runworker` running
+        'no_worker': task.attempts == 0 and timezone.now() - task.created_at > timedelta(seconds=30),
+    }
+    return render(request, 'registration_book/isbn_lookup.html', context)
+
+def enqueue_openbd_lookup(isbn):
+    """The pending OpenBD lookup task for an ISBN, queueing one if there is none."""
+    key = f'openbd:{isbn}'
+    task = enqueue('registration_book.fetch_openbd', key=key, isbn=isbn)
+    if task.status in (Task.DONE, Task.FAILED):
+        # A finished lookup keeps its key until it is deleted; free it for a fresh one
+        Task.objects.filter(pk=task.pk, idempotency_key=key).update(idempotency_key=None)
+        task = enqueue('registration_book.fetch_openbd', key=key, isbn=isbn)
+    return task
+
+def openbd_result_redirect(request, isbn, book_data):
+    if book_data:
+        # Keep the book data for the confirmation step
+        save_draft(request.user_id, isbn, book_data)
+        return redirect(f"{reverse('book_confirmation')}?{urlencode({'isbn': isbn})}")
+    messages.error(request, 'Book not found in OpenBD database')
+    return redirect('isbn_input')
+
 def manual_book_registration(request):
-    if not hasattr(request.user, 'user_type') or request.user.user_type != 'librarian':
-        return redirect('/accounts/librarian/login/')
     if request.method == "POST":
         form = ManualBookForm(request.POST)
         if form.is_valid():
-            # FIND or CREATE the book
-            book, book_created = Book.objects.get_or_create(
-                title=form.cleaned_data["title"],
-                author=form.cleaned_data["author"],
-                defaults={
-                    "isbn": form.cleaned_data.get("isbn") or None,
-                    "publish_date": form.cleaned_data.get("publish_date"),
-                    "image_url": "",
-                    "subject": form.cleaned_data.get("subject") or "",
-                },
-            )
-            # FIND or CREATE the storage by name
-            storage_name = form.cleaned_data["storage"].strip()
-            storage, storage_created = Storage.objects.get_or_create(
-                storage_name=storage_name
-            )
-            # CREATE the new BookInstance
-            book_instance = BookInstance.objects.create(
-                book=book,
-                storage=storage
-            )
+            with transaction.atomic():
+                # FIND or CREATE the book
+                book, book_created = Book.objects.get_or_create(
+                    title=form.cleaned_data["title"],
+                    author=form.cleaned_data["author"],
+                    defaults={
+                        "isbn": form.cleaned_data.get("isbn") or None,
+                        "publish_date": form.cleaned_data.get("publish_date"),
+                        "image_url": "",
+                        "subject": form.cleaned_data.get("subject") or "",
+                    },
+                )
+                # FIND or CREATE the storage by name
+                storage_name = form.cleaned_data["storage"].strip()
+                storage, storage_created = Storage.objects.get_or_create(
+                    storage_name=storage_name
+                )
+                # CREATE the new BookInstance
+                book_instance = BookInstance.objects.create(
+                    book=book,
+                    storage=storage
+                )
             # SUCCESS MESSAGE
             if book_created:
                 msg = f'New book "{book.title}" created; copy ID {book_instance.book_instance_id} stored at "{storage_name}".'
@@ -135,20 +114,17 @@ def manual_book_registration(request):
             return redirect("complete_manual")
     else:
         form = ManualBookForm()
-    return render(request, "registration_book/manual_book_registration.html", {"form": form})
+    return render(request, "registration_book/manual_book_registration.html", {
+        "form": form,
+        "storages": get_storages().values(),
+    })
 
-@login_required
 def registration_complete_manual(request):
-    if request.user.user_type != 'librarian':
-        return redirect('librarian_login')
-
     return render(request, 'registration_book/registration_complete_manual.html')
 
-@login_required(login_url='/accounts/librarian/login/')
 def book_confirmation_view(request):
-    if not hasattr(request.user, 'user_type') or request.user.user_type != 'librarian':
-        return redirect('/accounts/librarian/login/')
-    book_data = request.session.get('book_data')
+    isbn = request.GET.get('isbn')
+    book_data = load_draft(request.user_id, isbn)
     if not book_data:
         return redirect('isbn_input')
 
@@ -180,8 +156,7 @@ def book_confirmation_view(request):
                         storage=storage
                     )
 
-                    # Clear session data
-                    del request.session['book_data']
+                    delete_draft(request.user_id, isbn)
 
                     return redirect('registration_complete')
 
@@ -202,16 +177,10 @@ def book_confirmation_view(request):
         'form': form
     })
 
-@login_required(login_url='/accounts/librarian/login/')
 def registration_complete_view(request):
-    if not hasattr(request.user, 'user_type') or request.user.user_type != 'librarian':
-        return redirect('/accounts/librarian/login/')
     return render(request, 'registration_book/registration_complete.html')
 
-@login_required(login_url='/accounts/librarian/login/')
 def delete_book_instance_search(request):
-    if not hasattr(request.user, 'user_type') or request.user.user_type != 'librarian':
-        return redirect('/accounts/librarian/login/')
     form = BookInstanceSearchForm(request.GET or None)
     instances = None
 
@@ -219,11 +188,12 @@ def delete_book_instance_search(request):
         isbn = form.cleaned_data.get('isbn', '').strip()
         title = form.cleaned_data.get('title', '').strip()
         if isbn or title:
+            backend = get_search_backend()
             query = Q()
             if isbn:
-                query |= Q(book__isbn__icontains=isbn)
+                query |= Q(book__in=backend.search(Book.objects.all(), ranked=False, isbn=isbn))
             if title:
-                query |= Q(book__title__icontains=title)
+                query |= Q(book__in=backend.search(Book.objects.all(), ranked=False, title=title))
             instances = BookInstance.objects.filter(query).select_related('book', 'storage')
         else:
             instances = []
@@ -233,14 +203,12 @@ def delete_book_instance_search(request):
         'instances': instances,
     })
 
-@login_required(login_url='/accounts/librarian/login/')
 def book_instance_delete(request, pk):
-    if not hasattr(request.user, 'user_type') or request.user.user_type != 'librarian':
-        return redirect('/accounts/librarian/login/')
     instance = get_object_or_404(BookInstance, pk=pk)
     if request.method == 'POST':
         with transaction.atomic():
             book = instance.book
+            # rental.signals takes the copy out of the book's counts
             instance.delete()
             if not book.instances.exists():
                 book.delete()
@@ -250,13 +218,81 @@ def book_instance_delete(request, pk):
         'instance': instance
     })
 
-@login_required(login_url='/accounts/librarian/login/')
+def bulk_import_view(request):
+    if request.method == 'POST':
+        form = BulkImportForm(request.POST, request.FILES)
+        if form.is_valid():
+            upload = form.cleaned_data['file']
+            resume_job = form.cleaned_data.get('resume_job')
+            try:
+                source = upload.read().decode('utf-8-sig')
+            except UnicodeDecodeError:
+                form.add_error('file', 'The file is not UTF-8 text.')
+                return render(request, 'registration_book/bulk_import.html', {'form': form})
+
+            if resume_job:
+                job = BookImportJob.objects.defer('source').filter(pk=resume_job).first()
+                if job is None:
+                    form.add_error('resume_job', 'No import with this ID.')
+                elif job.status == 'running':
+                    form.add_error('resume_job', 'This import is still running.')
+                if form.errors:
+                    return render(request, 'registration_book/bulk_import.html', {'form': form})
+                BookImportJob.objects.filter(pk=job.pk).update(source=source, status='running')
+            else:
+                job = BookImportJob.objects.create(
+                    source_name=upload.name[:255],
+                    default_storage=form.cleaned_data.get('default_storage') or '',
+                    source=source,
+                )
+
+            # The task worker imports the rows; the report page follows its progress
+            enqueue('registration_book.import_isbns', job_id=job.job_id)
+            return redirect('bulk_import_report', job_id=job.job_id)
+    else:
+        form = BulkImportForm()
+    return render(request, 'registration_book/bulk_import.html', {'form': form})
+
+def bulk_import_report(request, job_id):
+    job = get_object_or_404(BookImportJob.objects.defer('source'), job_id=job_id)
+    failures = job.failures.all()[:500]
+    return render(request, 'registration_book/bulk_import_report.html', {
+        'job': job,
+        'failures': failures,
+    })
+
 def delete_complete(request):
-    if not hasattr(request.user, 'user_type') or request.user.user_type != 'librarian':
-        return redirect('/accounts/librarian/login/')
     """Renders the delete completion page."""
     return render(request, 'registration_book/delete_complete.html')
 
 def registration_book_logout(request):
     logout(request)
-    return redirect('librarian_login')
\ No newline at end of file
+    return redirect('librarian_login')
+
+
+def catalog_cache_stats(request):
+    """Hit/miss counters of the catalog cache in the process serving the request."""
+    return JsonResponse(cache_stats())
+
+
+def export_data(request, dataset):
+    """
+    Streams a dataset (rental.exports.DATASETS) as ?format=csv (default) or
+    ndjson. ?since=<ISO datetime> limits it to rows changed after that
+    watermark; the next one is sent in the X-Export-Watermark header.
+    """
+    fmt = request.GET.get('format', 'csv')
+    since = request.GET.get('since')
+    try:
+        since = parse_since(since) if since else None
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+    try:
+        chunks, watermark = stream_export(dataset, fmt, since)
+    except UnknownExport:
+        raise Http404(f"No export {dataset!r} in format {fmt!r}")
+
+    response = StreamingHttpResponse(chunks, content_type=FORMATS[fmt])
+    response['Content-Disposition'] = f'attachment; filename="{dataset}.{fmt}"'
+    response['X-Export-Watermark'] = watermark.isoformat()
+    return response
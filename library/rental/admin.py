@@ -1,7 +1,10 @@
 from django.contrib import admin
+from django.db.models import BooleanField, Case, Value, When
+from django.utils import timezone
 from django.utils.html import format_html
 from django.urls import reverse
-from .models import Loan, Reservation, Review
+from .models import Loan, LoanHistory, Reservation, Review
+from .pagination import EstimatedCountPaginator
 
 # Register your models here.
 @admin.register(Loan)
@@ -35,8 +38,15 @@ class LoanAdmin(admin.ModelAdmin):
         'is_overdue',
         'loan_status'
     ]
+    autocomplete_fields = [
+        'book_instance',
+        'employee'
+    ]
     ordering = ['-loan_start']
-    date_hierarchy = 'loan_start'
+    # No date_hierarchy: its year/month links come from a DISTINCT scan of the
+    # whole table; the loan_start list filter covers the same need
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     
     # Custom display methods
     def book_title(self, obj):
@@ -52,22 +62,78 @@ class LoanAdmin(admin.ModelAdmin):
     def loan_status(self, obj):
         if obj.return_date:
             return format_html('<span style="color: green;">Returned</span>')
-        elif obj.overdue:
+        elif obj.overdue_now:
             return format_html('<span style="color: red;">Overdue</span>')
         else:
             return format_html('<span style="color: orange;">On Loan</span>')
     loan_status.short_description = 'Status'
     
     def is_overdue(self, obj):
-        return obj.overdue
+        return obj.overdue_now
     is_overdue.boolean = True
     is_overdue.short_description = 'Overdue'
+    is_overdue.admin_order_field = 'overdue_now'
 
     # Optimize queries
     def get_queryset(self, request):
+        # Loan.overdue, computed once per request in SQL instead of per row
+        today = timezone.now().date()
         return super().get_queryset(request).select_related(
             'book_instance__book', 
             'employee'
+        ).annotate(overdue_now=Case(
+            When(return_date__isnull=True, due_date__lt=today, then=Value(True)),
+            default=Value(False),
+            output_field=BooleanField(),
+        ))
+
+@admin.register(LoanHistory)
+class LoanHistoryAdmin(admin.ModelAdmin):
+    """Archived loans (rental.archive); read-only, rows only move here from Loan."""
+    list_display = [
+        'loan_id',
+        'book_title',
+        'employee_username',
+        'loan_start',
+        'due_date',
+        'return_date',
+        'archived_at'
+    ]
+    list_filter = [
+        'loan_start',
+        'return_date'
+    ]
+    search_fields = [
+        'book_instance__book__title',
+        'book_instance__book__author',
+        'employee__username',
+        'book_instance__book__isbn'
+    ]
+    ordering = ['-return_date']
+    # No date_hierarchy (a DISTINCT scan of every partition); see LoanAdmin
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def book_title(self, obj):
+        return obj.book_instance.book.title
+    book_title.short_description = 'Book Title'
+    book_title.admin_order_field = 'book_instance__book__title'
+
+    def employee_username(self, obj):
+        return obj.employee.username
+    employee_username.short_description = 'Employee'
+    employee_username.admin_order_field = 'employee__username'
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related(
+            'book_instance__book',
+            'employee'
         )
 
 @admin.register(Reservation)
@@ -100,6 +166,10 @@ class ReservationAdmin(admin.ModelAdmin):
         'reserve_id',
         'reservation_duration'
     ]
+    autocomplete_fields = [
+        'book_instance',
+        'employee'
+    ]
     ordering = ['-future_rent']
     date_hierarchy = 'future_rent'
     
@@ -164,8 +234,14 @@ class ReviewAdmin(admin.ModelAdmin):
     readonly_fields = [
         'review_id'
     ]
+    autocomplete_fields = [
+        'book',
+        'employee'
+    ]
     ordering = ['-date']
     date_hierarchy = 'date'
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     
     # Custom display methods
     def book_title(self, obj):
@@ -1,4 +1,5 @@
 from django.apps import AppConfig
+from django.conf import settings
 import os
 import threading
 import time
@@ -10,8 +11,10 @@ class RentalConfig(AppConfig):
     name = 'rental'
 
     def ready(self):
-        # Only in main process
-        if os.environ.get('RUN_MAIN') == 'true':
+        from . import signals  # noqa: F401  (Review -> Book rating summary, BookInstance and Loan -> copy counts)
+
+        # Development server only; SCHEDULER_MODE = 'leader' starts from library/wsgi.py
+        if settings.SCHEDULER_MODE == 'runserver' and os.environ.get('RUN_MAIN') == 'true':
             # Small delay to avoid database warnings
             def start_scheduler():
                 time.sleep(1)
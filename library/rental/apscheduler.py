@@ -2,14 +2,17 @@ import logging
 import os
 import sys
 from django.conf import settings
+from django.core.management import call_command
 from django.utils import timezone
-from django.db import transaction
 from apscheduler.schedulers.background import BackgroundScheduler
-from apscheduler.triggers.cron import CronTrigger
 from django_apscheduler.jobstores import DjangoJobStore
+from django_apscheduler.models import DjangoJob
 from django_apscheduler import util
 
-from .models import Reservation, Loan
+from taskqueue.queue import delete_finished_tasks
+from .archive import archive_returned_loans
+from .notifications import send_loan_digests
+from .reservations import promote_due_reservations
 
 # FORCE console logging
 class ConsoleHandler(logging.StreamHandler):
@@ -28,86 +31,59 @@ logger.addHandler(ConsoleHandler())
 @util.close_old_connections
 def process_reservations():
     """
-    Convert reservations to loans only when books are actually available
+    Convert reservations to loans only when books are actually available.
+    Returns the summary from promote_due_reservations.
     """
     today = timezone.localdate()
     logger.info(f"Processing reservations for date {today}")
-    
+
     try:
-        # Find reservations that should start today or earlier
-        due_reservations = Reservation.objects.filter(future_rent__lte=today)
-        
-        logger.info(f"Found {due_reservations.count()} reservations due for processing")
-        
-        if not due_reservations.exists():
-            logger.info("No reservations to process")
-            return
-        
-        converted = 0
-        waiting = 0
-        errors = 0
-        
-        for res in due_reservations:
-            try:
-                with transaction.atomic():
-                    # Lock the reservation
-                    locked_res = Reservation.objects.select_for_update().get(pk=res.pk)
-                    
-                    duplicate_loan = Loan.objects.filter(
-                    book_instance=locked_res.book_instance,
-                    employee=locked_res.employee,
-                    return_date__isnull=True).first()
-
-                    if duplicate_loan:
-                        logger.info(
-                            "Employee already has copy on loan "
-                            f"(loan {duplicate_loan.loan_id}); deleting duplicate reservation {locked_res.reserve_id}")
-                        locked_res.delete()
-                        continue
-
-                    # Availability check (anyone else still on loan)
-                    current_loan = Loan.objects.filter(
-                        book_instance=locked_res.book_instance,
-                        return_date__isnull=True).exclude(employee=locked_res.employee).first()
-
-                    if current_loan:
-                        days_overdue = (
-                            (today - current_loan.due_date).days
-                            if current_loan.due_date and current_loan.due_date < today else 0)
-                        status = "overdue" if days_overdue > 0 else "on-loan"
-                        logger.info(
-                            f"Reservation {locked_res.reserve_id} waiting - book {status} "
-                            f"(borrower {current_loan.employee.username}, due {current_loan.due_date})")
-                        waiting += 1
-                        continue
-                        
-                    # Book is available - convert reservation to loan
-                    loan = Loan.objects.create(
-                        book_instance=locked_res.book_instance,
-                        employee=locked_res.employee,
-                        loan_start=today,
-                        due_date=locked_res.future_return,
-                    )
-                    
-                    # Delete the reservation since it's now a loan
-                    locked_res.delete()
-                    
-                    converted += 1
-                    logger.info(f"Converted reservation {res.reserve_id} → loan {loan.loan_id}")
-                    
-            except Reservation.DoesNotExist:
-                logger.info(f"Reservation {res.reserve_id} already processed")
-                continue
-            except Exception as e:
-                errors += 1
-                logger.error(f"Error processing reservation {res.reserve_id}: {e}")
-        
-        logger.info(f"Processing complete: {converted} converted, {waiting} waiting for book return, {errors} errors")
-        
+        summary = promote_due_reservations(today=today)
     except Exception as e:
         logger.error(f"Fatal error in process_reservations: {e}")
         raise
 
+    if not summary['due']:
+        logger.info("No reservations to process")
+    else:
+        logger.info(
+            f"Processing complete: {summary['due']} due, {summary['converted']} converted, "
+            f"{summary['duplicates']} duplicates removed, {summary['waiting']} waiting for book return, "
+            f"{summary['errors']} errors"
+        )
+    return summary
+
+@util.close_old_connections
+def archive_loans():
+    """Move long-returned loans into LoanHistory. Returns the archive summary."""
+    try:
+        summary = archive_returned_loans()
+    except Exception as e:
+        logger.error(f"Fatal error in archive_loans: {e}")
+        raise
+
+    logger.info(
+        f"Archival complete: {summary['archived']} loans returned before {summary['cutoff']} "
+        f"moved to history in {summary['batches']} batches"
+    )
+    return summary
+
+@util.close_old_connections
+def loan_digests():
+    """Email due-soon / overdue digests. Returns the send summary."""
+    try:
+        summary = send_loan_digests()
+    except Exception as e:
+        logger.error(f"Fatal error in loan_digests: {e}")
+        raise
+    return summary
+
+@util.close_old_connections
+def clear_sessions():
+    """Delete expired sessions (nothing to do for the signed-cookie engine)."""
+    call_command('clearsessions')
+    logger.info("Expired sessions cleared")
+
 def heartbeat():
     """Heartbeat with forced output"""
     msg = f"SCHEDULER ALIVE at {timezone.now()}"
@@ -116,8 +92,41 @@ def heartbeat():
     sys.stdout.write(f"{msg}\n")
     sys.stdout.flush()
 
+def configured_jobs():
+    """job id -> trigger arguments for the enabled jobs in settings.SCHEDULER_JOBS"""
+    return {job_id: trigger for job_id, trigger in settings.SCHEDULER_JOBS.items() if trigger}
+
+def add_jobs(scheduler):
+    """Register the jobs configured in settings.SCHEDULER_JOBS."""
+    for job_id, trigger in configured_jobs().items():
+        trigger_args = dict(trigger)
+        scheduler.add_job(
+            JOBS[job_id],
+            trigger=trigger_args.pop('trigger'),
+            id=job_id,
+            max_instances=1,
+            replace_existing=True,
+            **trigger_args,
+        )
+
+def build_scheduler(scheduler_class=BackgroundScheduler):
+    """
+    A scheduler with the DB job store and the configured jobs, not yet
+    started. Jobs stored by an earlier configuration (e.g. the old
+    test_promote job) are deleted so they do not keep firing.
+    """
+    stale = DjangoJob.objects.exclude(id__in=list(configured_jobs()))
+    for job_id in stale.values_list('id', flat=True):
+        logger.info(f"Removing job {job_id} (no longer configured)")
+    stale.delete()
+
+    scheduler = scheduler_class(timezone=settings.TIME_ZONE)
+    scheduler.add_jobstore(DjangoJobStore(), "default")
+    add_jobs(scheduler)
+    return scheduler
+
 def start():
-    """Start scheduler with forced output"""
+    """Start scheduler with forced output (SCHEDULER_MODE = 'runserver')"""
     if os.environ.get("RUN_MAIN") != "true":
         msg = "Not in main process - scheduler won't start"
         print(msg)
@@ -131,38 +140,7 @@ def start():
         return
     
     try:
-        scheduler = BackgroundScheduler(timezone=settings.TIME_ZONE)
-        scheduler.add_jobstore(DjangoJobStore(), "default")
-        
-        # Heartbeat every minute
-        scheduler.add_job(
-            heartbeat,
-            trigger="interval",
-            minutes=1,
-            id="heartbeat",
-            max_instances=1,
-            replace_existing=True,
-        )
-        
-        # Process every 2 minutes for testing
-        scheduler.add_job(
-            process_reservations,
-            trigger="interval",
-            minutes=2,
-            id="test_promote",
-            max_instances=1,
-            replace_existing=True,
-        )
-        
-        # Daily at midnight
-        scheduler.add_job(
-            process_reservations,
-            trigger=CronTrigger(hour=0, minute=0, timezone=settings.TIME_ZONE),
-            id="promote_reservations",
-            max_instances=1,
-            replace_existing=True,
-        )
-        
+        scheduler = build_scheduler()
         scheduler.start()
         settings._scheduler_started = True
         
@@ -183,3 +161,14 @@ def delete_old_job_executions(max_age=604_800):
     """Delete old APScheduler job executions from the database."""
     from django_apscheduler.models import DjangoJobExecution
     DjangoJobExecution.objects.delete_old_job_executions(max_age)
+
+# Job ids usable in settings.SCHEDULER_JOBS
+JOBS = {
+    'heartbeat': heartbeat,
+    'promote_reservations': process_reservations,
+    'archive_loans': archive_loans,
+    'delete_old_job_executions': delete_old_job_executions,
+    'delete_finished_tasks': delete_finished_tasks,
+    'send_loan_digests': loan_digests,
+    'clear_sessions': clear_sessions,
+}
@@ -0,0 +1,95 @@
+import logging
+from datetime import timedelta
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.utils import timezone
+from .models import Loan, LoanHistory
+
+# Same logger as the scheduler jobs that drive archival
+logger = logging.getLogger('apscheduler_rental')
+
+HISTORY_FIELDS = ('loan_id', 'book_instance_id', 'employee_id', 'loan_start', 'due_date', 'return_date')
+
+
+def archive_cutoff(days=None, today=None):
+    """Loans returned before this date are archived."""
+    if days is None:
+        days = settings.LOAN_ARCHIVE_AFTER_DAYS
+    return (today or timezone.localdate()) - timedelta(days=days)
+
+
+def archivable_loans(cutoff):
+    return Loan.objects.filter(return_date__isnull=False, return_date__lt=cutoff)
+
+
+def ensure_year_partitions(years, using=None):
+    """
+    PostgreSQL: create the rental_loanhistory_<year> partitions for `years`
+    if missing. Rows inserted without their year partition land in the
+    default partition, and a year partition can no longer be attached once
+    the default partition holds rows of that year, so this runs before every
+    insert.
+    """
+    using = using or router.db_for_write(LoanHistory)
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        return
+    table = connection.ops.quote_name(LoanHistory._meta.db_table)
+    with connection.cursor() as cursor:
+        for year in sorted(set(years)):
+            cursor.execute(
+                f'CREATE TABLE IF NOT EXISTS {LoanHistory._meta.db_table}_{int(year)} PARTITION OF {table} '
+                f"FOR VALUES FROM ('{int(year)}-01-01') TO ('{int(year) + 1}-01-01')"
+            )
+
+
+def archive_returned_loans(days=None, batch_size=None, today=None, dry_run=False):
+    """
+    Move loans returned more than `days` ago from Loan into LoanHistory.
+
+    Works in loan_id order, batch_size rows per transaction: lock the batch
+    (SKIP LOCKED, so a return or promotion in progress is never waited on),
+    bulk-insert the history rows, then delete the originals by primary key.
+    Open loans are never touched, so the partial active-loan indexes and the
+    one-active-loan constraint stay small.
+
+    Returns a summary dict.
+    """
+    batch_size = batch_size or settings.LOAN_ARCHIVE_BATCH_SIZE
+    cutoff = archive_cutoff(days, today)
+    summary = {'cutoff': cutoff, 'archived': 0, 'batches': 0}
+    loans = archivable_loans(cutoff)
+
+    if dry_run:
+        summary['archived'] = loans.count()
+        return summary
+
+    last_id = 0
+    while True:
+        with transaction.atomic():
+            batch = list(
+                loans.filter(loan_id__gt=last_id)
+                .select_for_update(skip_locked=True)
+                .order_by('loan_id')
+                .values(*HISTORY_FIELDS)[:batch_size]
+            )
+            if not batch:
+                break
+            ensure_year_partitions(row['return_date'].year for row in batch)
+            archived_at = timezone.now()
+            LoanHistory.objects.bulk_create(
+                [LoanHistory(archived_at=archived_at, **row) for row in batch],
+                batch_size=batch_size,
+                ignore_conflicts=True,
+            )
+            Loan.objects.filter(loan_id__in=[row['loan_id'] for row in batch]).delete()
+
+        last_id = batch[-1]['loan_id']
+        summary['archived'] += len(batch)
+        summary['batches'] += 1
+        logger.info(f"Archived {len(batch)} loans up to loan {last_id} (returned before {cutoff})")
+
+        if len(batch) < batch_size:
+            break
+
+    return summary
@@ -0,0 +1,203 @@
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+from datetime import date, timedelta
+from django.db.models import CharField, Prefetch, Value
+from .models import Loan, Reservation
+from registration_book.models import BookInstance
+
+
+def get_book_availability(book, employee_id, book_instance=None, copies=None):
+    """
+    Collect per-copy loan state, the employee's holdings and the reservation
+    state for a book in a fixed number of queries, regardless of how many
+    copies the book has. `copies` (e.g. from registration_book.cache) saves
+    reading the copies and their storages.
+    """
+    today = date.today()
+
+    active_loans = Loan.objects.filter(return_date__isnull=True).select_related('employee')
+    if copies is None:
+        # Every copy with its storage and (at most one) active loan: 2 queries
+        all_instances = list(
+            BookInstance.objects.filter(book=book)
+            .select_related('storage')
+            .prefetch_related(Prefetch('loan', queryset=active_loans, to_attr='active_loans'))
+        )
+    else:
+        # Active loans of the given copies: 1 query
+        all_instances = list(copies)
+        loans = {}
+        for loan in active_loans.filter(book_instance__in=[instance.pk for instance in all_instances]):
+            loans.setdefault(loan.book_instance_id, []).append(loan)
+        for instance in all_instances:
+            instance.active_loans = loans.get(instance.pk, [])
+
+    available_instances = []
+    loaned_instances = []
+    current_loan = None
+    user_has_this_instance = False
+    user_has_any_copy = False
+
+    for instance in all_instances:
+        loan = instance.active_loans[0] if instance.active_loans else None
+        if loan is None:
+            available_instances.append(instance)
+            continue
+
+        loaned_instances.append({'instance': instance, 'loan': loan})
+        is_this_instance = book_instance is not None and instance.pk == book_instance.pk
+        if is_this_instance:
+            current_loan = loan
+        if loan.employee_id == employee_id:
+            user_has_any_copy = True
+            if is_this_instance:
+                user_has_this_instance = True
+
+    # The user's open reservations for any copy of this book: 1 query
+    user_reservations = list(
+        Reservation.objects.filter(
+            book_instance__book=book,
+            employee_id=employee_id,
+            future_return__gte=today
+        ).select_related('book_instance').order_by('future_rent')
+    )
+    user_reservation_this_instance = None
+    if book_instance is not None:
+        user_reservation_this_instance = next(
+            (res for res in user_reservations if res.book_instance_id == book_instance.pk), None
+        )
+    user_reservation_any_copy = user_reservations[0] if user_reservations else None
+
+    # Latest reservation for the copy being viewed: 1 query
+    latest_reservation = None
+    if book_instance is not None:
+        latest_reservation = (
+            Reservation.objects.filter(book_instance=book_instance)
+            .select_related('employee')
+            .order_by('-future_return')
+            .first()
+        )
+
+    is_available = current_loan is None
+
+    return {
+        'current_loan': current_loan,
+        'is_available': is_available,
+        'latest_reservation': latest_reservation,
+        'user_reservation_this_instance': user_reservation_this_instance,
+        'user_reservation_any_copy': user_reservation_any_copy,
+        'user_has_this_instance': user_has_this_instance,
+        'user_has_any_copy': user_has_any_copy,
+        'all_instances': all_instances,
+        'available_instances': available_instances,
+        'loaned_instances': loaned_instances,
+        'total_copies': len(all_instances),
+        'available_count': len(available_instances),
+        'user_can_rent': is_available and not user_has_any_copy,
+        'user_can_reserve': not is_available and not user_has_any_copy,
+    }
+
+
+def get_rating_summary(book):
+    """
+    Average score and 1-5 histogram for a book, read from the rating summary
+    kept on Book (no queries).
+    """
+    return {
+        'avg_rating': book.rating_avg,
+        'rating_counts': book.rating_histogram,
+        'review_count': book.rating_count,
+    }
+
+
+# One loan or reservation of a copy, as the closed date interval [start, end]
+Booking = namedtuple('Booking', 'kind pk employee_id username start end')
+
+
+class AvailabilityTimeline:
+    """
+    Active loans and open reservations of one copy, sorted by start with a
+    running maximum of the end dates (a flattened interval tree). Overlap
+    checks and free-window searches are answered in memory from a single
+    query.
+    """
+
+    def __init__(self, bookings):
+        self.bookings = sorted(bookings, key=lambda booking: (booking.start, booking.end))
+        self._starts = [booking.start for booking in self.bookings]
+        self._max_end = []
+        for booking in self.bookings:
+            self._max_end.append(max(booking.end, self._max_end[-1]) if self._max_end else booking.end)
+
+    @classmethod
+    def for_instance(cls, book_instance, since=None, lock=False):
+        """
+        Load the timeline of a copy in one query: its active loan and every
+        reservation ending on or after `since` (today by default). With
+        lock=True the copy's row is locked first (inside a transaction) so
+        concurrent bookings of the same copy are serialized.
+        """
+        since = since or date.today()
+        if lock:
+            list(BookInstance.objects.select_for_update().filter(pk=book_instance.pk).values_list('pk'))
+
+        loans = Loan.objects.filter(book_instance=book_instance, return_date__isnull=True).annotate(
+            kind=Value('loan', output_field=CharField())
+        ).values_list('kind', 'loan_id', 'employee_id', 'employee__username', 'loan_start', 'due_date')
+        reservations = Reservation.objects.filter(
+            book_instance=book_instance,
+            future_rent__isnull=False,
+            future_return__gte=since,
+        ).annotate(
+            kind=Value('reservation', output_field=CharField())
+        ).values_list('kind', 'reserve_id', 'employee_id', 'employee__username', 'future_rent', 'future_return')
+
+        bookings = []
+        for kind, pk, employee_id, username, start, end in loans.union(reservations, all=True):
+            start = start or since
+            bookings.append(Booking(kind, pk, employee_id, username, start, max(end or start, start)))
+        return cls(bookings)
+
+    def conflicts(self, start, end, exclude_employee=None, exclude_reservation=None, closed=True):
+        """
+        Bookings overlapping [start, end] (both days inclusive), by start date.
+        closed=False compares half-open periods [start, end) instead, so a
+        booking ending on `start` or starting on `end` (a same-day handover)
+        does not conflict.
+        """
+        found = []
+        # Only bookings starting on or before `end` (before it, half-open) can
+        # overlap; walk them backwards until no earlier booking reaches `start`
+        index = (bisect_right if closed else bisect_left)(self._starts, end) - 1
+        while index >= 0 and (self._max_end[index] >= start if closed else self._max_end[index] > start):
+            booking = self.bookings[index]
+            reaches = booking.end >= start if closed else booking.end > start
+            if reaches and not self._excluded(booking, exclude_employee, exclude_reservation):
+                found.append(booking)
+            index -= 1
+        found.reverse()
+        return found
+
+    def first_conflict(self, start, end, **exclude):
+        conflicts = self.conflicts(start, end, **exclude)
+        return conflicts[0] if conflicts else None
+
+    def first_free_window(self, days, not_before=None, exclude_employee=None):
+        """
+        Earliest date d >= not_before (today by default) such that
+        [d, d + days] overlaps no booking.
+        """
+        candidate = not_before or date.today()
+        for booking in self.bookings:
+            if self._excluded(booking, exclude_employee, None) or booking.end < candidate:
+                continue
+            if booking.start > candidate + timedelta(days=days):
+                break
+            candidate = booking.end + timedelta(days=1)
+        return candidate
+
+    @staticmethod
+    def _excluded(booking, exclude_employee, exclude_reservation):
+        if exclude_employee is not None and booking.employee_id == getattr(exclude_employee, 'pk', exclude_employee):
+            return True
+        return booking.kind == 'reservation' and exclude_reservation is not None and booking.pk == exclude_reservation
@@ -2,6 +2,7 @@ from django import forms
 from django.core.exceptions import ValidationError
 from datetime import date, timedelta
 from .models import Reservation, Loan, Review
+from .availability import AvailabilityTimeline
 import re
 
 
@@ -21,6 +22,11 @@ class BookInstanceSearchForm(forms.Form):
         required=False,
         widget=forms.TextInput(attrs={'class': 'form-control'})
     )
+    available_only = forms.BooleanField(
+        label='Available now',
+        required=False,
+        widget=forms.CheckboxInput(attrs={'class': 'form-check-input'})
+    )
 
     def clean_isbn(self):
         data = self.cleaned_data.get('isbn', '').strip()
@@ -103,18 +109,14 @@ class RentForm(forms.Form):
         today = date.today()
         
         # Check for overlapping reservations
-        overlapping_reservations = Reservation.objects.filter(
-            book_instance=self.book_instance,
-            future_rent__lte=due_date,  # Reservation starts before or on rental end date
-            future_return__gte=today    # Reservation ends after or on rental start date
-        )
-        
-        if overlapping_reservations.exists():
-            first_conflict = overlapping_reservations.order_by('future_rent').first()
+        first_conflict = AvailabilityTimeline.for_instance(self.book_instance).first_conflict(today, due_date)
+        if first_conflict and first_conflict.kind == 'loan':
+            raise ValidationError("This copy is already on loan.")
+        if first_conflict:
             raise ValidationError(
                 f"Cannot rent until {due_date} because this copy is reserved "
-                f"from {first_conflict.future_rent} to {first_conflict.future_return} "
-                f"by {first_conflict.employee.username}. "
+                f"from {first_conflict.start} to {first_conflict.end} "
+                f"by {first_conflict.username}. "
                 f"Please choose an earlier due date or rent after the reservation period."
             )
         
@@ -127,6 +129,26 @@ class RentForm(forms.Form):
         return cleaned
    
     
+def reservation_conflict_message(timeline, start, end, user):
+    """Error message if [start, end] cannot be reserved on the timeline, else None."""
+    days = (end - start).days
+    # A copy that is free today is rented, not reserved
+    earliest = date.today() + timedelta(days=1)
+    if start < earliest:
+        available_from = timeline.first_free_window(days, not_before=earliest, exclude_employee=user)
+        return f"Reservations can begin no earlier than {available_from}"
+
+    conflict = timeline.first_conflict(start, end, exclude_employee=user)
+    if conflict is None:
+        return None
+    available_from = timeline.first_free_window(days, not_before=start, exclude_employee=user)
+    if conflict.kind == 'loan':
+        booked = f"on loan until {conflict.end}"
+    else:
+        booked = f"already reserved from {conflict.start} to {conflict.end}"
+    return f"This copy is {booked}. The first free period of this length starts on {available_from}."
+
+
 class ReservationForm(forms.Form):
     future_rent = forms.DateField(
         label="Reservation Start",
@@ -155,12 +177,17 @@ class ReservationForm(forms.Form):
 
         today = date.today()
 
-        # 1. Check if user already has a reservation for this specific book instance
-        existing_reservation = Reservation.objects.filter(
-            book_instance=self.book_instance,
-            employee=self.user,
-            future_return__gte=today  # Only check future/active reservations
-        ).first()
+        # 1-2. User's open reservations for this copy or any copy of this book
+        existing_reservations = list(
+            Reservation.objects.filter(
+                book_instance__book_id=self.book_instance.book_id,
+                employee=self.user,
+                future_return__gte=today  # Only check future/active reservations
+            ).order_by('future_rent')
+        )
+        existing_reservation = next(
+            (res for res in existing_reservations if res.book_instance_id == self.book_instance.pk), None
+        )
 
         if existing_reservation:
             raise ValidationError(
@@ -169,27 +196,26 @@ class ReservationForm(forms.Form):
                 f"Please cancel or wait for your current reservation to expire before making a new one."
             )
 
-        # 2. Check if user already has a reservation for ANY copy of this book
-        existing_book_reservation = Reservation.objects.filter(
-            book_instance__book=self.book_instance.book,
-            employee=self.user,
-            future_return__gte=today
-        ).first()
-
-        if existing_book_reservation:
+        if existing_reservations:
+            existing_book_reservation = existing_reservations[0]
             raise ValidationError(
                 f"You already have a reservation for another copy of '{self.book_instance.book.title}' "
-                f"(Copy {existing_book_reservation.book_instance.book_instance_id}) from "
+                f"(Copy {existing_book_reservation.book_instance_id}) from "
                 f"{existing_book_reservation.future_rent} to {existing_book_reservation.future_return}. "
                 f"Please cancel or wait for your current reservation to expire before making a new one."
             )
 
-        # 3. Check if user is currently borrowing this book instance
-        active_loan = Loan.objects.filter(
-            book_instance=self.book_instance,
-            employee=self.user,
-            return_date__isnull=True
-        ).first()
+        # 3-4. User's active loans of this copy or any copy of this book
+        active_loans = list(
+            Loan.objects.filter(
+                book_instance__book_id=self.book_instance.book_id,
+                employee=self.user,
+                return_date__isnull=True
+            )
+        )
+        active_loan = next(
+            (loan for loan in active_loans if loan.book_instance_id == self.book_instance.pk), None
+        )
 
         if active_loan:
             raise ValidationError(
@@ -197,49 +223,26 @@ class ReservationForm(forms.Form):
                 f"Please return it before making a reservation."
             )
 
-        # 4. Check if user is currently borrowing ANY copy of this book
-        active_loan_same_book = Loan.objects.filter(
-            book_instance__book=self.book_instance.book,
-            employee=self.user,
-            return_date__isnull=True
-        ).first()
-
-        if active_loan_same_book:
+        if active_loans:
+            active_loan_same_book = active_loans[0]
             raise ValidationError(
                 f"You are currently borrowing another copy of '{self.book_instance.book.title}' "
-                f"(Copy {active_loan_same_book.book_instance.book_instance_id}, due: {active_loan_same_book.due_date}). "
+                f"(Copy {active_loan_same_book.book_instance_id}, due: {active_loan_same_book.due_date}). "
                 f"Please return it before making a reservation."
             )
 
-        # 5. Existing validation for availability, date ranges, etc.
-        active_loans = Loan.objects.filter(
-            book_instance=self.book_instance, 
-            return_date__isnull=True
-        )
-        
-        if active_loans.exists():
-            latest_due_date = max(loan.due_date for loan in active_loans)
-            available_from = latest_due_date + timedelta(days=1)
-        else:
-            available_from = today
-
-        active_resvs = Reservation.objects.filter(
-            book_instance=self.book_instance, 
-            future_return__gt=today
-        ).exclude(employee=self.user)  # Exclude current user's reservations
-        
-        last_resv_end = max((res.future_return for res in active_resvs), default=today)
-        available_from = max(available_from, last_resv_end + timedelta(days=1))
-
-        if start < available_from:
-            raise ValidationError(f"Reservations can begin no earlier than {available_from}")
-
         if end > start + timedelta(weeks=2):
             raise ValidationError("Reservation cannot extend beyond two weeks from its start date.")
 
         if start >= end:
             raise ValidationError("End date must come after start date.")
 
+        # 5. The period must fit between the copy's loan and other reservations
+        self.timeline = AvailabilityTimeline.for_instance(self.book_instance)
+        conflict_message = reservation_conflict_message(self.timeline, start, end, self.user)
+        if conflict_message:
+            raise ValidationError(conflict_message)
+
         # # 6. Enforce max 3 active reservations for this instance (excluding current user)
         # overlapping = Reservation.objects.filter(
         #     book_instance=self.book_instance,
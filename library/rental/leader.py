@@ -0,0 +1,161 @@
+import atexit
+import logging
+import os
+import socket
+import threading
+import uuid
+from datetime import timedelta
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, transaction
+from django.db.models import DateTimeField, ExpressionWrapper, Q, Value
+from django.db.models.functions import Now
+from django.utils import timezone
+from .models import SchedulerLease
+
+# Same logger as the scheduler jobs
+logger = logging.getLogger('apscheduler_rental')
+
+LEASE_NAME = 'scheduler'
+
+
+def holder_id():
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+class SchedulerLeader:
+    """
+    Leader election over a SchedulerLease row, so exactly one of several
+    server processes (gunicorn workers, hosts) runs the scheduler.
+
+    Every SCHEDULER_LEASE_RENEW_SECONDS each process tries to take the lease:
+    a single UPDATE succeeds when it already holds the lease or the lease has
+    expired, using the database clock so hosts need not agree on the time.
+    The winner starts the scheduler and keeps renewing; the others stay idle.
+    If the holder dies it stops renewing, and another process takes over
+    within SCHEDULER_LEASE_SECONDS. A holder that fails to renew (database
+    errors, or the lease was taken over after a long stall) shuts its
+    scheduler down before anyone else can start one.
+    """
+
+    def __init__(self, scheduler_factory, name=LEASE_NAME, lease_seconds=None, renew_seconds=None):
+        self.scheduler_factory = scheduler_factory
+        self.name = name
+        self.lease_seconds = lease_seconds or settings.SCHEDULER_LEASE_SECONDS
+        self.renew_seconds = renew_seconds or settings.SCHEDULER_LEASE_RENEW_SECONDS
+        self.holder = holder_id()
+        self.pid = os.getpid()
+        self.scheduler = None
+        self._stop = threading.Event()
+
+    @property
+    def is_leader(self):
+        return self.scheduler is not None
+
+    def try_acquire(self):
+        """Take or renew the lease; True if this process holds it afterwards."""
+        expires_at = ExpressionWrapper(Now() + Value(timedelta(seconds=self.lease_seconds)), output_field=DateTimeField())
+        taken = SchedulerLease.objects.filter(name=self.name).filter(
+            Q(holder=self.holder) | Q(expires_at__lte=Now())
+        ).update(holder=self.holder, expires_at=expires_at)
+        if taken:
+            return True
+        try:
+            with transaction.atomic():
+                SchedulerLease.objects.create(
+                    name=self.name,
+                    holder=self.holder,
+                    expires_at=timezone.now() + timedelta(seconds=self.lease_seconds),
+                )
+        except IntegrityError:
+            # Someone else holds it
+            return False
+        return True
+
+    def release(self):
+        """Expire the lease now so another process takes over without waiting."""
+        SchedulerLease.objects.filter(name=self.name, holder=self.holder).update(expires_at=Now())
+
+    def tick(self):
+        """One election round: acquire/renew, then start or stop the scheduler to match."""
+        close_old_connections()
+        try:
+            leading = self.try_acquire()
+        except Exception as e:
+            logger.error(f"Scheduler lease check failed: {e}")
+            leading = False
+
+        if leading and self.scheduler is None:
+            logger.info(f"Scheduler lease acquired by {self.holder}; starting jobs")
+            self.scheduler = self.scheduler_factory()
+            self.scheduler.start()
+        elif not leading and self.scheduler is not None:
+            logger.warning(f"Scheduler lease lost by {self.holder}; stopping jobs")
+            self._shutdown_scheduler()
+        return leading
+
+    def run(self):
+        """Election loop; returns after stop()."""
+        logger.info(f"Scheduler leader election started as {self.holder}")
+        while not self._stop.is_set():
+            self.tick()
+            self._stop.wait(self.renew_seconds)
+
+    def stop(self):
+        self._stop.set()
+        if self.scheduler is not None:
+            self._shutdown_scheduler()
+            try:
+                self.release()
+            except Exception as e:
+                logger.error(f"Could not release scheduler lease: {e}")
+
+    def _shutdown_scheduler(self):
+        try:
+            self.scheduler.shutdown(wait=False)
+        except Exception as e:
+            logger.error(f"Scheduler shutdown failed: {e}")
+        self.scheduler = None
+
+
+_leader = None
+_lock = threading.Lock()
+
+
+def start_leader_election():
+    """Start this process's election thread (SCHEDULER_MODE = 'leader'), once per process."""
+    from .apscheduler import build_scheduler
+
+    global _leader
+    if _leader is not None and _leader.pid == os.getpid():
+        return _leader
+    with _lock:
+        if _leader is not None and _leader.pid == os.getpid():
+            return _leader
+        leader = SchedulerLeader(build_scheduler)
+        thread = threading.Thread(target=leader.run, name='scheduler-leader', daemon=True)
+        thread.start()
+        atexit.register(leader.stop)
+        _leader = leader
+        return leader
+
+
+def start_on_first_request(application):
+    """
+    Wrap a WSGI application so the election starts with the first request a
+    process serves. Only processes that serve requests compete: the
+    gunicorn --preload master imports library/wsgi.py but never serves, and
+    each forked worker starts its own thread.
+    """
+    def wrapper(environ, start_response):
+        start_leader_election()
+        return application(environ, start_response)
+    return wrapper
+
+
+def _reset_in_forked_child():
+    global _lock
+    # The parent's lock may have been held by another thread at fork time
+    _lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_in_forked_child)
@@ -0,0 +1,25 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from rental.archive import archive_returned_loans
+
+class Command(BaseCommand):
+    help = 'Move loans returned more than --days ago from Loan into LoanHistory'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.LOAN_ARCHIVE_AFTER_DAYS,
+                            help='Archive loans returned more than this many days ago')
+        parser.add_argument('--batch-size', type=int, default=settings.LOAN_ARCHIVE_BATCH_SIZE,
+                            help='Loans moved per transaction')
+        parser.add_argument('--dry-run', action='store_true', help='Only count the loans that would be archived')
+
+    def handle(self, *args, **options):
+        summary = archive_returned_loans(
+            days=options['days'], batch_size=options['batch_size'], dry_run=options['dry_run'],
+        )
+        if options['dry_run']:
+            self.stdout.write(f"{summary['archived']} loans returned before {summary['cutoff']} would be archived")
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f"Archived {summary['archived']} loans returned before {summary['cutoff']} "
+            f"in {summary['batches']} batches"
+        ))
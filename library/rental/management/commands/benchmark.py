@@ -0,0 +1,385 @@
+import json
+import logging
+import platform
+import random
+import subprocess
+import time
+from contextlib import nullcontext
+from datetime import date, timedelta
+
+import django
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import (
+    CaptureQueriesContext, override_settings, setup_test_environment, teardown_test_environment,
+)
+from django.urls import reverse
+from django.utils import timezone
+
+from accounts.models import CustomUser
+from registration_book.models import Book, BookInstance, Storage
+from registration_book.search import index_books
+from rental.apscheduler import process_reservations
+from rental.availability import AvailabilityTimeline
+from rental.models import Loan, Reservation, Review
+
+SCENARIOS = ('search', 'detail', 'rent', 'reserve', 'return_and_review', 'loan_history', 'process_reservations')
+
+TITLE_WORDS = ['吾輩', '猫', '坊っちゃん', 'こころ', '羅生門', '雪国', 'Python', 'Django', 'データベース', '入門',
+               '実践', '設計', 'アルゴリズム', '物語', '歴史', '科学', 'Web', 'SQL', '経済', '図書館']
+AUTHOR_NAMES = ['夏目漱石', '芥川龍之介', '川端康成', '太宰治', '宮沢賢治', 'Guido', 'Knuth', '森鴎外']
+MAX_ACTIVE_LOANS = 10
+
+
+def percentile(sorted_values, pct):
+    """Linear-interpolated percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = (len(sorted_values) - 1) * pct / 100
+    low = int(rank)
+    high = min(low + 1, len(sorted_values) - 1)
+    return sorted_values[low] + (sorted_values[high] - sorted_values[low]) * (rank - low)
+
+
+def summarize(samples):
+    timings = sorted(sample['ms'] for sample in samples)
+    queries = [sample['queries'] for sample in samples]
+    session_queries = [sample['session_queries'] for sample in samples]
+    return {
+        'iterations': len(samples),
+        'errors': sum(1 for sample in samples if not sample['ok']),
+        'mean_ms': round(sum(timings) / len(timings), 3) if timings else None,
+        'p50_ms': round(percentile(timings, 50), 3) if timings else None,
+        'p90_ms': round(percentile(timings, 90), 3) if timings else None,
+        'p95_ms': round(percentile(timings, 95), 3) if timings else None,
+        'p99_ms': round(percentile(timings, 99), 3) if timings else None,
+        'max_ms': round(timings[-1], 3) if timings else None,
+        'queries_mean': round(sum(queries) / len(queries), 2) if queries else None,
+        'queries_max': max(queries) if queries else None,
+        'session_queries_mean': round(sum(session_queries) / len(session_queries), 2) if session_queries else None,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        'Seed a throwaway test database with synthetic books, copies, users and loans, '
+        'time the employee rental flow and write latency percentiles and query counts as JSON'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--books', type=int, default=200)
+        parser.add_argument('--copies', type=int, default=3, help='Copies per book')
+        parser.add_argument('--users', type=int, default=50)
+        parser.add_argument('--history', type=int, default=20, help='Returned loans per user')
+        parser.add_argument('--iterations', type=int, default=30, help='Timed requests per scenario')
+        parser.add_argument('--warmup', type=int, default=3, help='Untimed requests per scenario')
+        parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+                            help=f'Comma-separated subset of: {", ".join(SCENARIOS)}')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--output', default='benchmark-results.json', help='JSON results file')
+        parser.add_argument('--compare', help='Previous JSON results file to diff against')
+        parser.add_argument('--session-engine', choices=sorted(settings.SESSION_ENGINES),
+                            help='Session engine for this run (default: settings.SESSION_ENGINE)')
+        parser.add_argument('--keepdb', action='store_true', help='Keep the test database between runs')
+        parser.add_argument('--noinput', '--no-input', action='store_false', dest='interactive')
+
+    def handle(self, *args, **options):
+        scenarios = [name.strip() for name in options['scenarios'].split(',') if name.strip()]
+        unknown = set(scenarios) - set(SCENARIOS)
+        if unknown:
+            raise CommandError(f"Unknown scenario(s): {', '.join(sorted(unknown))}")
+
+        self.options = options
+        self.random = random.Random(options['seed'])
+        self.clients = {}
+
+        # Per-reservation scheduler logging would drown the report
+        scheduler_logger = logging.getLogger('apscheduler_rental')
+        log_level = scheduler_logger.level
+        scheduler_logger.setLevel(logging.WARNING)
+
+        # Never touch the configured database: run against test_<NAME>
+        setup_test_environment()
+        with self.schema_without_migrations():
+            old_name = connection.creation.create_test_db(
+                verbosity=0, autoclobber=not options['interactive'], keepdb=options['keepdb'], serialize=False
+            )
+        # Clients are created after the override, so their sessions use the chosen engine
+        session_engine = settings.SESSION_ENGINES.get(options['session_engine'], settings.SESSION_ENGINE)
+        session_override = override_settings(SESSION_ENGINE=session_engine)
+        session_override.enable()
+        try:
+            started = time.perf_counter()
+            self.seed()
+            self.stdout.write(f"Seeded in {time.perf_counter() - started:.1f}s "
+                              f"({connection.vendor}, {Book.objects.count()} books, "
+                              f"{BookInstance.objects.count()} copies, {Loan.objects.count()} loans)")
+            results = {name: self.run_scenario(name) for name in scenarios}
+        finally:
+            session_override.disable()
+            connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=options['keepdb'])
+            teardown_test_environment()
+            scheduler_logger.setLevel(log_level)
+
+        report = {
+            'meta': {
+                'commit': git_commit(),
+                'timestamp': timezone.now().isoformat(),
+                'database': connection.vendor,
+                'session_engine': session_engine,
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'options': {key: options[key] for key in
+                            ('books', 'copies', 'users', 'history', 'iterations', 'warmup', 'seed')},
+            },
+            'results': results,
+        }
+        with open(options['output'], 'w', encoding='utf-8') as fh:
+            json.dump(report, fh, indent=2)
+
+        self.print_report(results)
+        if options['compare']:
+            self.print_comparison(results, options['compare'])
+        self.stdout.write(self.style.SUCCESS(f"Results written to {options['output']}"))
+
+    @staticmethod
+    def schema_without_migrations():
+        """
+        SQLite cannot replay rental 0002 (it drops the only column of a table),
+        so the throwaway SQLite database is created straight from the models.
+        PostgreSQL runs the migrations, which add the partitioned loan history
+        and the search index.
+        """
+        if connection.vendor != 'sqlite':
+            return nullcontext()
+        return override_settings(MIGRATION_MODULES={app.label: None for app in apps.get_app_configs()})
+
+    # Seeding
+
+    def seed(self):
+        options = self.options
+        rnd = self.random
+        today = date.today()
+
+        password = make_password('benchmark')
+        users = CustomUser.objects.bulk_create([
+            CustomUser(username=f'bench{i:05d}', password=password, user_type='employee')
+            for i in range(options['users'])
+        ], batch_size=1000)
+        self.users = users
+        storages = Storage.objects.bulk_create([Storage(storage_name=f'Shelf {i}') for i in range(10)])
+
+        books = []
+        for i in range(options['books']):
+            title = ' '.join(rnd.sample(TITLE_WORDS, 2)) + f' {i}'
+            books.append(Book(
+                title=title,
+                author=rnd.choice(AUTHOR_NAMES),
+                publish_date=str(rnd.randint(1900, 2025)),
+                isbn=f'978{i:010d}',
+                total_copies=options['copies'],
+                available_copies=options['copies'],
+            ))
+        books = Book.objects.bulk_create(books, batch_size=1000)
+        index_books(books)
+        self.books = books
+
+        instances = BookInstance.objects.bulk_create([
+            BookInstance(book=book, storage=rnd.choice(storages))
+            for book in books for _ in range(options['copies'])
+        ], batch_size=1000)
+        self.instances = instances
+
+        # Returned loans make up each user's history
+        history = []
+        for user in users:
+            for _ in range(options['history']):
+                start = today - timedelta(days=rnd.randint(15, 720))
+                history.append(Loan(
+                    book_instance=rnd.choice(instances), employee_id=user.pk,
+                    loan_start=start, due_date=start + timedelta(days=14), return_date=start + timedelta(days=rnd.randint(1, 14)),
+                ))
+        Loan.objects.bulk_create(history, batch_size=1000)
+
+        # A third of the copies are on loan, at most half the loan limit per user
+        on_loan = rnd.sample(instances, min(len(instances) // 3, len(users) * (MAX_ACTIVE_LOANS // 2)))
+        active = []
+        for index, instance in enumerate(on_loan):
+            start = today - timedelta(days=rnd.randint(0, 20))
+            active.append(Loan(
+                book_instance=instance, employee_id=users[index % len(users)].pk,
+                loan_start=start, due_date=start + timedelta(days=14),
+            ))
+        Loan.objects.bulk_create(active, batch_size=1000)
+        for book_id, count in self._per_book(active).items():
+            Book.objects.adjust_copy_counts(book_id, available=-count)
+
+        reviews = {}
+        for loan in history[::3]:
+            book_id = loan.book_instance.book_id
+            reviews[(book_id, loan.employee_id)] = Review(
+                book_id=book_id, employee_id=loan.employee_id, score=rnd.randint(1, 5),
+                review_title='Benchmark', review='Synthetic review', date=loan.return_date,
+            )
+        Review.objects.bulk_create(reviews.values(), batch_size=1000)
+
+        on_loan_ids = {instance.pk for instance in on_loan}
+        self.free_instances = [instance for instance in instances if instance.pk not in on_loan_ids]
+        rnd.shuffle(self.free_instances)
+        self.active_loans = active
+        rnd.shuffle(self.active_loans)
+
+    @staticmethod
+    def _per_book(loans):
+        counts = {}
+        for loan in loans:
+            counts[loan.book_instance.book_id] = counts.get(loan.book_instance.book_id, 0) + 1
+        return counts
+
+    def client_for(self, user):
+        if user.pk not in self.clients:
+            client = Client()
+            client.force_login(user)
+            self.clients[user.pk] = client
+        return self.clients[user.pk]
+
+    def user_with_capacity(self):
+        """A user below the active-loan limit."""
+        for _ in range(len(self.users)):
+            user = self.random.choice(self.users)
+            if Loan.objects.filter(employee_id=user.pk, return_date__isnull=True).count() < MAX_ACTIVE_LOANS - 1:
+                return user
+        raise CommandError('Every benchmark user is at the loan limit; increase --users')
+
+    # Scenarios: prepare_<name>() does the untimed setup and returns a callable
+    # whose execution is timed. The callable returns True on success.
+
+    def run_scenario(self, name):
+        prepare = getattr(self, f'prepare_{name}')
+        samples = []
+        for iteration in range(self.options['warmup'] + self.options['iterations']):
+            action = prepare()
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                ok = action()
+                elapsed = (time.perf_counter() - started) * 1000
+            if iteration >= self.options['warmup']:
+                samples.append({
+                    'ms': elapsed,
+                    'queries': len(queries),
+                    'session_queries': sum('django_session' in query['sql'] for query in queries.captured_queries),
+                    'ok': bool(ok),
+                })
+        return summarize(samples)
+
+    def _request(self, client, method, url, data=None, expect=(200, 302)):
+        def action():
+            response = getattr(client, method)(url, data or {})
+            return response.status_code in expect
+        return action
+
+    def prepare_search(self):
+        word = self.random.choice(TITLE_WORDS)
+        return self._request(self.client_for(self.random.choice(self.users)), 'get',
+                             reverse('book_instance_results'), {'title': word[:2]})
+
+    def prepare_detail(self):
+        instance = self.random.choice(self.instances)
+        return self._request(self.client_for(self.random.choice(self.users)), 'get',
+                             reverse('book_instance_detail', args=[instance.pk]))
+
+    def prepare_rent(self):
+        if not self.free_instances:
+            raise CommandError('Ran out of free copies to rent; increase --books or --copies')
+        instance = self.free_instances.pop()
+        user = self.user_with_capacity()
+        return self._request(self.client_for(user), 'post',
+                             reverse('rent_with_due_date', args=[instance.pk]),
+                             {'due_date': date.today() + timedelta(days=7)}, expect=(200,))
+
+    def prepare_reserve(self):
+        loan = self.random.choice(self.active_loans)
+        instance = loan.book_instance
+        # Someone who neither holds nor has reserved any copy of this book
+        busy = set(Loan.objects.filter(book_instance__book_id=instance.book_id, return_date__isnull=True)
+                   .values_list('employee_id', flat=True))
+        busy |= set(Reservation.objects.filter(book_instance__book_id=instance.book_id)
+                    .values_list('employee_id', flat=True))
+        user = next((user for user in self.users if user.pk not in busy), None)
+        if user is None:
+            raise CommandError('No user left to reserve with; increase --users')
+        start = AvailabilityTimeline.for_instance(instance).first_free_window(
+            3, not_before=date.today() + timedelta(days=1)
+        )
+        return self._request(self.client_for(user), 'post', reverse('reserve_book', args=[instance.pk]),
+                             {'future_rent': start, 'future_return': start + timedelta(days=3)}, expect=(200,))
+
+    def prepare_return_and_review(self):
+        if not self.active_loans:
+            raise CommandError('Ran out of active loans to return; increase --users or --books')
+        loan = self.active_loans.pop()
+        user = next(user for user in self.users if user.pk == loan.employee_id)
+        return self._request(self.client_for(user), 'post', reverse('return_and_review', args=[loan.loan_id]),
+                             {'review_title': 'Bench', 'score': 4, 'review': 'Returned by benchmark'},
+                             expect=(302,))
+
+    def prepare_loan_history(self):
+        return self._request(self.client_for(self.random.choice(self.users)), 'get', reverse('loan_history'))
+
+    def prepare_process_reservations(self):
+        """A batch of reservations due today, half of them on free copies."""
+        today = date.today()
+        batch = []
+        for instance in self.random.sample(self.instances, min(50, len(self.instances))):
+            user = self.random.choice(self.users)
+            if Reservation.objects.filter(book_instance=instance, employee_id=user.pk).exists():
+                continue
+            batch.append(Reservation(book_instance=instance, employee_id=user.pk,
+                                     future_rent=today, future_return=today + timedelta(days=7)))
+        Reservation.objects.bulk_create(batch)
+
+        def action():
+            summary = process_reservations()
+            return summary['errors'] == 0
+        return action
+
+    # Reporting
+
+    def print_report(self, results):
+        header = f"{'scenario':<22}{'n':>5}{'err':>5}{'p50':>10}{'p90':>10}{'p95':>10}{'p99':>10}{'max':>10}{'q':>8}{'qmax':>6}{'sess':>6}"
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        for name, row in results.items():
+            self.stdout.write(
+                f"{name:<22}{row['iterations']:>5}{row['errors']:>5}"
+                f"{row['p50_ms']:>10.2f}{row['p90_ms']:>10.2f}{row['p95_ms']:>10.2f}"
+                f"{row['p99_ms']:>10.2f}{row['max_ms']:>10.2f}{row['queries_mean']:>8.1f}{row['queries_max']:>6}{row['session_queries_mean']:>6.1f}"
+            )
+
+    def print_comparison(self, results, path):
+        with open(path, encoding='utf-8') as fh:
+            previous = json.load(fh)
+        self.stdout.write(f"\nCompared with {path} (commit {previous['meta'].get('commit')}):")
+        for name, row in results.items():
+            old = previous['results'].get(name)
+            if not old:
+                continue
+            p50 = (row['p50_ms'] - old['p50_ms']) / old['p50_ms'] * 100 if old['p50_ms'] else 0
+            p95 = (row['p95_ms'] - old['p95_ms']) / old['p95_ms'] * 100 if old['p95_ms'] else 0
+            queries = row['queries_mean'] - old['queries_mean']
+            session = row['session_queries_mean'] - old.get('session_queries_mean', 0)
+            line = f"{name:<22} p50 {p50:+7.1f}%  p95 {p95:+7.1f}%  queries {queries:+.1f} (session {session:+.1f})"
+            self.stdout.write(self.style.WARNING(line) if p95 > 20 or queries > 0 else line)
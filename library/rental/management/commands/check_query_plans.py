@@ -0,0 +1,112 @@
+import json
+import uuid
+from datetime import date
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from rental.models import Loan, LoanHistory, Reservation, Review
+from rental.pagination import KeysetPaginator
+from registration_book.models import BookInstance
+
+
+def hot_queries():
+    """(name, queryset) for the predicates the rental flow runs most."""
+    today = date.today()
+    instance_id = uuid.uuid4()
+    employee_id = uuid.uuid4()
+    # Keyset condition of a loan history page after the first (rental.views.loan_history)
+    history_after = KeysetPaginator(None, ('-loan_start', '-loan_id'), 10, nullable=('loan_start',))._after(
+        [today, 1000], nulls_largest=connection.features.nulls_order_largest,
+    )
+    return [
+        ('active loan of a copy',
+         Loan.objects.filter(book_instance_id=instance_id, return_date__isnull=True)),
+        ('active loans of an employee',
+         Loan.objects.filter(employee_id=employee_id, return_date__isnull=True)),
+        ('overdue loans',
+         Loan.objects.filter(return_date__isnull=True, due_date__lt=today)),
+        ('loan history page',
+         Loan.objects.filter(employee_id=employee_id, return_date__isnull=False)
+         .filter(history_after).order_by('-loan_start', '-loan_id')[:11]),
+        ('archived loan history page',
+         LoanHistory.objects.filter(employee_id=employee_id)
+         .filter(history_after).order_by('-loan_start', '-loan_id')[:11]),
+        ('due reservations',
+         Reservation.objects.filter(future_rent__lte=today).order_by('future_rent', 'reserve_id')[:500]),
+        ('reservation timeline of a copy',
+         Reservation.objects.filter(book_instance_id=instance_id, future_return__gte=today)),
+        ('open reservations of an employee',
+         Reservation.objects.filter(employee_id=employee_id, future_return__gte=today)),
+        ('reviews of a book',
+         Review.objects.filter(book_id=1)),
+        ('copies of a book',
+         BookInstance.objects.filter(book_id=1)),
+    ]
+
+
+def postgres_seq_scans(plan):
+    """Relation names of every Seq Scan node in an EXPLAIN (FORMAT JSON) plan."""
+    found = []
+    if plan.get('Node Type') == 'Seq Scan':
+        found.append(plan.get('Relation Name'))
+    for child in plan.get('Plans', []):
+        found.extend(postgres_seq_scans(child))
+    return found
+
+
+def sqlite_full_scans(rows):
+    """Tables SQLite's EXPLAIN QUERY PLAN reads without an index."""
+    found = []
+    for row in rows:
+        detail = row[-1]
+        if detail.startswith('SCAN ') and 'INDEX' not in detail:
+            found.append(detail.split()[1])
+    return found
+
+
+class Command(BaseCommand):
+    help = 'EXPLAIN the hot Loan/Reservation queries and flag sequential scans'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--planner-default', action='store_true',
+            help='PostgreSQL: keep enable_seqscan on. By default seq scans are disabled, so a '
+                 'remaining Seq Scan means no usable index (small tables are otherwise always seq scanned)',
+        )
+        parser.add_argument('--verbose-plans', action='store_true', help='Print every plan')
+
+    def handle(self, *args, **options):
+        if connection.vendor not in ('postgresql', 'sqlite'):
+            raise CommandError(f"Unsupported database: {connection.vendor}")
+
+        flagged = 0
+        for name, queryset in hot_queries():
+            sql, params = queryset.query.sql_with_params()
+            with transaction.atomic(), connection.cursor() as cursor:
+                if connection.vendor == 'postgresql':
+                    if not options['planner_default']:
+                        cursor.execute('SET LOCAL enable_seqscan = off')
+                    cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+                    plan = cursor.fetchone()[0]
+                    if isinstance(plan, str):
+                        plan = json.loads(plan)
+                    scans = postgres_seq_scans(plan[0]['Plan'])
+                    text = json.dumps(plan[0]['Plan'], indent=2)
+                else:
+                    cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+                    rows = cursor.fetchall()
+                    scans = sqlite_full_scans(rows)
+                    text = '\n'.join(row[-1] for row in rows)
+
+            if scans:
+                flagged += 1
+                self.stdout.write(self.style.WARNING(f"SEQ SCAN  {name}: {', '.join(scans)}"))
+            else:
+                self.stdout.write(f"ok        {name}")
+            if options['verbose_plans'] or scans:
+                self.stdout.write(f"          {sql}")
+            if options['verbose_plans']:
+                self.stdout.write(text)
+
+        if flagged:
+            raise CommandError(f"{flagged} quer{'y' if flagged == 1 else 'ies'} use a sequential scan")
+        self.stdout.write(self.style.SUCCESS('All hot queries use an index'))
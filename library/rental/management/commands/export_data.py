@@ -0,0 +1,38 @@
+import sys
+from pathlib import Path
+from django.core.management.base import BaseCommand, CommandError
+from rental.exports import DATASETS, FORMATS, UnknownExport, parse_since, stream_export
+
+class Command(BaseCommand):
+    help = 'Stream a dataset as CSV or NDJSON, optionally only the rows changed since a watermark'
+
+    def add_arguments(self, parser):
+        parser.add_argument('dataset', choices=sorted(DATASETS))
+        parser.add_argument('--format', choices=sorted(FORMATS), default='csv')
+        parser.add_argument('--since', help='Only rows changed after this ISO 8601 datetime')
+        parser.add_argument('--output', help='File to write (default: stdout)')
+        parser.add_argument('--watermark-file',
+                            help='Read --since from this file (if it exists) and store the next watermark '
+                                 'in it after a successful export')
+
+    def handle(self, *args, **options):
+        watermark_file = Path(options['watermark_file']) if options['watermark_file'] else None
+        since = options['since']
+        if since is None and watermark_file and watermark_file.exists():
+            since = watermark_file.read_text()
+        try:
+            since = parse_since(since) if since else None
+            chunks, watermark = stream_export(options['dataset'], options['format'], since)
+        except (ValueError, UnknownExport) as e:
+            raise CommandError(str(e))
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8', newline='') as output:
+                output.writelines(chunks)
+        else:
+            sys.stdout.writelines(chunks)
+            sys.stdout.flush()
+
+        if watermark_file:
+            watermark_file.write_text(watermark.isoformat() + '\n')
+        self.stderr.write(f"Exported {options['dataset']} changed after {since or 'the beginning'}; next watermark {watermark.isoformat()}")
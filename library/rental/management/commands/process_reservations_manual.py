@@ -1,38 +1,23 @@
 from django.core.management.base import BaseCommand
 from django.utils import timezone
-from django.db import transaction
-from rental.models import Reservation, Loan
+from rental.reservations import promote_due_reservations
 
 class Command(BaseCommand):
     help = 'Manually process reservations for today and convert them to loans'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Reservations locked and converted per transaction')
+
     def handle(self, *args, **options):
         today = timezone.localdate()
         self.stdout.write(f"Processing reservations for date: {today}")
-        
-        with transaction.atomic():
-            reservations = Reservation.objects.select_for_update().filter(
-                start_date__lte=today,
-                status=Reservation.Status.RESERVED
-            )
-            
-            processed_count = 0
-            for reservation in reservations:
-                loan = Loan.objects.create(
-                    instance=reservation.instance,
-                    borrower=reservation.user,
-                    start_date=today,
-                    due_date=reservation.expected_return,
-                )
-                
-                reservation.status = Reservation.Status.CONVERTED
-                reservation.save(update_fields=["status"])
-                
-                processed_count += 1
-                self.stdout.write(
-                    self.style.SUCCESS(
-                        f"✓ Converted reservation {reservation.id} to loan {loan.id}"
-                    )
-                )
-            
-            self.stdout.write(f"Processed {processed_count} reservations")
+
+        summary = promote_due_reservations(today=today, batch_size=options['batch_size'])
+
+        for loan_id in summary['loan_ids']:
+            self.stdout.write(self.style.SUCCESS(f"✓ Created loan {loan_id}"))
+        self.stdout.write(
+            f"Processed {summary['due']} reservations: {summary['converted']} converted, "
+            f"{summary['duplicates']} duplicates removed, {summary['waiting']} waiting, "
+            f"{summary['errors']} errors"
+        )
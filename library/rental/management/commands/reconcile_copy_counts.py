@@ -0,0 +1,59 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from django.db.models import Count, Q
+from registration_book.cache import invalidate_all
+from registration_book.models import Book
+
+
+class Command(BaseCommand):
+    help = 'Recompute Book.total_copies / Book.available_copies from BookInstance and active Loan rows'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only report drifted books without updating them',
+        )
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+
+        books = Book.objects.annotate(
+            instance_count=Count('instances', distinct=True),
+            loaned_count=Count(
+                'instances',
+                filter=Q(instances__loan__return_date__isnull=True, instances__loan__isnull=False),
+                distinct=True
+            ),
+        ).only('book_id', 'title', 'total_copies', 'available_copies')
+
+        drifted = []
+        for book in books.iterator(chunk_size=1000):
+            total = book.instance_count
+            available = total - book.loaned_count
+            if book.total_copies != total or book.available_copies != available:
+                self.stdout.write(
+                    f"Book {book.book_id} '{book.title}': "
+                    f"total {book.total_copies} -> {total}, available {book.available_copies} -> {available}"
+                )
+                book.total_copies = total
+                book.available_copies = available
+                drifted.append(book)
+
+        if not drifted:
+            self.stdout.write(self.style.SUCCESS("All copy counters are consistent"))
+            return
+
+        if dry_run:
+            self.stdout.write(self.style.WARNING(f"{len(drifted)} books drifted (dry run, nothing updated)"))
+            return
+
+        with transaction.atomic():
+            now = timezone.now()
+            for book in drifted:
+                book.updated_at = now
+            Book.objects.bulk_update(drifted, ['total_copies', 'available_copies'] + ['updated_at'], batch_size=500)
+            # bulk_update sends no signals
+            invalidate_all()
+        self.stdout.write(self.style.SUCCESS(f"Reconciled {len(drifted)} books"))
@@ -0,0 +1,70 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from django.db.models import Count
+from registration_book.cache import invalidate_all
+from registration_book.models import RATING_SCORES, Book
+from rental.models import Review
+
+RATING_FIELDS = ['rating_count', 'rating_sum', 'rating_avg'] + [f'rating_{score}' for score in RATING_SCORES]
+
+
+class Command(BaseCommand):
+    help = 'Recompute the Book rating summary (count, sum, average, 1-5 histogram) from Review rows'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only report drifted books without updating them',
+        )
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+
+        histograms = {}
+        rows = (
+            Review.objects.filter(book__isnull=False, score__in=RATING_SCORES)
+            .values('book_id', 'score')
+            .annotate(count=Count('review_id'))
+            .order_by()
+        )
+        for row in rows:
+            histograms.setdefault(row['book_id'], {})[row['score']] = row['count']
+
+        drifted = []
+        books = Book.objects.only('book_id', 'title', *RATING_FIELDS)
+        for book in books.iterator(chunk_size=1000):
+            histogram = histograms.get(book.book_id, {})
+            expected = {f'rating_{score}': histogram.get(score, 0) for score in RATING_SCORES}
+            expected['rating_count'] = sum(histogram.values())
+            expected['rating_sum'] = sum(score * count for score, count in histogram.items())
+            expected['rating_avg'] = expected['rating_sum'] / expected['rating_count'] if expected['rating_count'] else None
+
+            current = {field: getattr(book, field) for field in RATING_FIELDS}
+            if current != expected:
+                self.stdout.write(
+                    f"Book {book.book_id} '{book.title}': "
+                    f"{current['rating_count']} reviews / sum {current['rating_sum']} -> "
+                    f"{expected['rating_count']} reviews / sum {expected['rating_sum']}"
+                )
+                for field, value in expected.items():
+                    setattr(book, field, value)
+                drifted.append(book)
+
+        if not drifted:
+            self.stdout.write(self.style.SUCCESS("All rating summaries are consistent"))
+            return
+
+        if dry_run:
+            self.stdout.write(self.style.WARNING(f"{len(drifted)} books drifted (dry run, nothing updated)"))
+            return
+
+        with transaction.atomic():
+            now = timezone.now()
+            for book in drifted:
+                book.updated_at = now
+            Book.objects.bulk_update(drifted, RATING_FIELDS + ['updated_at'], batch_size=500)
+            # bulk_update sends no signals
+            invalidate_all()
+        self.stdout.write(self.style.SUCCESS(f"Reconciled {len(drifted)} books"))
@@ -1,41 +1,36 @@
 import logging
-from django.conf import settings
 from django.core.management.base import BaseCommand
+from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.schedulers.blocking import BlockingScheduler
-from apscheduler.triggers.cron import CronTrigger
-from django_apscheduler.jobstores import DjangoJobStore
-from django_apscheduler.models import DjangoJobExecution
-from django_apscheduler import util
 
-from rental.apscheduler import process_reservations, delete_old_job_executions
+from rental.apscheduler import build_scheduler
+from rental.leader import SchedulerLeader
 
 logger = logging.getLogger(__name__)
 
 class Command(BaseCommand):
-    help = "Runs APScheduler."
+    help = "Runs APScheduler with the jobs in settings.SCHEDULER_JOBS."
 
-    def handle(self, *args, **options):
-        scheduler = BlockingScheduler(timezone=settings.TIME_ZONE)
-        scheduler.add_jobstore(DjangoJobStore(), "default")
-
-        scheduler.add_job(
-            process_reservations,
-            trigger=CronTrigger(hour=0, minute=0, timezone=settings.TIME_ZONE),
-            id="promote_reservations",
-            max_instances=1,
-            replace_existing=True,
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--leader', action='store_true',
+            help='Take part in leader election, so several copies of this command '
+                 '(or server processes in SCHEDULER_MODE = "leader") run the jobs only once',
         )
 
-        scheduler.add_job(
-            delete_old_job_executions,
-            trigger=CronTrigger(
-                day_of_week="sun", hour=1, minute=0, timezone=settings.TIME_ZONE
-            ),
-            id="delete_old_job_executions",
-            max_instances=1,
-            replace_existing=True,
-        )
+    def handle(self, *args, **options):
+        if options['leader']:
+            leader = SchedulerLeader(lambda: build_scheduler(BackgroundScheduler))
+            try:
+                logger.info("Starting scheduler leader election...")
+                leader.run()
+            except KeyboardInterrupt:
+                logger.info("Stopping scheduler...")
+                leader.stop()
+                logger.info("Scheduler shut down successfully!")
+            return
 
+        scheduler = build_scheduler(BlockingScheduler)
         try:
             logger.info("Starting scheduler...")
             scheduler.start()
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from rental.notifications import send_loan_digests
+
+class Command(BaseCommand):
+    help = 'Email each employee a digest of their overdue and due-soon loans'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only count the digests that would be sent')
+
+    def handle(self, *args, **options):
+        summary = send_loan_digests(dry_run=options['dry_run'])
+        verb = 'would be sent' if options['dry_run'] else 'sent'
+        self.stdout.write(
+            f"{summary['employees'] - summary['no_email']} digests {verb} covering {summary['loans']} loans "
+            f"({summary['no_email']} employees without email skipped)"
+        )
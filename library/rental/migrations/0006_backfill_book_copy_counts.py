@@ -0,0 +1,30 @@
+from django.db import migrations
+from django.db.models import Count, Q
+
+
+def backfill_copy_counts(apps, schema_editor):
+    Book = apps.get_model('registration_book', 'Book')
+    books = Book.objects.annotate(
+        instance_count=Count('instances', distinct=True),
+        loaned_count=Count(
+            'instances',
+            filter=Q(instances__loan__return_date__isnull=True, instances__loan__isnull=False),
+            distinct=True
+        ),
+    )
+    for book in books.iterator():
+        book.total_copies = book.instance_count
+        book.available_copies = book.instance_count - book.loaned_count
+        book.save(update_fields=['total_copies', 'available_copies'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('registration_book', '0011_book_copy_counts'),
+        ('rental', '0005_reservation_unique_reservation_per_user_per_instance'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_copy_counts, migrations.RunPython.noop),
+    ]
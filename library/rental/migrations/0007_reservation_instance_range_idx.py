@@ -0,0 +1,19 @@
+# Generated by Django 5.2.2 on 2026-10-18 04:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0002_customuser_email_customuser_first_name_and_more'),
+        ('registration_book', '0014_bookimportjob'),
+        ('rental', '0006_backfill_book_copy_counts'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='reservation',
+            index=models.Index(fields=['book_instance', 'future_return', 'future_rent'], name='reservation_instance_range_idx'),
+        ),
+    ]
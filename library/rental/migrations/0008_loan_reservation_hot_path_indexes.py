@@ -0,0 +1,35 @@
+# Generated by Django 5.2.2 on 2026-10-18 04:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0002_customuser_email_customuser_first_name_and_more'),
+        ('registration_book', '0014_bookimportjob'),
+        ('rental', '0007_reservation_instance_range_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='loan',
+            index=models.Index(condition=models.Q(('return_date__isnull', True)), fields=['employee', 'due_date'], name='loan_active_employee_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='loan',
+            index=models.Index(condition=models.Q(('return_date__isnull', True)), fields=['due_date'], name='loan_active_due_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='loan',
+            index=models.Index(fields=['employee', '-loan_start', '-loan_id'], name='loan_employee_history_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reservation',
+            index=models.Index(fields=['future_rent', 'reserve_id'], name='reservation_due_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reservation',
+            index=models.Index(fields=['employee', 'future_return'], name='reservation_employee_idx'),
+        ),
+    ]
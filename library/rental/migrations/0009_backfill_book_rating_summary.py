@@ -0,0 +1,40 @@
+from django.db import migrations
+from django.db.models import Count
+
+
+def backfill_rating_summary(apps, schema_editor):
+    Book = apps.get_model('registration_book', 'Book')
+    Review = apps.get_model('rental', 'Review')
+    summaries = {}
+    rows = (
+        Review.objects.filter(book__isnull=False, score__in=range(1, 6))
+        .values('book_id', 'score')
+        .annotate(count=Count('review_id'))
+        .order_by()
+    )
+    for row in rows:
+        summaries.setdefault(row['book_id'], {})[row['score']] = row['count']
+
+    for book in Book.objects.filter(book_id__in=summaries).iterator():
+        histogram = summaries[book.book_id]
+        book.rating_count = sum(histogram.values())
+        book.rating_sum = sum(score * count for score, count in histogram.items())
+        book.rating_avg = book.rating_sum / book.rating_count
+        for score in range(1, 6):
+            setattr(book, f'rating_{score}', histogram.get(score, 0))
+        book.save(update_fields=[
+            'rating_count', 'rating_sum', 'rating_avg',
+            'rating_1', 'rating_2', 'rating_3', 'rating_4', 'rating_5',
+        ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('registration_book', '0015_book_rating_summary'),
+        ('rental', '0008_loan_reservation_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_rating_summary, migrations.RunPython.noop),
+    ]
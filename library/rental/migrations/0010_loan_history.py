@@ -0,0 +1,83 @@
+# Generated by Django 5.2.2 on 2026-10-18 04:17
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def create_loan_history_table(apps, schema_editor):
+    """
+    PostgreSQL: a table range-partitioned by return_date (one partition per
+    year, created by rental.archive, plus a default partition). A partitioned
+    table's primary key must contain the partition key, hence
+    (loan_id, return_date); loan_id stays unique because it is copied from
+    Loan. Other databases get the plain table.
+    """
+    LoanHistory = apps.get_model('rental', 'LoanHistory')
+    if schema_editor.connection.vendor != 'postgresql':
+        schema_editor.create_model(LoanHistory)
+        return
+
+    connection = schema_editor.connection
+    table = schema_editor.quote_name(LoanHistory._meta.db_table)
+    columns = []
+    for name in ('book_instance', 'employee'):
+        field = LoanHistory._meta.get_field(name)
+        target = field.target_field
+        columns.append(
+            f'{schema_editor.quote_name(field.column)} {target.db_type(connection)} NOT NULL '
+            f'REFERENCES {schema_editor.quote_name(field.related_model._meta.db_table)} '
+            f'({schema_editor.quote_name(target.column)}) DEFERRABLE INITIALLY DEFERRED'
+        )
+    book_instance_column, employee_column = columns
+    schema_editor.execute(
+        f'CREATE TABLE {table} ('
+        f'loan_id integer NOT NULL, '
+        f'{book_instance_column}, '
+        f'{employee_column}, '
+        f'loan_start date NULL, '
+        f'due_date date NULL, '
+        f'return_date date NOT NULL, '
+        f'archived_at timestamp with time zone NOT NULL, '
+        f'PRIMARY KEY (loan_id, return_date)'
+        f') PARTITION BY RANGE (return_date)'
+    )
+    schema_editor.execute(f'CREATE TABLE rental_loanhistory_default PARTITION OF {table} DEFAULT')
+    schema_editor.execute(f'CREATE INDEX rental_loanhistory_book_instance_idx ON {table} (book_instance_id)')
+    schema_editor.execute(
+        f'CREATE INDEX loanhistory_employee_idx ON {table} (employee_id, loan_start DESC, loan_id DESC)'
+    )
+
+
+def drop_loan_history_table(apps, schema_editor):
+    schema_editor.delete_model(apps.get_model('rental', 'LoanHistory'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0002_customuser_email_customuser_first_name_and_more'),
+        ('registration_book', '0015_book_rating_summary'),
+        ('rental', '0009_backfill_book_rating_summary'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(state_operations=[
+            migrations.CreateModel(
+                name='LoanHistory',
+                fields=[
+                    ('loan_id', models.IntegerField(primary_key=True, serialize=False, verbose_name='貸出状況ID')),
+                    ('loan_start', models.DateField(blank=True, null=True, verbose_name='貸出開始日')),
+                    ('due_date', models.DateField(blank=True, null=True, verbose_name='返却予定日')),
+                    ('return_date', models.DateField(verbose_name='返却日')),
+                    ('archived_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='アーカイブ日時')),
+                    ('book_instance', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_loans', to='registration_book.bookinstance')),
+                    ('employee', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_loans', to='accounts.employee')),
+                ],
+                options={
+                    'indexes': [models.Index(fields=['employee', '-loan_start', '-loan_id'], name='loanhistory_employee_idx')],
+                },
+            ),
+        ]),
+        migrations.RunPython(create_loan_history_table, drop_loan_history_table),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.2 on 2026-10-18 04:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rental', '0010_loan_history'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SchedulerLease',
+            fields=[
+                ('name', models.CharField(max_length=100, primary_key=True, serialize=False, verbose_name='リース名')),
+                ('holder', models.CharField(blank=True, max_length=255, verbose_name='保持者')),
+                ('expires_at', models.DateTimeField(verbose_name='有効期限')),
+            ],
+        ),
+    ]
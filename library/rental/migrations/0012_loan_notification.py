@@ -0,0 +1,26 @@
+# Generated by Django 5.2.2 on 2026-10-18 04:26
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rental', '0011_scheduler_lease'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LoanNotification',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('due_soon', 'Due soon'), ('overdue', 'Overdue')], max_length=10, verbose_name='種別')),
+                ('sent_on', models.DateField(verbose_name='送信日')),
+                ('loan', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='notifications', to='rental.loan')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('loan', 'kind', 'sent_on'), name='unique_loan_notification_per_day')],
+            },
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.2 on 2026-10-18 04:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0002_customuser_email_customuser_first_name_and_more'),
+        ('registration_book', '0016_export_watermark'),
+        ('rental', '0012_loan_notification'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='loan',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True, verbose_name='更新日時'),
+        ),
+        migrations.AddField(
+            model_name='reservation',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True, verbose_name='更新日時'),
+        ),
+        migrations.AddField(
+            model_name='review',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True, verbose_name='更新日時'),
+        ),
+        migrations.AddIndex(
+            model_name='loanhistory',
+            index=models.Index(fields=['archived_at'], name='loanhistory_archived_idx'),
+        ),
+    ]
@@ -14,7 +14,19 @@ class Loan(models.Model):
     loan_start = models.DateField('貸出開始日', null=True, blank=True)
     due_date = models.DateField('返却予定日', null=True, blank=True)
     return_date = models.DateField('返却日', null=True, blank=True)
+    # Export watermark (rental.exports); UPDATE-only code paths set it explicitly
+    updated_at = models.DateTimeField('更新日時', auto_now=True, db_index=True)
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.remember_open()
+        return instance
+
+    def remember_open(self):
+        """Note whether the stored row is an open loan (None if unknown); see rental.signals."""
+        self._open_state = self.__dict__['return_date'] is None if 'return_date' in self.__dict__ else None
+
     @property
     def loaned(self):
         return bool(self.loan_start) and self.return_date is None
@@ -46,6 +58,66 @@ class Loan(models.Model):
                 name='unique_active_loan_per_instance'
             )
         ]
+        indexes = [
+            # Active loans of an employee (loan limit, loan history), oldest due first
+            models.Index(fields=['employee', 'due_date'], condition=models.Q(return_date__isnull=True),
+                         name='loan_active_employee_idx'),
+            # Overdue / due-soon loans across all employees
+            models.Index(fields=['due_date'], condition=models.Q(return_date__isnull=True),
+                         name='loan_active_due_idx'),
+            # An employee's full history, newest first
+            models.Index(fields=['employee', '-loan_start', '-loan_id'], name='loan_employee_history_idx'),
+        ]
+
+class LoanHistory(models.Model):
+    """
+    Loans returned long ago, moved out of Loan by rental.archive so the live
+    table only holds open and recently returned loans. loan_id is the original
+    Loan id. On PostgreSQL the table is range-partitioned by return_date year
+    (see migration 0010); its primary key there is (loan_id, return_date).
+    """
+    loan_id = models.IntegerField('貸出状況ID', primary_key=True)
+    book_instance = models.ForeignKey(BookInstance, on_delete=models.CASCADE, related_name='archived_loans')
+    employee = models.ForeignKey(Employee, on_delete=models.CASCADE, related_name='archived_loans')
+    loan_start = models.DateField('貸出開始日', null=True, blank=True)
+    due_date = models.DateField('返却予定日', null=True, blank=True)
+    return_date = models.DateField('返却日')
+    archived_at = models.DateTimeField('アーカイブ日時', default=timezone.now)
+
+    loaned = False
+    overdue = False
+
+    def __str__(self):
+        return f'{self.employee.username} renting {self.book_instance.book.title} (Returned)'
+
+    class Meta:
+        indexes = [
+            # An employee's archived history, newest first (same shape as loan_employee_history_idx)
+            models.Index(fields=['employee', '-loan_start', '-loan_id'], name='loanhistory_employee_idx'),
+            # Incremental exports (rental.exports) filter on archived_at
+            models.Index(fields=['archived_at'], name='loanhistory_archived_idx'),
+        ]
+
+class LoanNotification(models.Model):
+    """A loan included in a due-soon / overdue digest (rental.notifications), so reruns do not repeat it."""
+    DUE_SOON = 'due_soon'
+    OVERDUE = 'overdue'
+    KIND_CHOICES = (
+        (DUE_SOON, 'Due soon'),
+        (OVERDUE, 'Overdue'),
+    )
+
+    loan = models.ForeignKey(Loan, on_delete=models.CASCADE, related_name='notifications')
+    kind = models.CharField('種別', max_length=10, choices=KIND_CHOICES)
+    sent_on = models.DateField('送信日')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['loan', 'kind', 'sent_on'], name='unique_loan_notification_per_day')
+        ]
+
+    def __str__(self):
+        return f'{self.get_kind_display()} notice for loan {self.loan_id} on {self.sent_on}'
 
 class Reservation(models.Model):
     reserve_id = models.AutoField('予約状況ID', primary_key=True)
@@ -53,16 +125,17 @@ class Reservation(models.Model):
     employee = models.ForeignKey(Employee, on_delete=models.CASCADE, related_name='reservations', null=True, blank=True)
     future_rent = models.DateField('予約開始日', null=True, blank=True)
     future_return = models.DateField('予約返却日', null=True, blank=True)
+    updated_at = models.DateTimeField('更新日時', auto_now=True, db_index=True)
 
     def clean(self):
+        from .availability import AvailabilityTimeline
+
         if self.future_rent >= self.future_return:
             raise ValidationError("Invalid reservation period.")
-        overlapping = Reservation.objects.filter(
-            book_instance=self.book_instance,
-            future_rent__lt=self.future_return,
-            future_return__gt=self.future_rent
-        ).exclude(pk=self.pk)
-        if overlapping.exists():
+        timeline = AvailabilityTimeline.for_instance(self.book_instance, since=self.future_rent)
+        # Half-open: one reservation may start on the day another ends
+        conflicts = timeline.conflicts(self.future_rent, self.future_return, exclude_reservation=self.pk, closed=False)
+        if any(booking.kind == 'reservation' for booking in conflicts):
             raise ValidationError("This book instance is already reserved for the selected period.")
 
     class Meta:
@@ -72,6 +145,14 @@ class Reservation(models.Model):
                 name='unique_reservation_per_user_per_instance'
             )
         ]
+        indexes = [
+            # Range lookups of a copy's open reservations (availability timeline)
+            models.Index(fields=['book_instance', 'future_return', 'future_rent'], name='reservation_instance_range_idx'),
+            # Due reservations in promotion order (future_rent <= today)
+            models.Index(fields=['future_rent', 'reserve_id'], name='reservation_due_idx'),
+            # An employee's open reservations
+            models.Index(fields=['employee', 'future_return'], name='reservation_employee_idx'),
+        ]
         
     def __str__(self):
         return f"{self.employee.username} reserved '{self.book_instance.book.title}' from {self.future_rent} to {self.future_return}"
@@ -86,9 +167,34 @@ class Review(models.Model):
     review_title = models.CharField('レビュータイトル', max_length=20, null=True, blank=True)
     review = models.TextField('レビュー', null=True, blank=True)
     date = models.DateField('レビュー日', null=True, blank=True)
+    updated_at = models.DateTimeField('更新日時', auto_now=True, db_index=True)
 
     class Meta:
         unique_together = ('book', 'employee')
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.remember_rating()
+        return instance
+
+    def remember_rating(self):
+        """Note the (book, score) the stored row counts towards; see rental.signals."""
+        self._rating_state = (self.__dict__.get('book_id'), self.__dict__.get('score'))
+
     def __str__(self):
         return f"{self.employee.username} reviewed '{self.book.title}' ({self.score}/5): {self.review_title}"
+
+
+class SchedulerLease(models.Model):
+    """
+    Leader lease for the in-process scheduler (rental.leader). The process
+    whose holder id is on the row, with expires_at in the future, runs the
+    jobs; the others wait for the lease to expire.
+    """
+    name = models.CharField('リース名', max_length=100, primary_key=True)
+    holder = models.CharField('保持者', max_length=255, blank=True)
+    expires_at = models.DateTimeField('有効期限')
+
+    def __str__(self):
+        return f'{self.name} held by {self.holder or "nobody"} until {self.expires_at}'
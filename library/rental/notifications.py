@@ -0,0 +1,120 @@
+import logging
+from datetime import timedelta
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db.models import Exists, OuterRef
+from django.template.loader import render_to_string
+from django.urls import reverse
+from django.utils import timezone
+from .models import Loan, LoanNotification
+
+# Same logger as the scheduler jobs that send the digests
+logger = logging.getLogger('apscheduler_rental')
+
+DIGEST_FIELDS = (
+    'loan_id', 'due_date', 'employee_id', 'employee__username', 'employee__email',
+    'book_instance__book__title', 'book_instance__book__author',
+)
+
+
+def due_loans(kind, today):
+    """
+    Open loans of one bucket not yet notified, as dicts ordered by employee:
+    overdue (due before today; reminded again after LOAN_OVERDUE_REMINDER_DAYS)
+    or due soon (due within LOAN_DUE_SOON_DAYS; notified once per loan).
+    One query, on the partial active-loan due_date index.
+    """
+    notified = LoanNotification.objects.filter(loan=OuterRef('pk'), kind=kind)
+    loans = Loan.objects.filter(return_date__isnull=True)
+    if kind == LoanNotification.OVERDUE:
+        loans = loans.filter(due_date__lt=today)
+        notified = notified.filter(sent_on__gt=today - timedelta(days=settings.LOAN_OVERDUE_REMINDER_DAYS))
+    else:
+        loans = loans.filter(due_date__gte=today, due_date__lte=today + timedelta(days=settings.LOAN_DUE_SOON_DAYS))
+    return loans.exclude(Exists(notified)).order_by('employee_id', 'due_date', 'loan_id').values(*DIGEST_FIELDS)
+
+
+def build_digests(today):
+    """{employee_id: {'username', 'email', 'overdue': [...], 'due_soon': [...]}}"""
+    digests = {}
+    for kind in (LoanNotification.OVERDUE, LoanNotification.DUE_SOON):
+        for loan in due_loans(kind, today):
+            digest = digests.setdefault(loan['employee_id'], {
+                'username': loan['employee__username'],
+                'email': loan['employee__email'],
+                LoanNotification.OVERDUE: [],
+                LoanNotification.DUE_SOON: [],
+            })
+            loan['days'] = abs((loan['due_date'] - today).days)
+            digest[kind].append(loan)
+    return digests
+
+
+def digest_message(digest, today, connection=None):
+    overdue, due_soon = digest[LoanNotification.OVERDUE], digest[LoanNotification.DUE_SOON]
+    parts = []
+    if overdue:
+        parts.append(f"{len(overdue)} overdue")
+    if due_soon:
+        parts.append(f"{len(due_soon)} due soon")
+    context = {
+        'username': digest['username'],
+        'overdue': overdue,
+        'due_soon': due_soon,
+        'today': today,
+        'loan_history_url': settings.LIBRARY_SITE_URL.rstrip('/') + reverse('loan_history'),
+    }
+    return EmailMessage(
+        subject=f"[Library] {', '.join(parts)}",
+        body=render_to_string('rental/email/loan_digest.txt', context),
+        to=[digest['email']],
+        connection=connection,
+    )
+
+
+def send_loan_digests(today=None, dry_run=False):
+    """
+    Email every employee with overdue or due-soon loans one digest.
+
+    All messages go over one backend connection (one SMTP session), in
+    chunks of LOAN_DIGEST_BATCH_SIZE. After each chunk is accepted its loans
+    are recorded in LoanNotification, so a rerun the same day sends nothing
+    twice, and a failure only resends the chunk that failed.
+    Employees without an email address are skipped.
+
+    Returns a summary dict.
+    """
+    today = today or timezone.localdate()
+    digests = build_digests(today)
+    summary = {'date': today, 'employees': len(digests), 'sent': 0, 'no_email': 0, 'loans': 0}
+
+    recipients = []
+    for digest in digests.values():
+        if not digest['email']:
+            summary['no_email'] += 1
+            continue
+        recipients.append(digest)
+    if dry_run or not recipients:
+        summary['loans'] = sum(len(d['overdue']) + len(d['due_soon']) for d in recipients)
+        return summary
+
+    batch_size = settings.LOAN_DIGEST_BATCH_SIZE
+    with get_connection() as connection:
+        for start in range(0, len(recipients), batch_size):
+            chunk = recipients[start:start + batch_size]
+            connection.send_messages([digest_message(digest, today, connection) for digest in chunk])
+            records = [
+                LoanNotification(loan_id=loan['loan_id'], kind=kind, sent_on=today)
+                for digest in chunk
+                for kind in (LoanNotification.OVERDUE, LoanNotification.DUE_SOON)
+                for loan in digest[kind]
+            ]
+            LoanNotification.objects.bulk_create(records, ignore_conflicts=True)
+            summary['sent'] += len(chunk)
+            summary['loans'] += len(records)
+
+    logger.info(
+        f"Loan digests for {today}: {summary['sent']} sent covering {summary['loans']} loans, "
+        f"{summary['no_email']} employees without email"
+    )
+    return summary
@@ -0,0 +1,217 @@
+import json
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+from django.utils.http import urlsafe_base64_decode, urlsafe_base64_encode
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(direction, values):
+    payload = json.dumps([direction, list(values)], cls=DjangoJSONEncoder, separators=(',', ':'))
+    return urlsafe_base64_encode(payload.encode())
+
+
+def decode_cursor(cursor):
+    try:
+        direction, values = json.loads(urlsafe_base64_decode(cursor).decode())
+    except (ValueError, TypeError, UnicodeDecodeError):
+        raise InvalidCursor(cursor)
+    if direction not in ('next', 'prev') or not isinstance(values, list):
+        raise InvalidCursor(cursor)
+    return direction, values
+
+
+class KeysetPage:
+    """One page of a KeysetPaginator; mirrors the parts of Page templates use."""
+
+    def __init__(self, object_list, has_next, has_previous, next_cursor, previous_cursor):
+        self.object_list = object_list
+        self._has_next = has_next
+        self._has_previous = has_previous
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self._has_next or self._has_previous
+
+
+class KeysetPaginator:
+    """
+    Cursor pagination over a unique ordering, e.g. ('title', 'book_id').
+    Each page is a single indexed range scan (WHERE (key) > cursor LIMIT n)
+    instead of COUNT(*) + OFFSET, so deep pages cost the same as the first.
+    The last key must be unique (normally the primary key). Keys that may be
+    NULL must be listed in `nullable`; they keep the database's own NULL
+    order (PostgreSQL: NULLs sort as the largest value, SQLite: the
+    smallest), so the ORDER BY still matches a plain index on the columns.
+    """
+
+    def __init__(self, queryset, ordering, per_page, nullable=()):
+        self.queryset = queryset
+        self.ordering = [(key.lstrip('-'), key.startswith('-')) for key in ordering]
+        self.per_page = per_page
+        self.nullable = set(nullable)
+
+    def _compare(self, field, value, descending, nulls_largest):
+        """(rows strictly after `value` in the iteration order, rows equal to it) for one key."""
+        nullable = field in self.nullable
+        nulls_last = nulls_largest != descending
+        if value is None:
+            after = Q(pk__in=[]) if nulls_last else Q(**{f'{field}__isnull': False})
+            return after, Q(**{f'{field}__isnull': True})
+        after = Q(**{f"{field}__{'lt' if descending else 'gt'}": value})
+        if nullable and nulls_last:
+            after |= Q(**{f'{field}__isnull': True})
+        return after, Q(**{field: value})
+
+    def _after(self, values, reverse=False, nulls_largest=False):
+        """Q for rows strictly after `values` in the (possibly reversed) ordering."""
+        condition = Q()
+        equal = Q()
+        for index, (field, descending) in enumerate(self.ordering):
+            after, same = self._compare(field, values[index], descending != reverse, nulls_largest)
+            condition |= equal & after
+            equal &= same
+        return condition
+
+    def _order_by(self, reverse=False):
+        return [
+            ('-' if descending != reverse else '') + field
+            for field, descending in self.ordering
+        ]
+
+    def _cursor_values(self, obj):
+        return [getattr(obj, field) for field, _ in self.ordering]
+
+    def _fetch_from(self, queryset, values, reverse):
+        """Up to per_page + 1 rows of `queryset` after `values`, in page order."""
+        queryset = queryset.order_by(*self._order_by(reverse))
+        if values is not None:
+            queryset = queryset.filter(self._after(values, reverse, connections[queryset.db].features.nulls_order_largest))
+        return list(queryset[:self.per_page + 1])
+
+    def _fetch(self, values, reverse):
+        return self._fetch_from(self.queryset, values, reverse)
+
+    def get_page(self, cursor=None):
+        direction, values = 'next', None
+        if cursor:
+            try:
+                direction, values = decode_cursor(cursor)
+            except InvalidCursor:
+                direction, values = 'next', None
+            if values is not None and len(values) != len(self.ordering):
+                direction, values = 'next', None
+
+        reverse = direction == 'prev'
+        rows = self._fetch(values, reverse)
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if reverse:
+            rows.reverse()
+            has_next, has_previous = values is not None, has_more
+        else:
+            has_next, has_previous = has_more, values is not None
+
+        next_cursor = encode_cursor('next', self._cursor_values(rows[-1])) if rows and has_next else None
+        previous_cursor = encode_cursor('prev', self._cursor_values(rows[0])) if rows and has_previous else None
+        return KeysetPage(rows, has_next, has_previous, next_cursor, previous_cursor)
+
+
+class MergedKeysetPaginator(KeysetPaginator):
+    """
+    KeysetPaginator over several querysets sharing the same ordering keys,
+    e.g. a live table and its archive. Each page is one range scan per
+    queryset (at most per_page + 1 rows each), merged in Python. The last
+    key must be unique across all of the querysets.
+    """
+
+    def __init__(self, querysets, ordering, per_page, nullable=()):
+        super().__init__(None, ordering, per_page, nullable)
+        self.querysets = querysets
+
+    def _nulls_largest(self):
+        return connections[self.querysets[0].db].features.nulls_order_largest
+
+    def _fetch(self, values, reverse):
+        rows = []
+        for queryset in self.querysets:
+            rows.extend(self._fetch_from(queryset, values, reverse))
+        # Stable sorts from the last key to the first give the mixed asc/desc
+        # order; NULLs sort where the database puts them
+        nulls_largest = self._nulls_largest()
+        for field, descending in reversed(self.ordering):
+            def key(obj, field=field):
+                value = getattr(obj, field)
+                return (value is None) == nulls_largest, value if value is not None else 0
+            rows.sort(key=key, reverse=descending != reverse)
+        return rows[:self.per_page + 1]
+
+
+def approximate_count(queryset):
+    """
+    Row estimate for a queryset without running COUNT(*).
+    PostgreSQL: the planner's estimate (pg_class.reltuples for an unfiltered
+    table, EXPLAIN otherwise). Other databases fall back to an exact count.
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return queryset.count()
+
+    with connection.cursor() as cursor:
+        if not queryset.query.where:
+            cursor.execute(
+                'SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+                [queryset.model._meta.db_table],
+            )
+            row = cursor.fetchone()
+            # reltuples is -1 for a table that has never been analyzed
+            if row and row[0] >= 0:
+                return row[0]
+            return queryset.count()
+
+        sql, params = queryset.order_by().query.sql_with_params()
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]['Plan']['Plan Rows'])
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator for admin changelists of large tables. On PostgreSQL the page
+    count comes from approximate_count() when it exceeds
+    ADMIN_EXACT_COUNT_LIMIT rows; smaller (e.g. filtered) results are counted
+    exactly. Past the real end of an over-estimated list, pages are empty.
+    """
+
+    @cached_property
+    def count(self):
+        if connections[self.object_list.db].vendor != 'postgresql':
+            return super().count
+        estimate = approximate_count(self.object_list)
+        if estimate > settings.ADMIN_EXACT_COUNT_LIMIT:
+            return estimate
+        return self.object_list.count()
@@ -0,0 +1,172 @@
+import logging
+from collections import Counter
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+from .models import Loan, Reservation
+from registration_book.models import Book
+
+# Same logger as the scheduler jobs that drive promotion
+logger = logging.getLogger('apscheduler_rental')
+
+
+def promote_due_reservations(today=None, batch_size=500, book_instance_ids=None):
+    """
+    Convert due reservations (future_rent <= today) into loans, set-based.
+
+    Reservations are walked in (future_rent, reserve_id) order in batches of
+    batch_size. Per batch: lock the reservations, load the active loans of
+    their copies in one query, then
+      * delete reservations whose employee already has the copy (duplicates),
+      * leave reservations whose copy is on loan to someone else (waiting),
+      * give each free copy to its earliest reservation: bulk-create the
+        loans and bulk-delete the converted reservations.
+    Later reservations for a copy claimed in the same run keep waiting.
+
+    Returns a summary dict with the counts and the created loan ids.
+    """
+    today = today or timezone.localdate()
+    summary = {
+        'date': today,
+        'due': 0,
+        'converted': 0,
+        'duplicates': 0,
+        'waiting': 0,
+        'errors': 0,
+        'loan_ids': [],
+    }
+
+    due = Reservation.objects.filter(
+        future_rent__lte=today,
+        book_instance__isnull=False,
+        employee__isnull=False,
+    )
+    if book_instance_ids is not None:
+        due = due.filter(book_instance_id__in=book_instance_ids)
+
+    cursor = None
+    while True:
+        page = due
+        if cursor is not None:
+            last_rent, last_id = cursor
+            page = page.filter(Q(future_rent__gt=last_rent) | Q(future_rent=last_rent, reserve_id__gt=last_id))
+        page = page.select_for_update(of=('self',)).select_related('book_instance').order_by('future_rent', 'reserve_id')
+
+        batch = []
+        # Counts of a failed batch are rolled back along with its transaction
+        before = dict(summary, loan_ids=list(summary['loan_ids']))
+        try:
+            with transaction.atomic():
+                batch = list(page[:batch_size])
+                if batch:
+                    _promote_batch(batch, today, summary)
+        except Exception as e:
+            if not batch:
+                raise
+            summary.update(before)
+            summary['due'] += len(batch)
+            summary['errors'] += len(batch)
+            logger.error(f"Error promoting reservations {batch[0].reserve_id}..{batch[-1].reserve_id}: {e}")
+
+        if len(batch) < batch_size:
+            break
+        cursor = (batch[-1].future_rent, batch[-1].reserve_id)
+
+    return summary
+
+
+def promote_returned_copy(book_instance_id, today=None):
+    """
+    Hand a returned copy to its earliest due reservation right away, instead
+    of leaving it for the nightly promote_reservations run. Same engine,
+    scoped to the one copy.
+    """
+    summary = promote_due_reservations(today=today, book_instance_ids=[book_instance_id])
+    if summary['converted']:
+        logger.info(f"Returned copy {book_instance_id} handed to the next reservation (loan {summary['loan_ids'][0]})")
+    return summary
+
+
+def _promote_batch(batch, today, summary):
+    summary['due'] += len(batch)
+    instance_ids = {res.book_instance_id for res in batch}
+
+    # Active loans of every copy in the batch, in one query
+    active = {
+        loan['book_instance_id']: loan
+        for loan in Loan.objects.filter(
+            book_instance_id__in=instance_ids, return_date__isnull=True
+        ).values('book_instance_id', 'employee_id', 'loan_id', 'due_date', 'employee__username')
+    }
+
+    to_delete = []
+    new_loans = []
+    claimed = set()
+    for res in batch:
+        loan = active.get(res.book_instance_id)
+        if loan and loan['employee_id'] == res.employee_id:
+            logger.info(
+                f"Employee already has copy on loan (loan {loan['loan_id']}); "
+                f"deleting duplicate reservation {res.reserve_id}"
+            )
+            summary['duplicates'] += 1
+            to_delete.append(res.reserve_id)
+        elif loan:
+            status = 'overdue' if loan['due_date'] and loan['due_date'] < today else 'on-loan'
+            logger.info(
+                f"Reservation {res.reserve_id} waiting - book {status} "
+                f"(borrower {loan['employee__username']}, due {loan['due_date']})"
+            )
+            summary['waiting'] += 1
+        elif res.book_instance_id in claimed:
+            summary['waiting'] += 1
+        else:
+            claimed.add(res.book_instance_id)
+            new_loans.append((res, Loan(
+                book_instance_id=res.book_instance_id,
+                employee_id=res.employee_id,
+                loan_start=today,
+                due_date=res.future_return,
+            )))
+
+    created = _create_loans(new_loans, summary)
+    to_delete.extend(res.reserve_id for res, _ in created)
+    if to_delete:
+        Reservation.objects.filter(reserve_id__in=to_delete).delete()
+
+    # Each new loan takes one copy out of its book's available count
+    for book_id, count in Counter(res.book_instance.book_id for res, _ in created).items():
+        Book.objects.adjust_copy_counts(book_id, available=-count)
+
+    summary['converted'] += len(created)
+    summary['loan_ids'].extend(loan.loan_id for _, loan in created)
+    for res, loan in created:
+        logger.info(f"Converted reservation {res.reserve_id} → loan {loan.loan_id}")
+
+
+def _create_loans(new_loans, summary):
+    """
+    Bulk-create the loans. If a copy was rented concurrently the unique
+    active-loan constraint rejects the whole insert; fall back to one
+    savepoint per loan so only the conflicting reservations keep waiting.
+    Both paths skip the Loan signals; the caller adjusts the copy counts.
+    """
+    if not new_loans:
+        return []
+    try:
+        with transaction.atomic():
+            Loan.objects.bulk_create([loan for _, loan in new_loans])
+        return new_loans
+    except IntegrityError:
+        pass
+
+    created = []
+    for res, loan in new_loans:
+        try:
+            with transaction.atomic():
+                Loan.objects.bulk_create([loan])
+            created.append((res, loan))
+        except IntegrityError:
+            logger.info(f"Reservation {res.reserve_id} waiting - copy was rented concurrently")
+            summary['waiting'] += 1
+    return created
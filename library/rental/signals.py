@@ -0,0 +1,88 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from registration_book.cache import get_copy_book_id
+from registration_book.models import Book, BookInstance
+from .models import Loan, Review
+
+
+def _adjust_available(loan, available):
+    book_id = get_copy_book_id(loan.book_instance_id)
+    if book_id is not None:
+        Book.objects.adjust_copy_counts(book_id, available=available)
+
+
+@receiver(post_save, sender=BookInstance)
+def update_copies_on_save(sender, instance, created, **kwargs):
+    """
+    A new copy counts towards its book; a copy moved to another book (admin)
+    takes its counts along. Bulk-created copies are counted by the code
+    creating them (registration_book.bulk_import).
+    """
+    old_book_id = None if created else getattr(instance, '_book_state', None)
+    if created:
+        Book.objects.adjust_copy_counts(instance.book_id, total=1, available=1)
+    elif old_book_id is not None and old_book_id != instance.book_id:
+        available = 0 if Loan.objects.filter(book_instance=instance, return_date__isnull=True).exists() else 1
+        Book.objects.adjust_copy_counts(old_book_id, total=-1, available=-available)
+        Book.objects.adjust_copy_counts(instance.book_id, total=1, available=available)
+    instance.remember_book()
+
+
+@receiver(post_delete, sender=BookInstance)
+def update_copies_on_delete(sender, instance, **kwargs):
+    """A deleted copy leaves its book's counts; its open loan, deleted first by the cascade, gave it back."""
+    book_id = getattr(instance, '_book_state', None) or instance.book_id
+    Book.objects.adjust_copy_counts(book_id, total=-1, available=-1)
+
+
+@receiver(post_save, sender=Loan)
+def update_available_on_save(sender, instance, created, **kwargs):
+    """
+    A new open loan, or a return_date set or cleared by a plain save() (e.g.
+    in the admin), moves the copy out of or into its book's available count.
+    Bulk-created loans are counted by the code creating them
+    (rental.reservations), and the return view marks loans returned with a
+    conditional UPDATE.
+    """
+    was_open = getattr(instance, '_open_state', None)
+    is_open = instance.return_date is None
+    if created:
+        if is_open:
+            _adjust_available(instance, -1)
+    elif was_open is not None and was_open != is_open:
+        _adjust_available(instance, -1 if is_open else 1)
+    instance.remember_open()
+
+
+@receiver(post_delete, sender=Loan)
+def update_available_on_delete(sender, instance, **kwargs):
+    """An open loan deleted (account deletion, admin, its copy deleted) frees the copy."""
+    is_open = getattr(instance, '_open_state', None)
+    if is_open is None:
+        is_open = instance.return_date is None
+    if is_open:
+        _adjust_available(instance, 1)
+
+
+@receiver(post_save, sender=Review)
+def update_rating_on_save(sender, instance, created, **kwargs):
+    """Move the review's score between Book rating summaries as it changes."""
+    old_book_id, old_score = (None, None) if created else getattr(instance, '_rating_state', (None, None))
+    new_book_id, new_score = instance.book_id, instance.score
+
+    if old_book_id == new_book_id:
+        if new_book_id is not None:
+            Book.objects.adjust_rating(new_book_id, old_score, new_score)
+    else:
+        if old_book_id is not None:
+            Book.objects.adjust_rating(old_book_id, old_score=old_score)
+        if new_book_id is not None:
+            Book.objects.adjust_rating(new_book_id, new_score=new_score)
+    instance.remember_rating()
+
+
+@receiver(post_delete, sender=Review)
+def update_rating_on_delete(sender, instance, **kwargs):
+    book_id, score = getattr(instance, '_rating_state', (instance.book_id, instance.score))
+    if book_id is not None:
+        Book.objects.adjust_rating(book_id, old_score=score)
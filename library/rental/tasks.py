@@ -0,0 +1,7 @@
+from taskqueue.queue import register
+from .reservations import promote_returned_copy
+
+
+@register('rental.promote_returned_copy')
+def promote_returned_copy_task(book_instance_id):
+    promote_returned_copy(book_instance_id)
@@ -1,3 +1,906 @@
-from django.test import TestCase
+import json
+import os
+from io import StringIO
+from datetime import date, timedelta
+from unittest.mock import MagicMock, patch
+from django.utils import timezone
+from django.contrib.messages import get_messages
+from django.core import mail
+from django.core.management import call_command
+from django.http import HttpResponse
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import connection
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext, ignore_warnings
+from django.urls import resolve, reverse
+from accounts.models import Employee, Librarian
+from library.db_routing import PIN_COOKIE, ReplicaRouter, ReplicaRoutingMiddleware
+from library.sql_instrumentation import QueryBudgetExceeded, fingerprint, reset_view_stats, view_stats
+from registration_book.cache import catalog_cache
+from registration_book.models import Book, BookInstance, Storage
+from taskqueue.worker import Worker
+from . import reservations
+from .archive import archive_returned_loans
+from .availability import AvailabilityTimeline, Booking
+from .forms import RentForm, ReservationForm
+from .leader import SchedulerLeader, start_leader_election, start_on_first_request
+from .pagination import encode_cursor
+from .notifications import send_loan_digests
+from .reservations import promote_due_reservations
+from .models import Loan, LoanHistory, Reservation, Review, SchedulerLease
 
-# Create your tests here.
+
+class SQLInstrumentationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.employee = Employee.objects.create_user(username='emp', password='pw12345!x', user_type='employee')
+        cls.other = Employee.objects.create_user(username='emp2', password='pw12345!x', user_type='employee')
+        storage = Storage.objects.create(storage_name='A')
+        cls.book = Book.objects.create(title='吾輩は猫である', author='夏目漱石', publish_date='1905')
+        cls.instances = [BookInstance.objects.create(book=cls.book, storage=storage) for _ in range(5)]
+
+    def setUp(self):
+        self.client.force_login(self.employee)
+        reset_view_stats()
+        catalog_cache().clear()
+
+    def detail_url(self):
+        return reverse('book_instance_detail', args=[self.instances[0].pk])
+
+    def test_disabled_by_default(self):
+        response = self.client.get(self.detail_url())
+        self.assertNotIn('Server-Timing', response)
+
+    @override_settings(SQL_INSTRUMENTATION=True)
+    def test_server_timing_and_view_stats(self):
+        response = self.client.get(self.detail_url())
+        self.assertRegex(response['Server-Timing'], r'^db;dur=[\d.]+;desc="\d+ queries", total;dur=[\d.]+$')
+        stats = view_stats()['book_instance_detail']
+        self.assertEqual(stats['requests'], 1)
+        self.assertGreater(stats['queries'], 0)
+
+    @override_settings(SQL_INSTRUMENTATION=True, SQL_QUERY_BUDGET_STRICT=True,
+                       SQL_QUERY_BUDGETS={'book_instance_detail': 1})
+    def test_strict_budget_fails_request(self):
+        with self.assertRaises(QueryBudgetExceeded):
+            self.client.get(self.detail_url())
+
+    @override_settings(SQL_INSTRUMENTATION=True, SQL_QUERY_BUDGET_STRICT=True,
+                       SQL_QUERY_BUDGETS={'book_instance_detail': 12})
+    def test_detail_query_count_does_not_grow_with_copies(self):
+        self.client.get(self.detail_url())
+        more = [BookInstance.objects.create(book=self.book, storage=self.instances[0].storage) for _ in range(20)]
+        for instance in more[:10]:
+            Loan.objects.create(book_instance=instance, employee=self.other,
+                                loan_start=date.today(), due_date=date.today() + timedelta(days=7))
+        # Compare cold requests; the catalog cache would otherwise save queries
+        catalog_cache().clear()
+        self.client.get(self.detail_url())
+        stats = view_stats()['book_instance_detail']
+        self.assertEqual(stats['queries'], 2 * stats['max_queries'])
+
+    def test_fingerprint_collapses_in_lists(self):
+        self.assertEqual(
+            fingerprint('SELECT * FROM t WHERE id IN (%s, %s, %s)'),
+            fingerprint('SELECT *  FROM t\nWHERE id IN (%s)'),
+        )
+
+
+
+class ReplicaRoutingTests(SimpleTestCase):
+    def route(self, method, path, cookies=None):
+        """Alias a Book read would use inside the view, and the response."""
+        request = RequestFactory().generic(method, path)
+        request.COOKIES.update(cookies or {})
+        request.resolver_match = resolve(path)
+        seen = []
+
+        def view(request):
+            seen.append(ReplicaRouter().db_for_read(Book))
+            return HttpResponse()
+
+        def handler(request):
+            # The handler runs process_view hooks inside the middleware chain
+            return middleware.process_view(request, view, (), {}) or view(request)
+
+        replica = {**settings.DATABASES, 'replica': settings.DATABASES['default']}
+        with ignore_warnings(message='Overriding setting DATABASES'), override_settings(DATABASES=replica):
+            middleware = ReplicaRoutingMiddleware(handler)
+            response = middleware(request)
+        return seen[0], response
+
+    def test_read_only_views_use_replica(self):
+        alias, response = self.route('GET', reverse('book_instance_results'))
+        self.assertEqual(alias, 'replica')
+        self.assertNotIn(PIN_COOKIE, response.cookies)
+        self.assertIsNone(ReplicaRouter().db_for_read(Book))
+
+    def test_other_views_and_writes_use_primary(self):
+        self.assertIsNone(self.route('GET', reverse('rental_index'))[0])
+        alias, response = self.route('POST', reverse('book_instance_results'))
+        self.assertIsNone(alias)
+        self.assertIn(PIN_COOKIE, response.cookies)
+
+    def test_pinned_client_reads_primary(self):
+        self.assertIsNone(self.route('GET', reverse('loan_history'), cookies={PIN_COOKIE: '1'})[0])
+
+class LoanArchiveTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.employee = Employee.objects.create_user(username='emp', password='pw12345!x', user_type='employee')
+        storage = Storage.objects.create(storage_name='A')
+        book = Book.objects.create(title='吾輩は猫である', author='夏目漱石', publish_date='1905')
+        instance = BookInstance.objects.create(book=book, storage=storage)
+        today = date.today()
+        for months in range(12):
+            start = today - timedelta(days=60 * months + 30)
+            Loan.objects.create(book_instance=instance, employee=cls.employee, loan_start=start,
+                                due_date=start + timedelta(days=7), return_date=start + timedelta(days=5))
+        # Entered without a start date (e.g. in the admin)
+        for _ in range(2):
+            Loan.objects.create(book_instance=instance, employee=cls.employee, return_date=today - timedelta(days=500))
+        Loan.objects.create(book_instance=instance, employee=cls.employee,
+                            loan_start=today, due_date=today + timedelta(days=7))
+
+    def history_pages(self):
+        pages, cursor = [], ''
+        while True:
+            page = self.client.get(reverse('loan_history'), {'cursor': cursor}).context['loans']
+            pages.append([loan.loan_id for loan in page])
+            if not page.has_next():
+                return pages, page
+            cursor = page.next_cursor
+
+    def history_ids(self):
+        return sum(self.history_pages()[0], [])
+
+    def test_archive_moves_only_old_returned_loans(self):
+        summary = archive_returned_loans(days=365, batch_size=2)
+        self.assertEqual(summary['archived'], LoanHistory.objects.count())
+        self.assertGreater(summary['archived'], 0)
+        self.assertFalse(Loan.objects.filter(return_date__lt=summary['cutoff']).exists())
+        self.assertEqual(Loan.objects.filter(return_date__isnull=True).count(), 1)
+
+    def test_loan_history_reads_across_both_tables(self):
+        self.client.force_login(self.employee)
+        before = self.history_ids()
+        archive_returned_loans(days=365)
+        self.assertEqual(self.history_ids(), before)
+        self.assertEqual(len(before), 15)
+        self.assertEqual(len(set(before)), 15)
+        # The open loan heads the first page
+        self.assertEqual(before[0], Loan.objects.get(return_date__isnull=True).loan_id)
+
+    def test_previous_cursors_walk_back_over_the_same_pages(self):
+        self.client.force_login(self.employee)
+        archive_returned_loans(days=365)
+        pages, page = self.history_pages()
+        self.assertGreater(len(pages), 1)
+        back = [pages[-1]]
+        while page.has_previous():
+            page = self.client.get(reverse('loan_history'), {'cursor': page.previous_cursor}).context['loans']
+            back.insert(0, [loan.loan_id for loan in page])
+        self.assertEqual(back, pages)
+
+
+class FakeScheduler:
+    running = False
+
+    def start(self):
+        self.running = True
+
+    def shutdown(self, wait=True):
+        self.running = False
+
+
+class SchedulerLeaderTests(TestCase):
+    def test_one_leader_and_takeover(self):
+        first = SchedulerLeader(FakeScheduler, lease_seconds=60, renew_seconds=1)
+        second = SchedulerLeader(FakeScheduler, lease_seconds=60, renew_seconds=1)
+        self.assertTrue(first.tick())
+        self.assertFalse(second.tick())
+        self.assertTrue(first.tick())
+
+        # The holder stops renewing (died): its lease runs out
+        SchedulerLease.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertTrue(second.tick())
+        self.assertFalse(first.tick())
+        self.assertFalse(first.is_leader)
+
+    def test_stop_releases_lease(self):
+        first = SchedulerLeader(FakeScheduler, lease_seconds=60, renew_seconds=1)
+        second = SchedulerLeader(FakeScheduler, lease_seconds=60, renew_seconds=1)
+        first.tick()
+        first.stop()
+        self.assertTrue(second.tick())
+
+    def test_election_starts_with_the_first_request(self):
+        calls = []
+        application = start_on_first_request(lambda environ, start_response: calls.append(environ))
+        with patch('rental.leader.start_leader_election') as start:
+            # Importing/wrapping (e.g. in a gunicorn --preload master) starts nothing
+            self.assertFalse(start.called)
+            application({'PATH_INFO': '/'}, None)
+            application({'PATH_INFO': '/'}, None)
+        self.assertEqual(start.call_count, 2)
+        self.assertEqual(len(calls), 2)
+
+    def test_started_once_per_process(self):
+        pid = os.getpid()
+        with patch('rental.leader._leader', None), patch('rental.leader.threading.Thread'), \
+                patch('rental.leader.atexit.register'), patch('rental.leader.os.getpid', return_value=pid) as getpid, \
+                patch('rental.leader.SchedulerLeader', side_effect=lambda factory: MagicMock(pid=getpid())):
+            first = start_leader_election()
+            self.assertIs(start_leader_election(), first)
+            # A forked child starts its own on its first request
+            getpid.return_value = pid + 1
+            second = start_leader_election()
+            self.assertIsNot(second, first)
+            self.assertIs(start_leader_election(), second)
+
+
+class PromotionOnReturnTests(TestCase):
+    def test_return_hands_copy_to_next_due_reservation(self):
+        employee = Employee.objects.create_user(username='emp', password='pw12345!x', user_type='employee')
+        waiting = Employee.objects.create_user(username='emp2', password='pw12345!x', user_type='employee')
+        storage = Storage.objects.create(storage_name='A')
+        book = Book.objects.create(title='吾輩は猫である', author='夏目漱石', publish_date='1905')
+        instance = BookInstance.objects.create(book=book, storage=storage)
+        today = date.today()
+        loan = Loan.objects.create(book_instance=instance, employee=employee,
+                                   loan_start=today - timedelta(days=3), due_date=today + timedelta(days=4))
+        Reservation.objects.create(book_instance=instance, employee=waiting,
+                                   future_rent=today, future_return=today + timedelta(days=7))
+
+        self.client.force_login(employee)
+        self.client.post(reverse('return_and_review', args=[loan.loan_id]),
+                         {'review_title': 'よい', 'score': 4, 'review': ''})
+        # The request only queued the promotion
+        self.assertTrue(Reservation.objects.exists())
+        self.assertEqual(Worker().run_once(), 1)
+
+        self.assertFalse(Reservation.objects.exists())
+        new_loan = Loan.objects.get(book_instance=instance, return_date__isnull=True)
+        self.assertEqual(new_loan.employee_id, waiting.pk)
+        self.assertEqual(new_loan.due_date, today + timedelta(days=7))
+
+
+class CopyCounterTests(TestCase):
+    def setUp(self):
+        self.employee = Employee.objects.create_user(username='emp', password='pw12345!x', user_type='employee')
+        self.other = Employee.objects.create_user(username='emp2', password='pw12345!x', user_type='employee')
+        storage = Storage.objects.create(storage_name='A')
+        self.book = Book.objects.create(title='吾輩は猫である', author='夏目漱石', publish_date='1905')
+        self.instances = [BookInstance.objects.create(book=self.book, storage=storage) for _ in range(2)]
+        self.client.force_login(self.employee)
+
+    def counts(self):
+        return Book.objects.values_list('total_copies', 'available_copies').get(pk=self.book.pk)
+
+    def rent(self, instance):
+        self.client.post(reverse('create_loan'), {'book_instance_id': instance.pk})
+        return Loan.objects.get(book_instance=instance, return_date__isnull=True)
+
+    def give_back(self, loan):
+        return self.client.post(reverse('return_and_review', args=[loan.loan_id]),
+                                {'review_title': 'よい', 'score': 4, 'review': ''})
+
+    def test_rent_return_and_double_return(self):
+        loan = self.rent(self.instances[0])
+        self.assertEqual(self.counts(), (2, 1))
+        self.give_back(loan)
+        self.assertEqual(self.counts(), (2, 2))
+        # The second submit finds the loan already returned
+        self.give_back(loan)
+        self.assertEqual(self.counts(), (2, 2))
+
+    def test_promotion_takes_returned_copy_again(self):
+        loan = self.rent(self.instances[0])
+        Reservation.objects.create(book_instance=self.instances[0], employee=self.other,
+                                   future_rent=date.today(), future_return=date.today() + timedelta(days=7))
+        self.give_back(loan)
+        self.assertEqual(self.counts(), (2, 2))
+        Worker().run_once()
+        self.assertEqual(self.counts(), (2, 1))
+
+    def test_admin_style_save_and_delete(self):
+        loan = self.rent(self.instances[0])
+        loan = Loan.objects.get(pk=loan.pk)
+        loan.return_date = date.today()
+        loan.save()
+        self.assertEqual(self.counts(), (2, 2))
+        loan.return_date = None
+        loan.save()
+        self.assertEqual(self.counts(), (2, 1))
+        Loan.objects.get(pk=loan.pk).delete()
+        self.assertEqual(self.counts(), (2, 2))
+        # Deleting a returned loan changes nothing
+        returned = self.rent(self.instances[1])
+        self.give_back(returned)
+        Loan.objects.get(pk=returned.pk).delete()
+        self.assertEqual(self.counts(), (2, 2))
+
+    def test_loan_added_and_deleted_in_admin(self):
+        self.client.force_login(Employee.objects.create_superuser(
+            username='admin', password='pw12345!x', user_type='librarian'))
+        response = self.client.post(reverse('admin:rental_loan_add'), {
+            'book_instance': self.instances[0].pk, 'employee': self.other.pk,
+            'loan_start': date.today(), 'due_date': date.today() + timedelta(days=7), 'return_date': '',
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.counts(), (2, 1))
+        # A loan entered already returned leaves the count alone
+        self.client.post(reverse('admin:rental_loan_add'), {
+            'book_instance': self.instances[1].pk, 'employee': self.other.pk,
+            'loan_start': date.today() - timedelta(days=7), 'due_date': date.today(), 'return_date': date.today(),
+        })
+        self.assertEqual(self.counts(), (2, 1))
+
+        loan = Loan.objects.get(book_instance=self.instances[0])
+        self.client.post(reverse('admin:rental_loan_delete', args=[loan.pk]), {'post': 'yes'})
+        self.assertEqual(self.counts(), (2, 2))
+
+    def test_account_deletion_frees_open_loans(self):
+        self.rent(self.instances[0])
+        self.rent(self.instances[1])
+        self.assertEqual(self.counts(), (2, 0))
+        self.employee.delete()
+        self.assertEqual(self.counts(), (2, 2))
+
+
+
+class GroupedSearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.employee = Employee.objects.create_user(username='emp', password='pw12345!x', user_type='employee')
+        storage = Storage.objects.create(storage_name='A')
+        # Pairs of books share a title, so book_id breaks the ties
+        cls.books = [
+            Book.objects.create(title=f'本{n // 2:02d}', author=f'著者{n % 2}', publish_date='2000', isbn=f'978{n:010d}')
+            for n in range(45)
+        ]
+        for book in cls.books:
+            BookInstance.objects.create(book=book, storage=storage)
+        for book in cls.books[::3]:
+            Loan.objects.create(book_instance=book.instances.get(), employee=cls.employee,
+                                loan_start=date.today(), due_date=date.today() + timedelta(days=7))
+
+    def setUp(self):
+        self.client.force_login(self.employee)
+
+    def page(self, cursor=None, **params):
+        params = {'group': 'book', 'title': '', **params}
+        if cursor:
+            params['cursor'] = cursor
+        response = self.client.get(reverse('book_instance_results'), params)
+        self.assertEqual(response.status_code, 200)
+        return response.context['book_page'], response.context['result_count']
+
+    def walk(self, **params):
+        """Book ids of every page, following next cursors."""
+        ids, cursor = [], None
+        while True:
+            page, _ = self.page(cursor, **params)
+            ids.extend(book.pk for book in page)
+            if not page.has_next():
+                self.assertIsNone(page.next_cursor)
+                return ids
+            cursor = page.next_cursor
+
+    def ordered(self, books, descending=False):
+        return [book.pk for book in sorted(books, key=lambda book: (book.title, book.pk), reverse=descending)]
+
+    def test_next_cursors_visit_every_book_once(self):
+        first, count = self.page()
+        self.assertEqual((len(first), count), (20, 45))
+        self.assertFalse(first.has_previous())
+        self.assertIsNone(first.previous_cursor)
+        self.assertEqual(self.walk(), self.ordered(self.books))
+
+    def test_previous_cursor_returns_the_earlier_page(self):
+        first, _ = self.page()
+        second, _ = self.page(first.next_cursor)
+        third, _ = self.page(second.next_cursor)
+        self.assertEqual(len(third), 5)
+        self.assertFalse(third.has_next())
+
+        back, _ = self.page(third.previous_cursor)
+        self.assertEqual([book.pk for book in back], [book.pk for book in second])
+        self.assertTrue(back.has_next() and back.has_previous())
+        self.assertEqual(back.next_cursor, second.next_cursor)
+        back, _ = self.page(back.previous_cursor)
+        self.assertEqual([book.pk for book in back], [book.pk for book in first])
+        self.assertFalse(back.has_previous())
+
+    def test_descending(self):
+        self.assertEqual(self.walk(dir='desc'), self.ordered(self.books, descending=True))
+        first, _ = self.page(dir='desc')
+        second, _ = self.page(first.next_cursor, dir='desc')
+        back, _ = self.page(second.previous_cursor, dir='desc')
+        self.assertEqual([book.pk for book in back], [book.pk for book in first])
+
+    def test_available_only(self):
+        available = [book for index, book in enumerate(self.books) if index % 3]
+        _, count = self.page(available_only='on')
+        self.assertEqual(count, len(available))
+        self.assertEqual(self.walk(available_only='on'), self.ordered(available))
+        # Combined with a title search
+        matching = [book for book in available if book.title == '本07']
+        self.assertEqual(self.walk(available_only='on', title='本07'), self.ordered(matching))
+
+    def test_invalid_cursor_starts_from_the_first_page(self):
+        first, _ = self.page()
+        wrong_length = encode_cursor('next', ['本05'])
+        for cursor in ('not-a-cursor', 'e30', wrong_length):
+            page, _ = self.page(cursor)
+            self.assertEqual([book.pk for book in page], [book.pk for book in first])
+            self.assertFalse(page.has_previous())
+
+
+class ReviewPagingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.employee = Employee.objects.create_user(username='emp', password='pw12345!x', user_type='employee')
+        reviewers = Employee.objects.bulk_create([
+            Employee(username=f'reviewer{n}', user_type='employee') for n in range(25)
+        ])
+        cls.book = Book.objects.create(title='吾輩は猫である', author='夏目漱石', publish_date='1905')
+        other = Book.objects.create(title='こころ', author='夏目漱石', publish_date='1914')
+        today = date.today()
+        # Dates repeat (review_id breaks the ties) and every fifth review has none
+        cls.reviews = [
+            Review.objects.create(book=cls.book, employee=reviewer, score=n % 5 + 1, review_title=f'感想{n}',
+                                  review='よい本' * (n + 1), date=None if n % 5 == 0 else today - timedelta(days=n // 3))
+            for n, reviewer in enumerate(reviewers)
+        ]
+        Review.objects.create(book=other, employee=reviewers[0], score=3, review_title='別の本')
+
+    def setUp(self):
+        self.client.force_login(self.employee)
+
+    def json_page(self, cursor=None):
+        params = {'format': 'json'}
+        if cursor:
+            params['cursor'] = cursor
+        return self.client.get(reverse('book_reviews', args=[self.book.pk]), params).json()
+
+    def test_json_cursor_pages_cover_every_review_once(self):
+        ids, cursor, pages = [], None, 0
+        while True:
+            page = self.json_page(cursor)
+            pages += 1
+            ids.extend(review['review_id'] for review in page['reviews'])
+            cursor = page['next_cursor']
+            if cursor is None:
+                break
+        self.assertEqual(pages, 3)
+        expected = sorted(self.reviews, key=lambda review: (review.date or date.min, review.review_id), reverse=True)
+        self.assertEqual(ids, [review.review_id for review in expected])
+
+    def test_undated_reviews_come_last(self):
+        last = self.json_page(self.json_page(self.json_page()['next_cursor'])['next_cursor'])['reviews']
+        undated = [review for review in last if review['date'] is None]
+        self.assertEqual(len(undated), 5)
+        self.assertEqual(last[-5:], undated)
+        self.assertEqual(undated[0], {
+            'review_id': self.reviews[20].review_id, 'review_title': '感想20', 'score': 1, 'date': None,
+            'employee': 'reviewer20', 'preview': 'よい本' * 21, 'truncated': False,
+        })
+
+    def test_html_fragment_links_the_next_page(self):
+        response = self.client.get(reverse('book_reviews', args=[self.book.pk]))
+        page = response.context['review_page']
+        self.assertEqual(len(page), 10)
+        self.assertContains(response, 'Load more reviews')
+        self.assertContains(response, page.next_cursor)
+        self.assertNotContains(response, '別の本')
+
+        for _ in range(2):
+            response = self.client.get(reverse('book_reviews', args=[self.book.pk]),
+                                       {'cursor': response.context['review_page'].next_cursor})
+        self.assertEqual(len(response.context['review_page']), 5)
+        self.assertNotContains(response, 'Load more reviews')
+
+    def test_truncated_review_full_text(self):
+        review = self.reviews[1]
+        Review.objects.filter(pk=review.pk).update(review='猫' * 450)
+        first = self.json_page()['reviews']
+        preview = next(item for item in first if item['review_id'] == review.review_id)
+        self.assertEqual((preview['preview'], preview['truncated']), ('猫' * 300, True))
+
+        response = self.client.get(reverse('review_text', args=[review.review_id]))
+        self.assertEqual(response.json(), {'review_id': review.review_id, 'review': '猫' * 450})
+        response = self.client.get(reverse('review_text', args=[self.reviews[0].review_id]))
+        self.assertEqual(response.json()['review'], 'よい本')
+        self.assertEqual(self.client.get(reverse('review_text', args=[0])).status_code, 404)
+
+class LoanDigestTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        storage = Storage.objects.create(storage_name='A')
+        book = Book.objects.create(title='吾輩は猫である', author='夏目漱石', publish_date='1905')
+        instances = [BookInstance.objects.create(book=book, storage=storage) for _ in range(4)]
+        cls.alice = Employee.objects.create_user(username='alice', password='pw12345!x', user_type='employee',
+                                                 email='alice@example.com')
+        cls.bob = Employee.objects.create_user(username='bob', password='pw12345!x', user_type='employee')
+        today = date.today()
+        for instance, employee, due in [
+            (instances[0], cls.alice, today - timedelta(days=3)),   # overdue
+            (instances[1], cls.alice, today + timedelta(days=1)),   # due soon
+            (instances[2], cls.alice, today + timedelta(days=10)),  # not yet
+            (instances[3], cls.bob, today - timedelta(days=1)),     # overdue, no email
+        ]:
+            Loan.objects.create(book_instance=instance, employee=employee,
+                                loan_start=due - timedelta(days=7), due_date=due)
+
+    def test_one_digest_per_employee_and_no_repeat(self):
+        summary = send_loan_digests()
+        self.assertEqual((summary['sent'], summary['loans'], summary['no_email']), (1, 2, 1))
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['alice@example.com'])
+        self.assertEqual(mail.outbox[0].subject, '[Library] 1 overdue, 1 due soon')
+        self.assertIn('3 days overdue', mail.outbox[0].body)
+
+        self.assertEqual(send_loan_digests()['sent'], 0)
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_overdue_reminder_repeats_after_interval(self):
+        send_loan_digests()
+        later = date.today() + timedelta(days=7)
+        summary = send_loan_digests(today=later)
+        # Both of alice's loans are overdue by then; the earlier due-soon notice does not suppress it
+        self.assertEqual(summary['sent'], 1)
+        self.assertIn('2 overdue', mail.outbox[-1].subject)
+
+
+class ExportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.librarian = Librarian.objects.create_user(username='lib', password='pw12345!x')
+        cls.books = [Book.objects.create(title=f'本{n}', author='著者', publish_date='2000') for n in range(3)]
+
+    def test_csv_and_incremental_ndjson(self):
+        self.client.force_login(self.librarian)
+        response = self.client.get(reverse('export_data', args=['books']))
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0].split(',')[:3], ['book_id', 'isbn', 'title'])
+        self.assertEqual(len(lines), 4)
+
+        # Only rows changed after the watermark, in change order
+        Book.objects.filter(pk=self.books[0].pk).update(updated_at=timezone.now() - timedelta(days=2))
+        since = (timezone.now() - timedelta(days=1)).isoformat()
+        response = self.client.get(reverse('export_data', args=['books']), {'format': 'ndjson', 'since': since})
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertIn('X-Export-Watermark', response)
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual({row['book_id'] for row in rows}, {self.books[1].pk, self.books[2].pk})
+
+        self.assertEqual(self.client.get(reverse('export_data', args=['nope'])).status_code, 404)
+        self.assertEqual(self.client.get(reverse('export_data', args=['books']), {'since': 'x'}).status_code, 400)
+
+
+class AdminChangelistTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = Employee.objects.create_superuser(username='admin', password='pw12345!x', user_type='librarian')
+        cls.storage = Storage.objects.create(storage_name='A')
+        cls.employee = Employee.objects.create_user(username='emp', password='pw12345!x', user_type='employee')
+
+    def add_loans(self, count):
+        today = date.today()
+        for _ in range(count):
+            book = Book.objects.create(title=f'本{Book.objects.count()}', author='著者', publish_date='2000')
+            instance = BookInstance.objects.create(book=book, storage=self.storage)
+            Loan.objects.create(book_instance=instance, employee=self.employee,
+                                loan_start=today - timedelta(days=10), due_date=today - timedelta(days=3))
+
+    def queries(self, url, **params):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return len(ctx)
+
+    def test_query_count_does_not_grow_with_rows(self):
+        self.client.force_login(self.admin)
+        urls = [
+            (reverse('admin:rental_loan_changelist'), {}),
+            (reverse('admin:registration_book_bookinstance_changelist'), {}),
+            (reverse('admin:autocomplete'), {'app_label': 'rental', 'model_name': 'loan', 'field_name': 'book_instance'}),
+        ]
+        self.add_loans(2)
+        before = [self.queries(url, **params) for url, params in urls]
+        self.add_loans(5)
+        self.assertEqual([self.queries(url, **params) for url, params in urls], before)
+
+        response = self.client.get(reverse('admin:rental_loan_changelist'))
+        self.assertEqual(sum(loan.overdue_now for loan in response.context['cl'].result_list), 7)
+
+
+class AvailabilityTimelineTests(SimpleTestCase):
+    day = date(2030, 1, 1)
+
+    def booking(self, start, end, kind='reservation', pk=1, employee_id=1):
+        return Booking(kind, pk, employee_id, 'emp', self.day + timedelta(days=start), self.day + timedelta(days=end))
+
+    def on(self, *days):
+        return [self.day + timedelta(days=d) for d in days]
+
+    def test_overlap_edges(self):
+        timeline = AvailabilityTimeline([self.booking(10, 15)])
+        for start, end, closed, expected in [
+            (15, 20, True, 1), (15, 20, False, 0),   # starts the day it ends
+            (5, 10, True, 1), (5, 10, False, 0),     # ends the day it starts
+            (16, 20, True, 0), (5, 9, True, 0),
+            (11, 12, False, 1), (5, 20, False, 1),
+        ]:
+            with self.subTest(start=start, end=end, closed=closed):
+                self.assertEqual(len(timeline.conflicts(*self.on(start, end), closed=closed)), expected)
+
+    def test_long_booking_found_behind_short_ones(self):
+        # The running maximum of end dates keeps the walk going past [5, 6]
+        timeline = AvailabilityTimeline([self.booking(1, 30, pk=1), self.booking(5, 6, pk=2), self.booking(40, 41, pk=3)])
+        self.assertEqual([b.pk for b in timeline.conflicts(*self.on(20, 21))], [1])
+        self.assertEqual([b.pk for b in timeline.conflicts(*self.on(0, 50))], [1, 2, 3])
+
+    def test_exclusions(self):
+        timeline = AvailabilityTimeline([
+            self.booking(1, 3, pk=1, employee_id=7), self.booking(2, 4, kind='loan', pk=1, employee_id=8),
+        ])
+        self.assertEqual([b.kind for b in timeline.conflicts(*self.on(0, 5), exclude_employee=7)], ['loan'])
+        self.assertEqual([b.kind for b in timeline.conflicts(*self.on(0, 5), exclude_reservation=1)], ['loan'])
+
+    def test_first_free_window_fills_gaps(self):
+        timeline = AvailabilityTimeline([self.booking(2, 4, pk=1), self.booking(6, 8, pk=2, employee_id=2)])
+        first = self.on(0)[0]
+        self.assertEqual(timeline.first_free_window(1, not_before=first), self.on(0)[0])
+        self.assertEqual(timeline.first_free_window(0, not_before=self.on(3)[0]), self.on(5)[0])
+        self.assertEqual(timeline.first_free_window(2, not_before=first), self.on(9)[0])
+        # The employee's own booking does not block them
+        self.assertEqual(timeline.first_free_window(2, not_before=self.on(3)[0], exclude_employee=2), self.on(5)[0])
+
+
+class BookingFormTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.employee = Employee.objects.create_user(username='emp', password='pw12345!x', user_type='employee')
+        cls.other = Employee.objects.create_user(username='emp2', password='pw12345!x', user_type='employee')
+        storage = Storage.objects.create(storage_name='A')
+        cls.book = Book.objects.create(title='吾輩は猫である', author='夏目漱石', publish_date='1905')
+        cls.instance = BookInstance.objects.create(book=cls.book, storage=storage)
+        cls.today = date.today()
+
+    def days(self, n):
+        return self.today + timedelta(days=n)
+
+    def reserve(self, start, end, employee=None):
+        return Reservation.objects.create(book_instance=self.instance, employee=employee or self.other,
+                                          future_rent=self.days(start), future_return=self.days(end))
+
+    def reservation_errors(self, start, end):
+        form = ReservationForm({'future_rent': self.days(start), 'future_return': self.days(end)},
+                               book_instance=self.instance, user=self.employee)
+        return form.errors.get('__all__', [])
+
+    def test_reservation_model_allows_same_day_handover(self):
+        self.reserve(3, 6)
+        Reservation(book_instance=self.instance, employee=self.employee,
+                    future_rent=self.days(6), future_return=self.days(9)).clean()
+        with self.assertRaises(ValidationError):
+            Reservation(book_instance=self.instance, employee=self.employee,
+                        future_rent=self.days(5), future_return=self.days(9)).clean()
+
+    def test_reservation_form_messages(self):
+        self.assertEqual(self.reservation_errors(2, 5), [])
+        self.assertEqual(self.reservation_errors(0, 3), [f"Reservations can begin no earlier than {self.days(1)}"])
+
+        self.reserve(3, 6)
+        self.assertEqual(self.reservation_errors(5, 8), [
+            f"This copy is already reserved from {self.days(3)} to {self.days(6)}. "
+            f"The first free period of this length starts on {self.days(7)}."
+        ])
+        Loan.objects.create(book_instance=self.instance, employee=self.other,
+                            loan_start=self.today, due_date=self.days(2))
+        self.assertEqual(self.reservation_errors(1, 4), [
+            f"This copy is on loan until {self.days(2)}. The first free period of this length starts on {self.days(7)}."
+        ])
+
+    def test_rent_form_messages(self):
+        form = RentForm({'due_date': self.days(5)}, book_instance=self.instance, user=self.employee)
+        self.assertTrue(form.is_valid())
+        self.reserve(3, 6)
+        form = RentForm({'due_date': self.days(5)}, book_instance=self.instance, user=self.employee)
+        self.assertIn(f"Cannot rent until {self.days(5)} because this copy is reserved "
+                      f"from {self.days(3)} to {self.days(6)} by emp2.", form.errors['__all__'][0])
+        self.assertTrue(RentForm({'due_date': self.days(2)}, book_instance=self.instance, user=self.employee).is_valid())
+
+    def unlocked_timelines_see_nothing(self):
+        """Simulate a booking committed between form validation and the locked re-check."""
+        load = AvailabilityTimeline.for_instance
+
+        def for_instance(book_instance, since=None, lock=False):
+            return load(book_instance, since, lock) if lock else AvailabilityTimeline([])
+        return patch.object(AvailabilityTimeline, 'for_instance', for_instance)
+
+    def test_locked_recheck_in_views(self):
+        self.client.force_login(self.employee)
+        self.reserve(3, 6)
+        with self.unlocked_timelines_see_nothing():
+            response = self.client.post(reverse('rent_with_due_date', args=[self.instance.pk]),
+                                        {'due_date': self.days(5)})
+            self.assertIn('Cannot rent until', str(list(get_messages(response.wsgi_request))[0]))
+            self.assertFalse(Loan.objects.exists())
+
+            response = self.client.post(reverse('reserve_book', args=[self.instance.pk]),
+                                        {'future_rent': self.days(4), 'future_return': self.days(8)})
+            self.assertContains(response, 'already reserved')
+            self.assertEqual(Reservation.objects.count(), 1)
+
+
+class ReservationPromotionTests(TestCase):
+    def setUp(self):
+        self.employees = [
+            Employee.objects.create_user(username=f'emp{n}', password='pw12345!x', user_type='employee')
+            for n in range(3)
+        ]
+        storage = Storage.objects.create(storage_name='A')
+        self.book = Book.objects.create(title='吾輩は猫である', author='夏目漱石', publish_date='1905')
+        self.copies = [BookInstance.objects.create(book=self.book, storage=storage) for _ in range(5)]
+        self.today = date.today()
+
+    def reserve(self, copy, employee, days_ago=0):
+        start = self.today - timedelta(days=days_ago)
+        return Reservation.objects.create(book_instance=copy, employee=employee,
+                                          future_rent=start, future_return=start + timedelta(days=7))
+
+    def lend(self, copy, employee):
+        return Loan.objects.create(book_instance=copy, employee=employee,
+                                   loan_start=self.today, due_date=self.today + timedelta(days=3))
+
+    def test_summary_of_a_mixed_run(self):
+        self.lend(self.copies[0], self.employees[0])
+        duplicate = self.reserve(self.copies[0], self.employees[0])
+        waiting = self.reserve(self.copies[0], self.employees[1])
+        converted = self.reserve(self.copies[1], self.employees[0], days_ago=1)
+        # Same free copy: the earlier reservation gets it, this one waits
+        claimed = self.reserve(self.copies[1], self.employees[2])
+        not_due = Reservation.objects.create(book_instance=self.copies[3], employee=self.employees[1],
+                                             future_rent=self.today + timedelta(days=1),
+                                             future_return=self.today + timedelta(days=5))
+
+        summary = promote_due_reservations()
+        loan = Loan.objects.get(book_instance=self.copies[1], return_date__isnull=True)
+        self.assertEqual(summary, {
+            'date': self.today, 'due': 4, 'converted': 1, 'duplicates': 1, 'waiting': 2, 'errors': 0,
+            'loan_ids': [loan.loan_id],
+        })
+        self.assertEqual(loan.employee_id, self.employees[0].pk)
+        self.assertEqual(loan.due_date, converted.future_return)
+        self.assertEqual(
+            set(Reservation.objects.values_list('pk', flat=True)),
+            {waiting.pk, claimed.pk, not_due.pk},
+        )
+        self.assertFalse(Reservation.objects.filter(pk=duplicate.pk).exists())
+        self.assertEqual(Book.objects.get(pk=self.book.pk).available_copies, 3)
+
+    def test_batches_are_bounded(self):
+        for copy, employee in zip(self.copies, self.employees + self.employees):
+            self.reserve(copy, employee)
+        sizes = []
+
+        def record(batch, today, summary):
+            sizes.append(len(batch))
+            return promote_batch(batch, today, summary)
+
+        promote_batch = reservations._promote_batch
+        with patch.object(reservations, '_promote_batch', record):
+            summary = promote_due_reservations(batch_size=2)
+        self.assertEqual(sizes, [2, 2, 1])
+        self.assertEqual(summary['converted'], 5)
+        self.assertFalse(Reservation.objects.exists())
+
+    def test_failed_batch_is_rolled_back_and_counted(self):
+        for copy, employee in zip(self.copies[:2], self.employees):
+            self.reserve(copy, employee)
+        with patch.object(reservations, '_create_loans', side_effect=RuntimeError('boom')):
+            summary = promote_due_reservations()
+        self.assertEqual((summary['due'], summary['errors'], summary['converted']), (2, 2, 0))
+        self.assertEqual(Reservation.objects.count(), 2)
+        self.assertFalse(Loan.objects.exists())
+
+    def test_concurrent_rental_falls_back_to_one_loan_at_a_time(self):
+        # A copy rented after the batch read its active loans makes bulk_create fail
+        first = self.reserve(self.copies[0], self.employees[0])
+        second = self.reserve(self.copies[1], self.employees[1])
+        self.lend(self.copies[1], self.employees[2])
+        new_loans = [
+            (res, Loan(book_instance_id=res.book_instance_id, employee_id=res.employee_id,
+                       loan_start=self.today, due_date=res.future_return))
+            for res in (first, second)
+        ]
+        summary = {'waiting': 0}
+        created = reservations._create_loans(new_loans, summary)
+        self.assertEqual([res for res, _ in created], [first])
+        self.assertEqual(summary['waiting'], 1)
+        self.assertTrue(Loan.objects.filter(book_instance=self.copies[0], employee=self.employees[0]).exists())
+
+
+class RatingSummaryTests(TestCase):
+    def setUp(self):
+        self.employee = Employee.objects.create_user(username='emp', password='pw12345!x', user_type='employee')
+        self.other = Employee.objects.create_user(username='emp2', password='pw12345!x', user_type='employee')
+        storage = Storage.objects.create(storage_name='A')
+        self.book = Book.objects.create(title='吾輩は猫である', author='夏目漱石', publish_date='1905')
+        self.second = Book.objects.create(title='こころ', author='夏目漱石', publish_date='1914')
+        self.instance = BookInstance.objects.create(book=self.book, storage=storage)
+
+    def summary(self, book=None):
+        return Book.objects.values_list(
+            'rating_count', 'rating_sum', 'rating_avg', 'rating_1', 'rating_2', 'rating_3', 'rating_4', 'rating_5',
+        ).get(pk=(book or self.book).pk)
+
+    def review(self, employee, score, book=None):
+        return Review.objects.create(book=book or self.book, employee=employee, score=score, review_title='感想')
+
+    def test_new_reviews_are_counted(self):
+        self.review(self.employee, 4)
+        self.review(self.other, 1)
+        Review.objects.create(book=self.second, employee=self.employee, score=None)
+        self.assertEqual(self.summary(), (2, 5, 2.5, 1, 0, 0, 1, 0))
+        self.assertEqual(self.summary(self.second), (0, 0, None, 0, 0, 0, 0, 0))
+
+    def test_score_change_through_return_view(self):
+        self.review(self.employee, 2)
+        loan = Loan.objects.create(book_instance=self.instance, employee=self.employee, loan_start=date.today())
+        self.client.force_login(self.employee)
+        self.client.post(reverse('return_and_review', args=[loan.loan_id]),
+                         {'review_title': 'よい', 'score': 5, 'review': ''})
+        self.assertEqual(Review.objects.get().score, 5)
+        self.assertEqual(self.summary(), (1, 5, 5.0, 0, 0, 0, 0, 1))
+
+    def test_admin_edit_moves_score_between_books(self):
+        self.review(self.employee, 3)
+        # As the admin does: load the row, change it, save()
+        review = Review.objects.get()
+        review.book = self.second
+        review.score = 4
+        review.save()
+        review.score = None
+        review.save()
+        self.assertEqual(self.summary(), (0, 0, None, 0, 0, 0, 0, 0))
+        self.assertEqual(self.summary(self.second), (0, 0, None, 0, 0, 0, 0, 0))
+        review.score = 2
+        review.save()
+        self.assertEqual(self.summary(self.second), (1, 2, 2.0, 0, 1, 0, 0, 0))
+
+    def test_delete_removes_the_stored_score(self):
+        review = self.review(self.employee, 4)
+        self.review(self.other, 2)
+        # Unsaved edits do not change what the row counted towards
+        review.score = 1
+        review.delete()
+        self.assertEqual(self.summary(), (1, 2, 2.0, 0, 1, 0, 0, 0))
+        self.other.delete()
+        self.assertEqual(self.summary(), (0, 0, None, 0, 0, 0, 0, 0))
+
+    def test_reconcile_ratings_repairs_drift(self):
+        self.review(self.employee, 4)
+        self.review(self.other, 5)
+        # Queryset updates bypass the signals
+        Review.objects.filter(employee=self.other).update(score=1)
+        Book.objects.filter(pk=self.second.pk).update(rating_count=3, rating_sum=9, rating_3=3)
+
+        out = StringIO()
+        call_command('reconcile_ratings', '--dry-run', stdout=out)
+        self.assertIn('2 books drifted', out.getvalue())
+        self.assertEqual(self.summary(), (2, 9, 4.5, 0, 0, 0, 1, 1))
+
+        out = StringIO()
+        call_command('reconcile_ratings', stdout=out)
+        self.assertIn('Reconciled 2 books', out.getvalue())
+        self.assertEqual(self.summary(), (2, 5, 2.5, 1, 0, 0, 1, 0))
+        self.assertEqual(self.summary(self.second), (0, 0, None, 0, 0, 0, 0, 0))
+
+        out = StringIO()
+        call_command('reconcile_ratings', stdout=out)
+        self.assertIn('All rating summaries are consistent', out.getvalue())
@@ -12,6 +12,8 @@ urlpatterns = [
     path('instance/<str:instance_id>/rent/', views.rent_with_due_date, name='rent_with_due_date'),
     path('create-loan/', views.create_loan, name='create_loan'),
     path('instance/<str:instance_id>/reserve/', views.reserve_book, name='reserve_book'),
+    path('book/<int:book_id>/reviews/', views.book_reviews, name='book_reviews'),
+    path('review/<int:review_id>/text/', views.review_text, name='review_text'),
     path('cancel_reservation/<int:reservation_id>/', views.cancel_reservation, name='cancel_reservation'),
     path('loan-history/', views.loan_history, name='loan_history'),
     path('loan/<int:loan_id>/return/', views.return_and_review, name='return_and_review'),
@@ -1,57 +1,52 @@
+from django.conf import settings
 from django.shortcuts import render, get_object_or_404
-from django.db.models import Q, Avg, Count, BooleanField, ExpressionWrapper
+from django.http import Http404, JsonResponse
+from django.db.models import F, Q, Count, DateField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Length, Substr
 from django.db import IntegrityError, transaction
 from django.core.paginator import Paginator
-from django.contrib.auth.decorators import login_required
 from django.contrib.auth import logout
 from django.contrib import messages
 from django.shortcuts import redirect
 from django.utils import timezone
 from datetime import date, timedelta
-import logging
 from urllib.parse import urlencode
-from .models import Loan, Reservation, Review
+import uuid
+from .models import Loan, LoanHistory, Reservation, Review
 from registration_book.models import Book, BookInstance
-from .forms import BookInstanceSearchForm, DeleteAccountForm, RentForm, ReservationForm, ReviewForm
+from registration_book import cache as catalog_cache
+from registration_book.search import get_search_backend
+from taskqueue.queue import enqueue
+from .forms import (
+    BookInstanceSearchForm, DeleteAccountForm, RentForm, ReservationForm, ReviewForm,
+    reservation_conflict_message,
+)
+from .availability import AvailabilityTimeline, get_book_availability, get_rating_summary
+from .pagination import KeysetPaginator, MergedKeysetPaginator, approximate_count
 # Create your views here.
 
-def employee_required(view_func):
-    """
-    Decorator: only allow access if user.user_type == 'employee'.
-    Redirects others to the employee login.
-    """
-    from functools import wraps
-    from django.urls import reverse_lazy
-
-    @wraps(view_func)
-    @login_required(login_url=reverse_lazy('accounts:employee_login'))
-    def _wrapped(request, *args, **kwargs):
-        if getattr(request.user, 'user_type', None) != 'employee':
-            return redirect('accounts:employee_login')
-        return view_func(request, *args, **kwargs)
-    return _wrapped
-
-@login_required(login_url='/accounts/employee/login/')
 def rental_index(request):
-    if not hasattr(request.user, 'user_type') or request.user.user_type != 'employee':
-        return redirect('/accounts/employee/login/')
     return render(request, 'rental/rental_index.html')
 
-@login_required(login_url='/accounts/employee/login/')
 def book_instance_search(request):
-    if not hasattr(request.user, 'user_type') or request.user.user_type != 'employee':
-        return redirect('/accounts/employee/login/')
     form = BookInstanceSearchForm(request.GET)
     return render(request, 'rental/book_instance_search.html', {'form': form})
 
-@login_required(login_url='/accounts/employee/login/')
 def book_instance_results(request):
     form = BookInstanceSearchForm(request.GET)
     instances = None
     page_obj = None
+    book_page = None
+    result_count = None
 
-    # Determine sort field and direction
-    sort = request.GET.get('sort', 'title')   # default sort key
+    # group=book returns one row per Book (keyset paginated) instead of one per copy
+    group_by_book = request.GET.get('group') == 'book'
+    # 'exact', 'approx' (planner estimate) or 'none'
+    count_mode = request.GET.get('count', getattr(settings, 'SEARCH_RESULTS_COUNT', 'exact'))
+
+    # Determine sort field and direction (relevance by default for text searches)
+    has_text_query = bool(request.GET.get('title', '').strip() or request.GET.get('author', '').strip())
+    sort = request.GET.get('sort', 'relevance' if has_text_query else 'title')
     direction = request.GET.get('dir', 'asc') # 'asc' or 'desc'
     sort_prefix = '' if direction == 'asc' else '-'
     # Map allowed sort keys to model fields
@@ -60,36 +55,51 @@ def book_instance_results(request):
         'author': 'book__author',
         'isbn': 'book__isbn',
         'storage': 'storage__name',  # adjust to your storage field
+        'available': 'book__available_copies',
     }
-    order_by = sort_prefix + sort_fields.get(sort, 'book__title')
+    if sort == 'relevance' and has_text_query:
+        order_by = '-search_rank' if direction == 'asc' else 'search_rank'
+    elif sort == 'rating':
+        # Best rated first by default; unrated books always last
+        rating = F('book__rating_avg')
+        order_by = rating.desc(nulls_last=True) if direction == 'asc' else rating.asc(nulls_last=True)
+    else:
+        order_by = sort_prefix + sort_fields.get(sort, 'book__title')
 
     if form.is_valid():
         isbn = form.cleaned_data.get('isbn', '').strip()
         title = form.cleaned_data.get('title', '').strip()
         author = form.cleaned_data.get('author', '').strip()
 
-        # Build search query
-        if isbn or title or author:
-            query = Q()
-            if isbn:
-                query &= Q(book__isbn__exact=isbn)
-            if title:
-                query &= Q(book__title__icontains=title)
-            if author:
-                query &= Q(book__author__icontains=author)
-            instances = BookInstance.objects.filter(query)
-        else:
-            instances = BookInstance.objects.all()
-
-        # Apply related selects, sorting, and pagination
-        instances = (
-            instances
-            .select_related('book', 'storage')
-            .order_by(order_by)
-        )
+        if group_by_book:
+            book_page, result_count = _book_group_results(request, form, direction, count_mode)
+            return render(request, 'rental/book_instance_results.html', {
+                'form': form,
+                'book_page': book_page,
+                'result_count': result_count,
+                'count_mode': count_mode,
+                'group_by_book': True,
+                'current_sort': 'title',
+                'current_dir': direction,
+            })
+
+        # Build search query; title/author go through the catalog search index
+        instances = BookInstance.objects.all()
+        if isbn:
+            instances = instances.filter(book__isbn__exact=isbn)
+        if title or author:
+            instances = get_search_backend().search(instances, prefix='book__', title=title, author=author)
+
+        # Denormalized counter on Book, so no join against Loan is needed
+        if form.cleaned_data.get('available_only'):
+            instances = instances.filter(book__available_copies__gt=0)
+
+        # Apply sorting and pagination; the page's books and storages come from the catalog cache
+        instances = instances.order_by(order_by, 'book__title', 'book_instance_id')
         paginator = Paginator(instances, 20)
         page_number = request.GET.get('page')
         page_obj = paginator.get_page(page_number)
+        page_obj.object_list = catalog_cache.attach_catalog(page_obj.object_list)
     
     else:
         instances = None
@@ -104,12 +114,44 @@ def book_instance_results(request):
     })
 
 
+def _book_group_results(request, form, direction, count_mode):
+    """
+    One row per Book with its copy summary, keyset-paginated on (title, book_id).
+    Availability comes from the denormalized counters, so no Loan join is needed.
+    """
+    isbn = form.cleaned_data.get('isbn', '').strip()
+    title = form.cleaned_data.get('title', '').strip()
+    author = form.cleaned_data.get('author', '').strip()
+
+    books = Book.objects.all()
+    if isbn:
+        books = books.filter(isbn=isbn)
+    if title or author:
+        books = get_search_backend().search(books, ranked=False, title=title, author=author)
+    if form.cleaned_data.get('available_only'):
+        books = books.filter(available_copies__gt=0)
+
+    if count_mode == 'approx':
+        result_count = approximate_count(books)
+    elif count_mode == 'none':
+        result_count = None
+    else:
+        result_count = books.count()
+
+    # Any copy to link to; the detail page lists every copy of the book
+    first_instance = BookInstance.objects.filter(book=OuterRef('pk')).order_by('book_instance_id').values('pk')[:1]
+    books = books.defer('search_vector').annotate(first_instance_id=Subquery(first_instance))
+
+    ordering = ('title', 'book_id') if direction == 'asc' else ('-title', '-book_id')
+    book_page = KeysetPaginator(books, ordering, 20).get_page(request.GET.get('cursor'))
+    return book_page, result_count
+
+
 def rental_logout(request):
     logout(request)
     return redirect('employee_login')
 
 
-@employee_required
 def delete_account(request):
     if request.method == 'POST':
         form = DeleteAccountForm(request.POST, user=request.user)
@@ -124,115 +166,96 @@ def delete_account(request):
     return render(request, 'rental/delete_account.html', {'form': form})
 
 
-@login_required(login_url='/accounts/employee/login/')
 def book_instance_detail(request, instance_id):
-    if not hasattr(request.user, 'user_type') or request.user.user_type != 'employee':
-        return redirect('/accounts/employee/login/')
-    
-    book_instance = get_object_or_404(BookInstance, book_instance_id=instance_id)
-    book = book_instance.book
-    
-    # Check if this instance is currently on loan
-    current_loan = None
-    is_available = True
     try:
-        current_loan = Loan.objects.get(book_instance=book_instance, return_date__isnull=True)
-        is_available = False
-    except Loan.DoesNotExist:
-        is_available = True
-
-    # Get the latest reservation for this specific book instance
-    latest_reservation = Reservation.objects.filter(
-        book_instance=book_instance
-    ).order_by('-future_return').first()
-
-    # Check if user has existing reservations for this book
-    user_reservation_this_instance = Reservation.objects.filter(
-        book_instance=book_instance,
-        employee=request.user,
-        future_return__gte=date.today()
-    ).first()
-    
-    user_reservation_any_copy = Reservation.objects.filter(
-        book_instance__book=book,
-        employee=request.user,
-        future_return__gte=date.today()
-    ).first()
-    
-    # Check if user is currently borrowing this specific instance
-    user_has_this_instance = Loan.objects.filter(
-        book_instance=book_instance,
-        employee=request.user,
-        return_date__isnull=True
-    ).exists()
-
-    # Check if user is currently borrowing any copy of this book
-    user_has_any_copy = Loan.objects.filter(
-        book_instance__book=book,
-        employee=request.user,
-        return_date__isnull=True
-    ).exists()
-
-    all_instances = BookInstance.objects.filter(book=book).select_related('storage')
-    
-    available_instances = []
-    loaned_instances = []
-    
-    for instance in all_instances:
-        try:
-            loan = Loan.objects.get(book_instance=instance, return_date__isnull=True)
-            loaned_instances.append({
-                'instance': instance,
-                'loan': loan
-            })
-        except Loan.DoesNotExist:
-            available_instances.append(instance)
-    
-    # Get reviews and other data...
-    reviews = Review.objects.filter(book=book).select_related('employee').order_by('-date')
-    avg_rating = reviews.aggregate(Avg('score'))['score__avg']
-    rating_counts = reviews.values('score').annotate(count=Count('score')).order_by('score')
-    
-    # Get latest reservation
-    latest_reservation = Reservation.objects.filter(
-        book_instance=book_instance
-    ).order_by('-future_return').first()
+        instance_id = uuid.UUID(instance_id)
+    except ValueError:
+        raise Http404('No BookInstance matches the given query.')
+    # Book, storages and the copy list come from the catalog cache
+    book_id = catalog_cache.get_copy_book_id(instance_id)
+    copies = catalog_cache.get_copies(book_id) if book_id is not None else []
+    book_instance = next((copy for copy in copies if copy.pk == instance_id), None)
+    if book_instance is None:
+        raise Http404('No BookInstance matches the given query.')
+    book = book_instance.book
 
-    
-    
-    context = {
+    # Loans, the user's holdings and reservations in a fixed number of queries
+    context = get_book_availability(book, request.user_id, book_instance, copies=copies)
+
+    # First page of reviews (previews only) and the rating distribution
+    context.update(get_rating_summary(book))
+
+    context.update({
         'book_instance': book_instance,
         'book': book,
-        'current_loan': current_loan,
-        'is_available': is_available,
-        'latest_reservation': latest_reservation,
-        'user_reservation_this_instance': user_reservation_this_instance,
-        'user_reservation_any_copy': user_reservation_any_copy,
-        'user_has_this_instance': user_has_this_instance,
-        'user_has_any_copy': user_has_any_copy,
-        'all_instances': all_instances,
-        'available_instances': available_instances,
-        'loaned_instances': loaned_instances,
-        'total_copies': all_instances.count(),
-        'available_count': len(available_instances),
-        'reviews': reviews,
-        'avg_rating': avg_rating,
-        'rating_counts': rating_counts,
-        'latest_reservation': latest_reservation,
-        'user_can_rent': is_available and not user_has_any_copy,
-        'user_can_reserve': not is_available and not user_has_any_copy,
-    }
-    
+        'review_page': _review_page(book.pk),
+        'preview_length': REVIEW_PREVIEW_LENGTH,
+    })
+
     return render(request, 'rental/book_instance_detail.html', context)
 
 
+REVIEWS_PER_PAGE = 10
+REVIEW_PREVIEW_LENGTH = 300
+
+
+def _review_page(book_id, cursor=None):
+    """
+    One page of a book's reviews, newest first, keyset-paginated on
+    (date, review_id). The review body is deferred; only a preview is read.
+    """
+    reviews = (
+        Review.objects.filter(book_id=book_id)
+        .select_related('employee')
+        .defer('review')
+        .annotate(
+            # Keyset keys must not be NULL
+            sort_date=Coalesce('date', Value(date.min, output_field=DateField())),
+            preview=Substr('review', 1, REVIEW_PREVIEW_LENGTH),
+            review_length=Length('review'),
+        )
+    )
+    return KeysetPaginator(reviews, ('-sort_date', '-review_id'), REVIEWS_PER_PAGE).get_page(cursor)
+
+
+def book_reviews(request, book_id):
+    """Further pages of reviews: an HTML fragment, or JSON with ?format=json."""
+
+    review_page = _review_page(book_id, request.GET.get('cursor'))
+    if request.GET.get('format') == 'json':
+        return JsonResponse({
+            'reviews': [
+                {
+                    'review_id': review.review_id,
+                    'review_title': review.review_title,
+                    'score': review.score,
+                    'date': review.date,
+                    'employee': review.employee.username if review.employee else None,
+                    'preview': review.preview,
+                    'truncated': (review.review_length or 0) > REVIEW_PREVIEW_LENGTH,
+                }
+                for review in review_page
+            ],
+            'next_cursor': review_page.next_cursor,
+        })
+
+    return render(request, 'rental/review_list_fragment.html', {
+        'review_page': review_page,
+        'book_id': book_id,
+        'preview_length': REVIEW_PREVIEW_LENGTH,
+    })
+
+
+def review_text(request, review_id):
+    """Full body of one review, for "Read more"."""
+
+    review = get_object_or_404(Review.objects.only('review_id', 'review'), review_id=review_id)
+    return JsonResponse({'review_id': review.review_id, 'review': review.review or ''})
+
+
 
-@login_required(login_url='/accounts/employee/login/')
 def create_loan(request):
     if request.method == 'POST':
-        if not hasattr(request.user, 'user_type') or request.user.user_type != 'employee':
-            return redirect('/accounts/employee/login/')
-        
         book_instance_id = request.POST.get('book_instance_id')
         book_instance = get_object_or_404(BookInstance, book_instance_id=book_instance_id)
         
@@ -242,14 +265,18 @@ def create_loan(request):
             messages.error(request, 'This book copy is already on loan.')
             return redirect('book_instance_detail', instance_id=book_instance_id)
         
-        # Create loan
-        
-        loan = Loan.objects.create(
-            book_instance=book_instance,
-            employee=request.user,
-            loan_start=date.today(),
-            due_date=date.today() + timedelta(weeks=2)
-        )
+        # Create loan; rental.signals takes the copy out of the available count
+        try:
+            with transaction.atomic():
+                loan = Loan.objects.create(
+                    book_instance=book_instance,
+                    employee_id=request.user_id,
+                    loan_start=date.today(),
+                    due_date=date.today() + timedelta(weeks=2)
+                )
+        except IntegrityError:
+            messages.error(request, 'This book copy is already on loan.')
+            return redirect('book_instance_detail', instance_id=book_instance_id)
         
         messages.success(request, f'You have successfully rented "{book_instance.book.title}" (Copy {book_instance_id}). Due date: {loan.due_date}')
         return redirect('rental_index')
@@ -258,11 +285,7 @@ def create_loan(request):
 
 
 
-@login_required(login_url='/accounts/employee/login/')
 def rent_with_due_date(request, instance_id):
-    if not hasattr(request.user, 'user_type') or request.user.user_type != 'employee':
-        return redirect('/accounts/employee/login/')
-
     book_instance = get_object_or_404(BookInstance, book_instance_id=instance_id)
     
     # Prevent renting if already on loan
@@ -275,7 +298,7 @@ def rent_with_due_date(request, instance_id):
         if form.is_valid():
             MAX_ACTIVE_LOANS = 10
 
-            active_loans_count = Loan.objects.filter(employee=request.user, return_date__isnull=True).count()
+            active_loans_count = Loan.objects.filter(employee_id=request.user_id, return_date__isnull=True).count()
 
             if active_loans_count >= MAX_ACTIVE_LOANS:
                 form.add_error(None, "You cannot rent more than 10 books at once. Please return a book before renting another.")
@@ -286,42 +309,43 @@ def rent_with_due_date(request, instance_id):
                 })
             due = form.cleaned_data['due_date']
             
-            # Double-check for reservation conflicts (in case of race conditions)
+            # Re-check against the copy's timeline with the copy locked, so a
+            # concurrent rental or reservation cannot slip in between
             today = date.today()
-            overlapping_reservations = Reservation.objects.filter(
-                book_instance=book_instance,
-                future_rent__lte=due,
-                future_return__gte=today
-            )
-            
-            if overlapping_reservations.exists():
-                first_conflict = overlapping_reservations.order_by('future_rent').first()
+            try:
+                with transaction.atomic():
+                    timeline = AvailabilityTimeline.for_instance(book_instance, lock=True)
+                    first_conflict = timeline.first_conflict(today, due)
+                    if first_conflict is None:
+                        Loan.objects.create(
+                            book_instance=book_instance,
+                            employee_id=request.user_id,
+                            loan_start=today,
+                            due_date=due
+                        )
+            except IntegrityError:
+                messages.error(request, "Unable to rent this copy; it's already on loan.")
+                return redirect('book_instance_detail', instance_id=instance_id)
+
+            if first_conflict and first_conflict.kind == 'loan':
+                messages.error(request, "Unable to rent this copy; it's already on loan.")
+                return redirect('book_instance_detail', instance_id=instance_id)
+            if first_conflict:
                 messages.error(
                     request,
                     f"Cannot rent until {due} because this copy is reserved "
-                    f"from {first_conflict.future_rent} to {first_conflict.future_return}. "
+                    f"from {first_conflict.start} to {first_conflict.end}. "
                     f"Please choose an earlier due date."
                 )
                 return render(request, 'rental/rent_with_due_date.html', {
                     'form': form,
                     'book_instance': book_instance
                 })
-            
-            # Safe to create the loan
-            try:
-                Loan.objects.create(
-                    book_instance=book_instance,
-                    employee=request.user,
-                    loan_start=today,
-                    due_date=due
-                )
-                return render(request, 'rental/rental_complete.html', {
-                    'book': book_instance.book,
-                    'book_instance': book_instance,
-                })
-            except IntegrityError:
-                messages.error(request, "Unable to rent this copy; it's already on loan.")
-                return redirect('book_instance_detail', instance_id=instance_id)
+
+            return render(request, 'rental/rental_complete.html', {
+                'book': book_instance.book,
+                'book_instance': book_instance,
+            })
     else:
         form = RentForm(book_instance=book_instance)
 
@@ -331,29 +355,37 @@ def rent_with_due_date(request, instance_id):
     })
 
 
-@login_required(login_url='/accounts/employee/login/')
 def reserve_book(request, instance_id):
-    if request.user.user_type != 'employee':
-        return redirect('employee_login')
-
     book_instance = get_object_or_404(BookInstance, book_instance_id=instance_id)
     
     if request.method == "POST":
         form = ReservationForm(request.POST, book_instance=book_instance, user=request.user)
         if form.is_valid():
-            res = Reservation.objects.create(
-                book_instance=book_instance,
-                employee=request.user,
-                future_rent=form.cleaned_data["future_rent"],
-                future_return=form.cleaned_data["future_return"]
-            )
-            messages.success(request,
-                f"Reserved '{book_instance.book.title}' from {res.future_rent} to {res.future_return}.")
-            return render(request, 'rental/reservation_complete.html', {
-                'book': book_instance.book,
-                'book_instance': book_instance,
-                'reservation': res,  
-            })
+            start = form.cleaned_data["future_rent"]
+            end = form.cleaned_data["future_return"]
+            # Re-check with the copy locked so two overlapping reservations
+            # cannot both be accepted
+            with transaction.atomic():
+                timeline = AvailabilityTimeline.for_instance(book_instance, lock=True)
+                conflict_message = reservation_conflict_message(timeline, start, end, request.user_id)
+                if conflict_message is None:
+                    res = Reservation.objects.create(
+                        book_instance=book_instance,
+                        employee_id=request.user_id,
+                        future_rent=start,
+                        future_return=end
+                    )
+
+            if conflict_message:
+                form.add_error(None, conflict_message)
+            else:
+                messages.success(request,
+                    f"Reserved '{book_instance.book.title}' from {res.future_rent} to {res.future_return}.")
+                return render(request, 'rental/reservation_complete.html', {
+                    'book': book_instance.book,
+                    'book_instance': book_instance,
+                    'reservation': res,  
+                })
 
     else:
         form = ReservationForm(book_instance=book_instance, user=request.user)
@@ -365,12 +397,8 @@ def reserve_book(request, instance_id):
     })
 
 
-@login_required(login_url='/accounts/employee/login/')
 def cancel_reservation(request, reservation_id):
-    if not hasattr(request.user, 'user_type') or request.user.user_type != 'employee':
-        return redirect('/accounts/employee/login/')
-    
-    reservation = get_object_or_404(Reservation, reserve_id=reservation_id, employee=request.user)
+    reservation = get_object_or_404(Reservation, reserve_id=reservation_id, employee_id=request.user_id)
     
     if request.method == 'POST':
         book_title = reservation.book_instance.book.title
@@ -380,89 +408,67 @@ def cancel_reservation(request, reservation_id):
     
     return render(request, 'rental/cancel_reservation.html', {'reservation': reservation})
 
-@login_required(login_url='/accounts/employee/login/')
 def loan_history(request):
-    if not hasattr(request.user, 'user_type') or request.user.user_type != 'employee':
-        return redirect('/accounts/employee/login/')
-    
-    # Get all loans and reservations for the current user
-    loans = Loan.objects.filter(employee=request.user).select_related('book_instance__book', 'book_instance__storage').annotate(
-            is_active=ExpressionWrapper(
-                Q(return_date__isnull=True),
-                output_field=BooleanField()
-            )
-        ).order_by('-is_active', '-loan_start')
-    reservations = Reservation.objects.filter(employee=request.user).select_related('book_instance__book', 'book_instance__storage').order_by('-future_rent')
-    
-    # Count overdue books
-    overdue_loans = loans.filter(return_date__isnull=True, due_date__lt=date.today())
-    overdue_count = overdue_loans.count()
-    
-    # Pagination for loans
-    paginator = Paginator(loans, 10)  # Show 10 loans per page
-    page_number = request.GET.get('page')
-    page_loans = paginator.get_page(page_number)
-    
+    today = date.today()
+    active_only = request.GET.get('view') == 'active'
+    user_loans = Loan.objects.filter(employee_id=request.user_id).select_related('book_instance__book', 'book_instance__storage')
+
+    if active_only:
+        # Fast path: only the (at most ten) open loans, straight from the
+        # partial active-loan index; historical rows are never read
+        loans = list(user_loans.filter(return_date__isnull=True).order_by('due_date', 'loan_id'))
+        overdue_count = sum(1 for loan in loans if loan.overdue)
+        counts = {'active': len(loans), 'overdue': overdue_count, 'returned': None}
+    else:
+        # Active / overdue / returned counts in one aggregate query, plus the archived loans
+        counts = Loan.objects.filter(employee_id=request.user_id).aggregate(
+            active=Count('loan_id', filter=Q(return_date__isnull=True)),
+            overdue=Count('loan_id', filter=Q(return_date__isnull=True, due_date__lt=today)),
+            returned=Count('loan_id', filter=Q(return_date__isnull=False)),
+        )
+        counts['returned'] += LoanHistory.objects.filter(employee_id=request.user_id).count()
+        overdue_count = counts['overdue']
+        # Returned loans newest first across Loan and LoanHistory, keyed on the
+        # raw columns so each page walks loan_employee_history_idx /
+        # loanhistory_employee_idx; loans without a start date sort where the
+        # database puts NULLs
+        returned = user_loans.filter(return_date__isnull=False)
+        archived = LoanHistory.objects.filter(employee_id=request.user_id).select_related(
+            'book_instance__book', 'book_instance__storage'
+        )
+        loans = MergedKeysetPaginator(
+            [returned, archived], ('-loan_start', '-loan_id'), 10, nullable=('loan_start',)
+        ).get_page(request.GET.get('cursor'))
+        if not loans.has_previous():
+            # The open loans (at most ten) head the first page, from the active-loan index
+            open_loans = user_loans.filter(return_date__isnull=True).order_by('-loan_start', '-loan_id')
+            loans.object_list = list(open_loans) + loans.object_list
+
+    reservations = Reservation.objects.filter(employee_id=request.user_id).select_related(
+        'book_instance__book', 'book_instance__storage'
+    ).annotate(rent_key=Coalesce('future_rent', Value(date.min, output_field=DateField())))
+    reservations = KeysetPaginator(reservations, ('-rent_key', '-reserve_id'), 10).get_page(request.GET.get('rcursor'))
+
     context = {
-        'loans': page_loans,
+        'loans': loans,
         'reservations': reservations,
         'overdue_count': overdue_count,
-        'overdue_loans': overdue_loans,
+        'loan_counts': counts,
+        'active_only': active_only,
+        'active_tab': 'reservations' if request.GET.get('rcursor') else 'loans',
     }
     
     return render(request, 'rental/loan_history.html', context)
 
 
-def process_waiting_reservations_for_book(book_instance):
-    """
-    Process any waiting reservations when a book is returned
-    """
-    
-    logger = logging.getLogger(__name__)
-    today = timezone.localdate()
-    
-    # Find reservations waiting for this specific book
-    waiting_reservations = Reservation.objects.filter(
-        book_instance=book_instance,
-        future_rent__lte=today
-    ).order_by('future_rent')  # First come, first served
-    
-    if not waiting_reservations.exists():
-        return
-    
-    # Process the first waiting reservation
-    next_reservation = waiting_reservations.first()
-    
-    try:
-        with transaction.atomic():
-            # Create loan for the waiting user
-            loan = Loan.objects.create(
-                instance=next_reservation.book_instance,
-                borrower=next_reservation.employee,
-                start_date=today,
-                due_date=next_reservation.future_return,
-            )
-            
-            # Delete the reservation
-            next_reservation.delete()
-            
-            logger.info(f"✅ Auto-processed waiting reservation {next_reservation.reserve_id} → loan {loan.loan_id}")
-            
-    except Exception as e:
-        logger.error(f"Error auto-processing waiting reservation: {e}")
-
-@login_required(login_url='/accounts/employee/login/')
 def return_and_review(request, loan_id):
-    if not hasattr(request.user, 'user_type') or request.user.user_type != 'employee':
-        return redirect('/accounts/employee/login/')
-    
-    loan = get_object_or_404(Loan, loan_id=loan_id, employee=request.user, return_date__isnull=True)
+    loan = get_object_or_404(Loan, loan_id=loan_id, employee_id=request.user_id, return_date__isnull=True)
     
     if request.method == 'POST':
         form = ReviewForm(request.POST)
         if form.is_valid():
             # Handle review creation/update
-            existing_review = Review.objects.filter(book=loan.book_instance.book, employee=request.user).first()
+            existing_review = Review.objects.filter(book=loan.book_instance.book, employee_id=request.user_id).first()
             
             if existing_review:
                 existing_review.review_title = form.cleaned_data['review_title']
@@ -473,34 +479,37 @@ def return_and_review(request, loan_id):
             else:
                 review = form.save(commit=False)
                 review.book = loan.book_instance.book
-                review.employee = request.user
+                review.employee_id = request.user_id
                 review.date = date.today()
                 review.save()
             
-            # Mark loan as returned
-            loan.return_date = date.today()
-            loan.save()
-
-            process_waiting_reservations_for_book(loan.book_instance)
+            # Mark loan as returned and put the copy back into the available count
+            # (conditional UPDATE so a double-submitted return is only counted once)
+            with transaction.atomic():
+                loan.return_date = date.today()
+                returned = Loan.objects.filter(
+                    loan_id=loan.loan_id, return_date__isnull=True
+                ).update(return_date=loan.return_date, updated_at=timezone.now())
+                if returned:
+                    Book.objects.adjust_copy_counts(loan.book_instance.book_id, available=1)
+                    # The worker hands the copy to its next due reservation once the return commits
+                    enqueue('rental.promote_returned_copy', key=f'promote-return:{loan.loan_id}',
+                            book_instance_id=loan.book_instance_id)
             
             messages.success(request, f'Book "{loan.book_instance.book.title}" returned successfully and your review has been saved!')
             return redirect('loan_return_completed')
     else:
-        existing_review = Review.objects.filter(book=loan.book_instance.book, employee=request.user).first()
+        existing_review = Review.objects.filter(book=loan.book_instance.book, employee_id=request.user_id).first()
         form = ReviewForm(instance=existing_review) if existing_review else ReviewForm()
     
     context = {
         'loan': loan,
         'form': form,
-        'existing_review': Review.objects.filter(book=loan.book_instance.book, employee=request.user).first(),
+        'existing_review': Review.objects.filter(book=loan.book_instance.book, employee_id=request.user_id).first(),
     }
     
     return render(request, 'rental/return_and_review.html', context)
 
 
-@login_required(login_url='/accounts/employee/login/')
 def loan_return_completed(request):
-    if not hasattr(request.user, 'user_type') or request.user.user_type != 'employee':
-        return redirect('/accounts/employee/login/')
-    
     return render(request, 'rental/loan_return_completed.html')
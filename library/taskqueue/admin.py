@@ -0,0 +1,43 @@
+from django.contrib import admin
+from django.utils import timezone
+from .models import Task
+
+
+@admin.register(Task)
+class TaskAdmin(admin.ModelAdmin):
+    list_display = [
+        'id',
+        'name',
+        'status',
+        'attempts',
+        'max_attempts',
+        'run_at',
+        'locked_by',
+        'created_at',
+        'finished_at'
+    ]
+    list_filter = [
+        'status',
+        'name'
+    ]
+    search_fields = [
+        'name',
+        'idempotency_key'
+    ]
+    readonly_fields = [
+        'attempts',
+        'locked_by',
+        'locked_at',
+        'last_error',
+        'created_at',
+        'finished_at'
+    ]
+    ordering = ['-id']
+    actions = ['retry_tasks']
+
+    @admin.action(description='Run selected tasks again now')
+    def retry_tasks(self, request, queryset):
+        count = queryset.exclude(status=Task.RUNNING).update(
+            status=Task.QUEUED, attempts=0, run_at=timezone.now(), locked_by='', locked_at=None, finished_at=None,
+        )
+        self.message_user(request, f'{count} tasks queued again')
@@ -0,0 +1,32 @@
+import signal
+from django.core.management.base import BaseCommand
+from taskqueue.worker import Worker
+
+
+class Command(BaseCommand):
+    help = 'Run queued tasks (taskqueue) until interrupted'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Run the tasks that are due now, then exit')
+        parser.add_argument('--batch-size', type=int, help='Tasks claimed per poll (TASK_QUEUE_BATCH_SIZE)')
+        parser.add_argument('--poll-interval', type=float, help='Seconds to sleep when idle (TASK_QUEUE_POLL_SECONDS)')
+
+    def handle(self, *args, **options):
+        worker = Worker(batch_size=options['batch_size'], poll_interval=options['poll_interval'])
+
+        if options['once']:
+            total = 0
+            while True:
+                processed = worker.run_once()
+                total += processed
+                if not processed:
+                    break
+            self.stdout.write(f"Ran {total} tasks")
+            return
+
+        # Finish the current task, then exit
+        signal.signal(signal.SIGTERM, lambda signum, frame: worker.stop())
+        try:
+            worker.run()
+        except KeyboardInterrupt:
+            worker.stop()
@@ -0,0 +1,41 @@
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models
+from django.utils import timezone
+
+
+class Task(models.Model):
+    """One queued call of a registered task (taskqueue.queue); run by `manage.py runworker`."""
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    )
+
+    name = models.CharField('タスク名', max_length=100)
+    kwargs = models.JSONField('引数', default=dict, encoder=DjangoJSONEncoder)
+    idempotency_key = models.CharField('冪等キー', max_length=255, unique=True, null=True, blank=True)
+    status = models.CharField('状態', max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    attempts = models.PositiveIntegerField('試行回数', default=0)
+    max_attempts = models.PositiveIntegerField('最大試行回数', default=5)
+    run_at = models.DateTimeField('実行予定日時', default=timezone.now)
+    locked_by = models.CharField('実行ワーカー', max_length=255, blank=True)
+    locked_at = models.DateTimeField('実行開始日時', null=True, blank=True)
+    last_error = models.TextField('最後のエラー', blank=True)
+    created_at = models.DateTimeField('登録日時', auto_now_add=True)
+    finished_at = models.DateTimeField('完了日時', null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Claim order of runnable tasks
+            models.Index(fields=['run_at', 'id'], condition=models.Q(status='queued'), name='task_queued_idx'),
+            # Stale running tasks (worker died)
+            models.Index(fields=['locked_at'], condition=models.Q(status='running'), name='task_running_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.name} #{self.pk} ({self.status}, attempt {self.attempts}/{self.max_attempts})'
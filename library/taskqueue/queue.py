@@ -0,0 +1,95 @@
+"""
+Lightweight DB-backed task queue.
+
+Side effects that should not hold up a request (OpenBD lookups, reservation
+promotion, notifications) are plain functions registered with @register
+in an app's tasks.py. enqueue() stores a Task row and returns at once; a
+`manage.py runworker` process claims and runs it (taskqueue.worker), with
+retries and exponential backoff. Because the row is written in the caller's
+transaction, a rolled-back request leaves no task behind.
+"""
+import logging
+from datetime import timedelta
+from functools import partial
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from .models import Task
+
+logger = logging.getLogger(__name__)
+
+_registry = {}
+
+
+class UnknownTask(LookupError):
+    pass
+
+
+def register(name, max_attempts=None):
+    """Decorator registering a task function under `name`; it is called with the enqueued kwargs."""
+    def decorator(func):
+        if name in _registry and _registry[name] is not func:
+            raise ValueError(f"Task {name} is already registered")
+        func.task_name = name
+        func.max_attempts = max_attempts
+        _registry[name] = func
+        return func
+    return decorator
+
+
+def get_task(name):
+    try:
+        return _registry[name]
+    except KeyError:
+        raise UnknownTask(name)
+
+
+def enqueue(name, *, key=None, delay=None, max_attempts=None, **kwargs):
+    """
+    Queue a call of task `name` with JSON-serialisable kwargs; returns the Task.
+
+    key is an idempotency key: enqueueing an existing key returns that task
+    instead of adding a second one (keys are freed when finished tasks are
+    deleted, see delete_finished_tasks). delay postpones the first run.
+    """
+    func = get_task(name)
+    fields = {
+        'name': name,
+        'kwargs': kwargs,
+        'idempotency_key': key,
+        'max_attempts': max_attempts or func.max_attempts or settings.TASK_QUEUE_MAX_ATTEMPTS,
+        'run_at': timezone.now() + (delay or timedelta()),
+    }
+
+    if key is None:
+        task = Task.objects.create(**fields)
+    else:
+        task = Task.objects.filter(idempotency_key=key).first()
+        if task is not None:
+            return task
+        try:
+            with transaction.atomic():
+                task = Task.objects.create(**fields)
+        except IntegrityError:
+            # Enqueued concurrently under the same key
+            return Task.objects.get(idempotency_key=key)
+
+    if settings.TASK_QUEUE_EAGER:
+        # No worker (development, tests): run in-process once the caller commits
+        transaction.on_commit(partial(run_eagerly, task.pk), robust=True)
+    return task
+
+
+def run_eagerly(task_id):
+    from .worker import Worker
+
+    Worker(name='eager').run_tasks(Task.objects.filter(pk=task_id, status=Task.QUEUED))
+
+
+def delete_finished_tasks(keep=None):
+    """Delete done tasks older than TASK_QUEUE_KEEP_FINISHED; failed ones stay for inspection."""
+    keep = keep or settings.TASK_QUEUE_KEEP_FINISHED
+    deleted, _ = Task.objects.filter(status=Task.DONE, finished_at__lt=timezone.now() - keep).delete()
+    if deleted:
+        logger.info(f"Deleted {deleted} finished tasks")
+    return deleted
@@ -0,0 +1,66 @@
+from datetime import timedelta
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from .models import Task
+from .queue import enqueue, register
+from .worker import Worker
+
+calls = []
+
+
+@register('taskqueue.tests.record')
+def record(value, fail_times=0):
+    calls.append(value)
+    if calls.count(value) <= fail_times:
+        raise RuntimeError(f'failure {calls.count(value)}')
+
+
+class TaskQueueTests(TestCase):
+    def setUp(self):
+        calls.clear()
+
+    def test_runs_queued_task(self):
+        task = enqueue('taskqueue.tests.record', value='a')
+        self.assertEqual(calls, [])
+        self.assertEqual(Worker().run_once(), 1)
+        task.refresh_from_db()
+        self.assertEqual((task.status, task.attempts), (Task.DONE, 1))
+        self.assertEqual(calls, ['a'])
+
+    def test_idempotency_key_returns_existing_task(self):
+        first = enqueue('taskqueue.tests.record', key='k1', value='a')
+        second = enqueue('taskqueue.tests.record', key='k1', value='b')
+        self.assertEqual(first.pk, second.pk)
+        self.assertEqual(Task.objects.count(), 1)
+
+    def test_failure_is_retried_with_backoff_then_fails(self):
+        task = enqueue('taskqueue.tests.record', max_attempts=2, value='a', fail_times=5)
+        worker = Worker()
+        worker.run_once()
+        task.refresh_from_db()
+        self.assertEqual((task.status, task.attempts), (Task.QUEUED, 1))
+        self.assertGreater(task.run_at, timezone.now())
+        self.assertIn('failure 1', task.last_error)
+
+        # Not due yet
+        self.assertEqual(worker.run_once(), 0)
+        Task.objects.update(run_at=timezone.now())
+        worker.run_once()
+        task.refresh_from_db()
+        self.assertEqual((task.status, task.attempts), (Task.FAILED, 2))
+
+    def test_stale_running_task_is_requeued(self):
+        task = enqueue('taskqueue.tests.record', value='a')
+        Task.objects.update(status=Task.RUNNING, attempts=1, locked_by='dead',
+                            locked_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(Worker().run_once(), 1)
+        task.refresh_from_db()
+        self.assertEqual((task.status, task.attempts), (Task.DONE, 2))
+
+    @override_settings(TASK_QUEUE_EAGER=True)
+    def test_eager_mode_runs_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            enqueue('taskqueue.tests.record', value='a')
+            self.assertEqual(calls, [])
+        self.assertEqual(calls, ['a'])
+        self.assertEqual(Task.objects.get().status, Task.DONE)
@@ -0,0 +1,137 @@
+import logging
+import os
+import random
+import socket
+import threading
+import traceback
+from datetime import timedelta
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+from .models import Task
+from .queue import UnknownTask, get_task
+
+logger = logging.getLogger(__name__)
+
+
+def backoff_delay(attempts):
+    """Delay before retry number `attempts`: doubles per attempt up to the cap, with jitter."""
+    delay = min(
+        settings.TASK_QUEUE_BACKOFF_SECONDS * 2 ** max(attempts - 1, 0),
+        settings.TASK_QUEUE_BACKOFF_MAX_SECONDS,
+    )
+    return timedelta(seconds=delay * random.uniform(0.5, 1.0))
+
+
+class Worker:
+    """
+    Claims runnable tasks and runs them.
+
+    Claiming locks up to batch_size queued tasks whose run_at has passed with
+    SELECT ... FOR UPDATE SKIP LOCKED (PostgreSQL), so concurrent workers
+    never wait on or pick the same rows, and marks them running in the same
+    transaction. SQLite has no row locks; there the conditional
+    UPDATE ... WHERE status = 'queued' decides which worker gets a task.
+    A failing task is retried with exponential backoff until max_attempts,
+    then marked failed. Tasks left running by a worker that died are
+    requeued after TASK_QUEUE_LOCK_TIMEOUT.
+    """
+
+    def __init__(self, name=None, batch_size=None, poll_interval=None):
+        self.name = name or f"{socket.gethostname()}:{os.getpid()}"
+        self.batch_size = batch_size or settings.TASK_QUEUE_BATCH_SIZE
+        self.poll_interval = poll_interval or settings.TASK_QUEUE_POLL_SECONDS
+        self._stop = threading.Event()
+
+    def claim(self):
+        now = timezone.now()
+        with transaction.atomic():
+            ids = list(
+                Task.objects.filter(status=Task.QUEUED, run_at__lte=now)
+                .select_for_update(skip_locked=True)
+                .order_by('run_at', 'id')
+                .values_list('id', flat=True)[:self.batch_size]
+            )
+            if not ids:
+                return []
+            Task.objects.filter(id__in=ids, status=Task.QUEUED).update(
+                status=Task.RUNNING, locked_by=self.name, locked_at=now, attempts=F('attempts') + 1,
+            )
+        return list(
+            Task.objects.filter(id__in=ids, status=Task.RUNNING, locked_by=self.name, locked_at=now).order_by('run_at', 'id')
+        )
+
+    def execute(self, task):
+        try:
+            get_task(task.name)(**task.kwargs)
+        except Exception as e:
+            self.failed(task, e)
+            return False
+
+        Task.objects.filter(pk=task.pk, locked_by=self.name).update(
+            status=Task.DONE, finished_at=timezone.now(), last_error='',
+        )
+        logger.info(f"Task {task.name} #{task.pk} done (attempt {task.attempts})")
+        return True
+
+    def failed(self, task, error):
+        message = ''.join(traceback.format_exception(error))
+        now = timezone.now()
+        tasks = Task.objects.filter(pk=task.pk, locked_by=self.name)
+        if isinstance(error, UnknownTask) or task.attempts >= task.max_attempts:
+            tasks.update(status=Task.FAILED, finished_at=now, last_error=message)
+            logger.error(f"Task {task.name} #{task.pk} failed after {task.attempts} attempts: {error}")
+            return
+        run_at = now + backoff_delay(task.attempts)
+        tasks.update(status=Task.QUEUED, run_at=run_at, locked_by='', locked_at=None, last_error=message)
+        logger.warning(f"Task {task.name} #{task.pk} attempt {task.attempts} failed, retrying at {run_at}: {error}")
+
+    def requeue_stale(self):
+        """Return tasks whose worker died mid-run to the queue (or fail them when out of attempts)."""
+        now = timezone.now()
+        stale = Task.objects.filter(status=Task.RUNNING, locked_at__lt=now - settings.TASK_QUEUE_LOCK_TIMEOUT)
+        message = 'Worker stopped while the task was running'
+        requeued = stale.filter(attempts__lt=F('max_attempts')).update(
+            status=Task.QUEUED, run_at=now, locked_by='', locked_at=None, last_error=message,
+        )
+        failed = stale.filter(attempts__gte=F('max_attempts')).update(
+            status=Task.FAILED, finished_at=now, last_error=message,
+        )
+        if requeued or failed:
+            logger.warning(f"Recovered stale tasks: {requeued} requeued, {failed} failed")
+
+    def run_tasks(self, queryset):
+        """Claim and run the queued tasks of `queryset` now, ignoring run_at (eager mode)."""
+        now = timezone.now()
+        ids = list(queryset.values_list('id', flat=True))
+        Task.objects.filter(id__in=ids, status=Task.QUEUED).update(
+            status=Task.RUNNING, locked_by=self.name, locked_at=now, attempts=F('attempts') + 1,
+        )
+        for task in Task.objects.filter(id__in=ids, status=Task.RUNNING, locked_by=self.name, locked_at=now):
+            self.execute(task)
+
+    def run_once(self):
+        """One poll: recover stale tasks, claim a batch and run it. Returns the number run."""
+        self.requeue_stale()
+        tasks = self.claim()
+        for task in tasks:
+            self.execute(task)
+        return len(tasks)
+
+    def run(self):
+        logger.info(f"Task worker {self.name} started")
+        while not self._stop.is_set():
+            close_old_connections()
+            try:
+                processed = self.run_once()
+            except Exception as e:
+                # e.g. database unavailable or, on SQLite, locked by another worker
+                logger.error(f"Task worker poll failed: {e}")
+                processed = 0
+            if not processed:
+                self._stop.wait(self.poll_interval)
+        logger.info(f"Task worker {self.name} stopped")
+
+    def stop(self):
+        self._stop.set()